@@ -2,29 +2,115 @@
 API路由定义
 """
 import os
-from typing import List
-from fastapi import APIRouter, HTTPException
-from fastapi.responses import JSONResponse
+import json
+import time
+import asyncio
+import tempfile
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import List, Optional, Dict, Any, AsyncIterator, Callable, Tuple
+from fastapi import APIRouter, Depends, FastAPI, HTTPException, Request, UploadFile, File, Form
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
+from starlette.background import BackgroundTask
 
-from models.knowledge_base import KnowledgeBase
+from models.knowledge_base import KnowledgeBase, preload_embedding_model
 from services.ollama_service import OllamaService
 from services.folder_watcher import FolderWatcher
+from services.ingest_scheduler import IngestScheduler, IngestQueueFullError
+from services.llm_scheduler import (LLMScheduler, LLMTicket, LLMQueueFullError, LLMQueueTimeoutError,
+                                    PRIORITY_CHAT, PRIORITY_QUESTION, PRIORITY_BATCH)
+from services.chat_sessions import ChatSessionStore
+from services.answer_cache import AnswerCache
+from services.context_packer import ContextPacker
+from services.bulk_upload import UploadBatch, is_archive
+from services.service_loader import ServiceLoader
 import config
 
 router = APIRouter()
 
-# 初始化服务
-kb = KnowledgeBase()
+if config.SERVICE_ROLE not in ("indexer", "query"):
+    raise ValueError(f"未知的进程角色: {config.SERVICE_ROLE}（应为 indexer 或 query）")
+READ_ONLY = config.SERVICE_ROLE == "query"  # 只读查询进程：不监控文件夹、不导入，从索引进程写入的存储中检索
+if READ_ONLY and config.VECTOR_STORE != "flat":
+    raise ValueError("只读查询进程需要flat向量存储后端（config.VECTOR_STORE = \"flat\"），ChromaDB不支持多个进程打开同一目录")
+
+# 初始化服务（知识库和文件夹监控在应用启动后由 service_loader 在后台加载，加载完成前为None）
+kb: Optional[KnowledgeBase] = None
+folder_watcher: Optional[FolderWatcher] = None
 ollama = OllamaService()
-folder_watcher = FolderWatcher(kb)  # 默认会自动启动监控
+llm_scheduler = LLMScheduler()  # 限制同时发往Ollama的请求数
+chat_sessions = ChatSessionStore()  # 多轮对话会话
+answer_cache = AnswerCache() if config.ANSWER_CACHE_ENABLED else None  # 语义回答缓存
+context_packer = ContextPacker()  # 合并、去重并按token预算裁剪检索结果
+ingest_scheduler = IngestScheduler()
+service_loader = ServiceLoader()
 
 # 创建上传目录
 os.makedirs(config.UPLOAD_DIR, exist_ok=True)
 
+if config.PRELOAD_EMBEDDING_MODEL:
+    preload_embedding_model()
+
+def _load_knowledge_base():
+    """打开向量库并加载嵌入模型"""
+    global kb
+    knowledge_base = KnowledgeBase(read_only=READ_ONLY)
+    if READ_ONLY and knowledge_base.mode == "simple":
+        raise Exception("简化模式的知识库只保存在进程内存中，不支持只读查询进程")
+    knowledge_base.progress_callback = ingest_scheduler.record_chunks
+    if answer_cache is not None:
+        knowledge_base.invalidation_callback = answer_cache.invalidate
+    kb = knowledge_base
+
+def _start_folder_watcher():
+    """启动文件夹监控（初始扫描作为后台导入任务执行，不等待完成）"""
+    global folder_watcher
+    folder_watcher = FolderWatcher(kb, scheduler=ingest_scheduler)
+
+service_loader.add_step("knowledge_base", _load_knowledge_base)
+if config.WARMUP_ENABLED:
+    service_loader.add_step("warm_up", lambda: kb.warm_up())
+if READ_ONLY:
+    service_loader.add_step("index_refresh", lambda: kb.start_refresh(config.INDEX_REFRESH_INTERVAL))
+else:
+    service_loader.add_step("folder_watcher", _start_folder_watcher)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """应用生命周期：启动时在后台加载知识库（不阻塞存活检查），关闭时停止监控并关闭Ollama连接池"""
+    ollama.start_health_checks()
+    if not READ_ONLY:
+        ingest_scheduler.start()
+    service_loader.start()
+    yield
+    if folder_watcher is not None and folder_watcher.is_running:
+        folder_watcher.stop_watching()
+    await ollama.close()
+
+def _require_indexer():
+    """写入类接口只由索引进程提供"""
+    if READ_ONLY:
+        raise HTTPException(status_code=403, detail="当前为只读查询进程，写入和文件夹监控请发送到索引进程")
+
+def _require_ready():
+    """依赖知识库的接口在服务加载完成前返回503"""
+    if not service_loader.ready:
+        detail = f"服务加载失败: {service_loader.error}" if service_loader.status == "failed" else "服务正在启动，请稍后重试"
+        raise HTTPException(status_code=503, detail=detail,
+                            headers={"Retry-After": str(config.STARTUP_RETRY_AFTER)})
+
 class QuestionRequest(BaseModel):
     question: str
     use_context: bool = True
+    use_cache: bool = True  # False时不读取也不写入语义回答缓存
+
+class BatchQuestionRequest(BaseModel):
+    questions: List[str]
+    use_context: bool = True
+    use_cache: bool = True
+    concurrency: Optional[int] = None  # 同时生成的回答数，默认 config.BATCH_QUESTION_CONCURRENCY
 
 class ChatMessage(BaseModel):
     role: str
@@ -33,10 +119,35 @@ class ChatMessage(BaseModel):
 class ChatRequest(BaseModel):
     messages: List[ChatMessage]
     use_context: bool = True
+    session_id: Optional[str] = None  # 上一轮返回的会话ID，用于复用已处理的对话上下文
+
+class IngestJobRequest(BaseModel):
+    action: str  # ingest / update / delete / rescan
+    path: Optional[str] = None  # 相对监控目录的文件路径（ingest / update）
+    document_id: Optional[str] = None  # 要删除的文档ID（delete）
+    delete_file: bool = False  # 同时删除监控目录中的文件（delete，来自监控目录的文档必须指定）
+
+class DeleteDocumentsRequest(BaseModel):
+    document_ids: List[str]
+    delete_files: bool = False  # 同时删除监控目录中的文件，否则来自监控目录的文档不删除
+
+def _llm_busy_error(e: Exception) -> HTTPException:
+    """大模型队列已满返回429，排队超时返回503"""
+    status_code = 429 if isinstance(e, LLMQueueFullError) else 503
+    return HTTPException(status_code=status_code, detail=str(e),
+                         headers={"Retry-After": str(config.LLM_RETRY_AFTER)})
+
+def _resolve_watch_path(path: str) -> Path:
+    """将相对路径解析为监控目录内的文件路径，拒绝目录外的路径"""
+    root = folder_watcher.watch_folder.resolve()
+    resolved = (root / path).resolve()
+    if resolved != root and root not in resolved.parents:
+        raise HTTPException(status_code=400, detail="路径必须位于监控目录内")
+    return folder_watcher.watch_folder / resolved.relative_to(root)
 
 # 文件夹监控相关接口
 
-@router.post("/folder-watch/start")
+@router.post("/folder-watch/start", dependencies=[Depends(_require_indexer), Depends(_require_ready)])
 async def start_folder_watching():
     """启动文件夹监控"""
     try:
@@ -49,7 +160,7 @@ async def start_folder_watching():
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"启动监控失败: {str(e)}")
 
-@router.post("/folder-watch/stop")
+@router.post("/folder-watch/stop", dependencies=[Depends(_require_indexer), Depends(_require_ready)])
 async def stop_folder_watching():
     """停止文件夹监控"""
     try:
@@ -61,7 +172,7 @@ async def stop_folder_watching():
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"停止监控失败: {str(e)}")
 
-@router.get("/folder-watch/status")
+@router.get("/folder-watch/status", dependencies=[Depends(_require_indexer), Depends(_require_ready)])
 async def get_folder_watch_status():
     """获取文件夹监控状态"""
     try:
@@ -73,43 +184,404 @@ async def get_folder_watch_status():
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"获取状态失败: {str(e)}")
 
-@router.post("/folder-watch/rescan")
+@router.post("/folder-watch/rescan", dependencies=[Depends(_require_indexer), Depends(_require_ready)])
 async def force_rescan_folder():
-    """强制重新扫描文件夹"""
+    """强制重新扫描文件夹（后台执行，立即返回任务ID）"""
     try:
-        folder_watcher.force_rescan()
+        job = folder_watcher.schedule_rescan()
         return JSONResponse({
             "success": True,
-            "message": "强制重新扫描完成"
+            "message": "强制重新扫描任务已提交",
+            "job_id": job.id
         })
+    except IngestQueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"重新扫描失败: {str(e)}")
 
-@router.post("/question")
+# 导入任务接口
+
+@router.post("/ingest/jobs", dependencies=[Depends(_require_indexer), Depends(_require_ready)])
+async def submit_ingest_job(request: IngestJobRequest):
+    """提交导入任务"""
+    try:
+        if request.action == "rescan":
+            job = folder_watcher.schedule_rescan()
+        elif request.action in ("ingest", "update"):
+            if not request.path:
+                raise HTTPException(status_code=400, detail="缺少path参数")
+            job = folder_watcher.schedule_sync(_resolve_watch_path(request.path))
+        elif request.action == "delete":
+            if not request.document_id:
+                raise HTTPException(status_code=400, detail="缺少document_id参数")
+            document_id = request.document_id
+            job = ingest_scheduler.submit("delete", f"document:{document_id}",
+                                          lambda: folder_watcher.delete_documents([document_id], request.delete_file))
+        else:
+            raise HTTPException(status_code=400, detail=f"不支持的任务类型: {request.action}")
+        
+        return JSONResponse({
+            "success": True,
+            "job": job.to_dict()
+        })
+    except HTTPException:
+        raise
+    except IngestQueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"提交导入任务失败: {str(e)}")
+
+@router.get("/ingest/jobs", dependencies=[Depends(_require_indexer)])
+async def list_ingest_jobs(status: Optional[str] = None, limit: int = 100):
+    """获取导入任务列表和队列状态"""
+    try:
+        jobs = ingest_scheduler.list_jobs(status, limit)
+        return JSONResponse({
+            "success": True,
+            "stats": ingest_scheduler.get_stats(),
+            "jobs": [job.to_dict() for job in jobs]
+        })
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"获取导入任务失败: {str(e)}")
+
+@router.get("/ingest/jobs/{job_id}", dependencies=[Depends(_require_indexer)])
+async def get_ingest_job(job_id: str):
+    """获取导入任务进度"""
+    job = ingest_scheduler.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    return JSONResponse({
+        "success": True,
+        "job": job.to_dict()
+    })
+
+def _retrieve(query: str, embedding: Optional[List[float]] = None) -> List[Dict[str, Any]]:
+    """检索问题相关的分块并组装为发送给大模型的上下文"""
+    return context_packer.pack(kb.search(query, config.TOP_K_RESULTS, embedding))
+
+async def _search_context(query: str, embedding: Optional[List[float]] = None) -> List[Dict[str, Any]]:
+    """检索并组装上下文（在线程池中执行，不阻塞事件循环）"""
+    return await run_in_threadpool(_retrieve, query, embedding)
+
+async def _lookup_answer(request: QuestionRequest) -> Tuple[Optional[List[float]], Optional[Dict[str, Any]]]:
+    """查询语义回答缓存，返回 (问题嵌入, 缓存的回答)
+    
+    只缓存基于知识库的回答；不使用缓存（未启用、不检索、请求跳过或简化模式）时问题嵌入为None。
+    """
+    if answer_cache is None or not request.use_context:
+        return None, None
+    if not request.use_cache:
+        answer_cache.record_bypass()
+        return None, None
+    embedding = await run_in_threadpool(kb.embed_query, request.question)
+    if embedding is None:
+        return None, None
+    return embedding, answer_cache.lookup(embedding)
+
+def _answer_saver(question: str, embedding: Optional[List[float]], generation: int,
+                  search_results: List[Dict[str, Any]]) -> Optional[Callable[[str], None]]:
+    """返回将生成的回答写入语义回答缓存的函数，不使用缓存时返回None
+    
+    generation 为检索前读取的失效代数，检索或生成期间有分块失效时回答不写入缓存。
+    """
+    if embedding is None:
+        return None
+    chunk_ids = [chunk_id for result in search_results for chunk_id in result.get('chunk_ids', [])]
+    
+    def save(answer: str):
+        answer_cache.put(question, embedding, answer, chunk_ids, generation)
+    return save
+
+@router.post("/question", dependencies=[Depends(_require_ready)])
 async def ask_question(request: QuestionRequest):
     """问答接口"""
     try:
+        embedding, cached = await _lookup_answer(request)
+        if cached is not None:
+            return JSONResponse({
+                "success": True,
+                "question": request.question,
+                "answer": cached["answer"],
+                "context_used": True,
+                "sources": cached["sources"],
+                "cached": True,
+                "cache_similarity": cached["similarity"]
+            })
+        
         context = []
+        save_answer = None
         if request.use_context:
-            # 搜索相关文档
-            search_results = kb.search(request.question, config.TOP_K_RESULTS)
+            # 搜索相关文档（向量编码和检索在线程池中执行，不阻塞事件循环）
+            generation = answer_cache.generation if embedding is not None else 0
+            search_results = await _search_context(request.question, embedding)
             context = [result['content'] for result in search_results]
+            save_answer = _answer_saver(request.question, embedding, generation, search_results)
         
         # 生成回答
-        answer = ollama.generate_response(request.question, context)
+        async with llm_scheduler.slot(PRIORITY_QUESTION):
+            answer = await ollama.generate_response(request.question, context)
+        
+        if save_answer is not None:
+            save_answer(answer)
         
         return JSONResponse({
             "success": True,
             "question": request.question,
             "answer": answer,
             "context_used": len(context) > 0,
-            "sources": len(context)
+            "sources": len(context),
+            "cached": False
         })
         
+    except (LLMQueueFullError, LLMQueueTimeoutError) as e:
+        raise _llm_busy_error(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"问答失败: {str(e)}")
 
-@router.post("/chat")
+def _sse(event: str, data: Dict[str, Any]) -> str:
+    """格式化一条Server-Sent Events消息"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def _stream_answer(search_results: List[Dict[str, Any]], tokens: AsyncIterator[str], started: float,
+                   ticket: LLMTicket, session_id: Optional[str] = None,
+                   final: Optional[Dict[str, Any]] = None,
+                   on_done: Optional[Callable[[str], None]] = None) -> StreamingResponse:
+    """以SSE流式返回回答
+    
+    事件顺序: sources（检索结果）-> token（逐段回答）-> done（完整回答和耗时），
+    出错时发送 error。客户端断开连接时生成器被取消，到Ollama的请求随之关闭。
+    大模型名额在生成结束时归还；响应未开始发送连接就已断开时，由后台任务归还。
+    session_id 随 sources 事件返回；final 为生成结束后由生成器填写的统计信息，随 done 事件返回；
+    on_done 在完整生成后以完整回答调用（中途取消或出错时不调用）。
+    """
+    async def release():
+        # 异步函数在事件循环中执行；同步函数会被放到线程池，而调度器只能在事件循环中使用
+        ticket.release()
+    
+    async def events():
+        yield _sse("sources", {
+            **({"session_id": session_id} if session_id else {}),
+            "context_used": len(search_results) > 0,
+            "sources": len(search_results),
+            "results": [
+                {
+                    "document_id": result['metadata'].get('document_id'),
+                    "filename": result['metadata'].get('filename'),
+                    "chunk_index": result['metadata'].get('chunk_index'),
+                    "similarity": result.get('similarity')
+                }
+                for result in search_results
+            ]
+        })
+        
+        parts = []
+        first_token_seconds = None
+        try:
+            async for token in tokens:
+                if first_token_seconds is None:
+                    first_token_seconds = round(time.perf_counter() - started, 3)
+                parts.append(token)
+                yield _sse("token", {"token": token})
+        except Exception as e:
+            yield _sse("error", {"detail": str(e)})
+            return
+        finally:
+            # 先归还名额：客户端断开时 aclose 会被取消，之后的语句不再执行
+            ticket.release()
+            await tokens.aclose()
+        
+        answer = "".join(parts)
+        if on_done is not None:
+            on_done(answer)
+        yield _sse("done", {
+            **({"session_id": session_id} if session_id else {}),
+            **(final or {}),
+            "answer": answer,
+            "first_token_seconds": first_token_seconds,
+            "total_seconds": round(time.perf_counter() - started, 3)
+        })
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        background=BackgroundTask(release)
+    )
+
+def _stream_cached(cached: Dict[str, Any], started: float) -> StreamingResponse:
+    """以SSE返回缓存的回答，事件格式与 _stream_answer 相同，整段回答作为一个token发送"""
+    async def events():
+        yield _sse("sources", {"context_used": True, "sources": cached["sources"], "results": [], "cached": True})
+        yield _sse("token", {"token": cached["answer"]})
+        elapsed = round(time.perf_counter() - started, 3)
+        yield _sse("done", {
+            "answer": cached["answer"],
+            "cached": True,
+            "cache_similarity": cached["similarity"],
+            "first_token_seconds": elapsed,
+            "total_seconds": elapsed
+        })
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.post("/question/stream", dependencies=[Depends(_require_ready)])
+async def ask_question_stream(request: QuestionRequest):
+    """流式问答接口（SSE）"""
+    started = time.perf_counter()
+    try:
+        embedding, cached = await _lookup_answer(request)
+        if cached is not None:
+            return _stream_cached(cached, started)
+        generation = answer_cache.generation if embedding is not None else 0
+        search_results = []
+        if request.use_context:
+            search_results = await _search_context(request.question, embedding)
+        ticket = await llm_scheduler.acquire(PRIORITY_QUESTION)
+    except (LLMQueueFullError, LLMQueueTimeoutError) as e:
+        raise _llm_busy_error(e)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"问答失败: {str(e)}")
+    
+    context = [result['content'] for result in search_results]
+    save_answer = _answer_saver(request.question, embedding, generation, search_results)
+    return _stream_answer(search_results, ollama.stream_response(request.question, context), started, ticket,
+                          on_done=save_answer)
+
+def _prepare_batch(request: BatchQuestionRequest) -> Tuple[Dict[int, Dict[str, Any]], Dict[int, List[str]],
+                                                          Dict[int, Optional[Callable[[str], None]]]]:
+    """批量问答的检索阶段，返回 (缓存命中的回答, 各问题的上下文, 各问题的缓存写入函数)，均以问题序号为键
+    
+    所有问题一次编码，未命中回答缓存的问题一次向量库查询。
+    """
+    questions = request.questions
+    contexts: Dict[int, List[str]] = {i: [] for i in range(len(questions))}
+    savers: Dict[int, Optional[Callable[[str], None]]] = {i: None for i in range(len(questions))}
+    cached: Dict[int, Dict[str, Any]] = {}
+    if not request.use_context:
+        return cached, contexts, savers
+    
+    embeddings = None
+    if answer_cache is not None:
+        if request.use_cache:
+            embeddings = kb.embed_queries(questions)
+            for i, embedding in enumerate(embeddings or []):
+                hit = answer_cache.lookup(embedding)
+                if hit is not None:
+                    cached[i] = hit
+        else:
+            for _ in questions:
+                answer_cache.record_bypass()
+    
+    pending = [i for i in range(len(questions)) if i not in cached]
+    if not pending:
+        return cached, contexts, savers
+    generation = answer_cache.generation if embeddings is not None else 0
+    pending_embeddings = [embeddings[i] for i in pending] if embeddings is not None else None
+    all_results = kb.search_many([questions[i] for i in pending], config.TOP_K_RESULTS, pending_embeddings)
+    for i, search_results in zip(pending, all_results):
+        search_results = context_packer.pack(search_results)
+        contexts[i] = [result['content'] for result in search_results]
+        savers[i] = _answer_saver(questions[i], embeddings[i] if embeddings is not None else None,
+                                  generation, search_results)
+    return cached, contexts, savers
+
+def _ndjson(data: Dict[str, Any]) -> str:
+    """格式化一行NDJSON"""
+    return json.dumps(data, ensure_ascii=False) + "\n"
+
+@router.post("/question/batch", dependencies=[Depends(_require_ready)])
+async def ask_question_batch(request: BatchQuestionRequest):
+    """批量问答接口（NDJSON）
+    
+    所有问题一次编码、一次向量库查询，回答以批量优先级、受限的并发数生成，
+    每个问题完成后立即返回一行（index为问题在请求中的序号，缓存命中的最先返回），
+    最后一行为汇总。单个问题生成失败时该行带 error，不影响其余问题。
+    """
+    questions = request.questions
+    if not questions:
+        raise HTTPException(status_code=400, detail="问题列表不能为空")
+    if len(questions) > config.BATCH_QUESTION_MAX:
+        raise HTTPException(status_code=400, detail=f"单次最多提交 {config.BATCH_QUESTION_MAX} 个问题")
+    concurrency = config.BATCH_QUESTION_CONCURRENCY if request.concurrency is None else request.concurrency
+    if concurrency < 1:
+        raise HTTPException(status_code=400, detail="concurrency必须为正整数")
+    # 至少留出一个名额给交互式请求，否则问答和对话要排在整批生成之后，等待超时返回503；
+    # 超过名额数也只会占满共享的等待队列，使交互式请求被拒绝
+    concurrency = min(concurrency, max(1, llm_scheduler.max_concurrency - 1))
+
+    started = time.perf_counter()
+    try:
+        cached, contexts, savers = await run_in_threadpool(_prepare_batch, request)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"批量问答失败: {str(e)}")
+    
+    async def answer(index: int, semaphore: asyncio.Semaphore) -> Dict[str, Any]:
+        question = questions[index]
+        async with semaphore:
+            item_started = time.perf_counter()
+            try:
+                async with llm_scheduler.slot(PRIORITY_BATCH):
+                    answer_text = await ollama.generate_response(question, contexts[index])
+            except Exception as e:
+                return {"index": index, "question": question, "error": str(e)}
+        if savers[index] is not None:
+            try:
+                savers[index](answer_text)
+            except Exception as e:
+                # 写入缓存失败不影响已生成的回答
+                print(f"⚠️ 保存回答缓存失败: {e}")
+        return {
+            "index": index,
+            "question": question,
+            "answer": answer_text,
+            "context_used": len(contexts[index]) > 0,
+            "sources": len(contexts[index]),
+            "cached": False,
+            "seconds": round(time.perf_counter() - item_started, 3)
+        }
+    
+    async def lines():
+        semaphore = asyncio.Semaphore(concurrency)
+        tasks = [asyncio.create_task(answer(i, semaphore)) for i in range(len(questions)) if i not in cached]
+        failed = 0
+        try:
+            for index, hit in sorted(cached.items()):
+                yield _ndjson({
+                    "index": index,
+                    "question": questions[index],
+                    "answer": hit["answer"],
+                    "context_used": True,
+                    "sources": hit["sources"],
+                    "cached": True,
+                    "cache_similarity": hit["similarity"]
+                })
+            for task in asyncio.as_completed(tasks):
+                line = await task
+                failed += "error" in line
+                yield _ndjson(line)
+            yield _ndjson({"summary": {
+                "total": len(questions),
+                "answered": len(questions) - len(cached) - failed,
+                "cached": len(cached),
+                "failed": failed,
+                "seconds": round(time.perf_counter() - started, 3)
+            }})
+        finally:
+            # 客户端中途断开时取消尚未完成的生成
+            for task in tasks:
+                task.cancel()
+    
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+def _user_turns(messages: List[Dict[str, str]]) -> int:
+    """对话中的用户消息数"""
+    return sum(1 for msg in messages if msg["role"] == "user")
+
+@router.post("/chat", dependencies=[Depends(_require_ready)])
 async def chat(request: ChatRequest):
     """多轮对话接口"""
     try:
@@ -117,57 +589,179 @@ async def chat(request: ChatRequest):
         if request.use_context and request.messages:
             # 使用最后一条消息搜索上下文
             last_message = request.messages[-1].content
-            search_results = kb.search(last_message, config.TOP_K_RESULTS)
+            search_results = await _search_context(last_message)
             context = [result['content'] for result in search_results]
         
         # 转换消息格式
         messages = [{"role": msg.role, "content": msg.content} for msg in request.messages]
         
+        # 复用会话上下文时，之前轮次已发送过的参考信息不再重复发送
+        session = chat_sessions.resolve(request.session_id, _user_turns(messages))
+        
         # 生成回答
-        answer = ollama.chat_with_context(messages, context)
+        async with llm_scheduler.slot(PRIORITY_CHAT):
+            result = await ollama.chat_with_session(session, messages, session.new_context(context))
         
         return JSONResponse({
             "success": True,
-            "answer": answer,
+            "session_id": session.id,
+            "answer": result["answer"],
             "context_used": len(context) > 0,
-            "sources": len(context)
+            "sources": len(context),
+            "prompt_eval_count": result["prompt_eval_count"],
+            "prompt_eval_ms": result["prompt_eval_ms"]
         })
         
+    except (LLMQueueFullError, LLMQueueTimeoutError) as e:
+        raise _llm_busy_error(e)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"对话失败: {str(e)}")
+
+@router.post("/chat/stream", dependencies=[Depends(_require_ready)])
+async def chat_stream(request: ChatRequest):
+    """流式多轮对话接口（SSE）"""
+    started = time.perf_counter()
+    try:
+        search_results = []
+        if request.use_context and request.messages:
+            # 使用最后一条消息搜索上下文
+            search_results = await _search_context(request.messages[-1].content)
+        ticket = await llm_scheduler.acquire(PRIORITY_CHAT)
+    except (LLMQueueFullError, LLMQueueTimeoutError) as e:
+        raise _llm_busy_error(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"对话失败: {str(e)}")
+    
+    messages = [{"role": msg.role, "content": msg.content} for msg in request.messages]
+    session = chat_sessions.resolve(request.session_id, _user_turns(messages))
+    context = session.new_context([result['content'] for result in search_results])
+    final: Dict[str, Any] = {}
+    tokens = ollama.stream_chat(messages, context, session=session, final=final)
+    return _stream_answer(search_results, tokens, started, ticket, session.id, final)
 
-@router.get("/documents")
-async def list_documents():
-    """获取文档列表"""
+@router.get("/documents", dependencies=[Depends(_require_ready)])
+async def list_documents(offset: int = 0, limit: int = config.DOCUMENT_PAGE_SIZE, filename: Optional[str] = None):
+    """获取文档列表（分页，filename按文件名子串过滤）"""
+    if offset < 0 or not 1 <= limit <= config.DOCUMENT_PAGE_MAX:
+        raise HTTPException(status_code=400, detail=f"offset不能为负数，limit范围为 1~{config.DOCUMENT_PAGE_MAX}")
     try:
-        documents = kb.list_documents()
+        documents = await run_in_threadpool(kb.list_documents, offset, limit, filename)
+        total = await run_in_threadpool(kb.count_documents, filename)
         return JSONResponse({
             "success": True,
+            "total": total,
+            "offset": offset,
+            "limit": limit,
             "documents": documents
         })
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"获取文档列表失败: {str(e)}")
 
-@router.delete("/documents/{document_id}")
-async def delete_document(document_id: str):
-    """删除文档"""
+def _upload_target(folder: Optional[str]) -> Path:
+    """上传文件的目标目录（监控目录或其中的子目录）"""
+    return _resolve_watch_path(folder) if folder else folder_watcher.watch_folder
+
+def _commit_upload(batch: UploadBatch, target: Path) -> Dict[str, Any]:
+    """将暂存的文件移入监控目录，整批提交为一个导入任务（队列满时等待）"""
+    files = [{"path": (target / path).relative_to(folder_watcher.watch_folder).as_posix(), "size": size}
+             for path, size in batch.files.items()]
+    job = None
+    if batch.files:
+        paths = batch.commit(target)
+        job = folder_watcher.schedule_import(paths, f"upload:{batch.staging.name}", block=True)
+    else:
+        batch.discard()
+    return {
+        "files": files,
+        "skipped": batch.skipped,
+        "job": job.to_dict() if job is not None else None
+    }
+
+@router.post("/documents/upload", dependencies=[Depends(_require_indexer), Depends(_require_ready)])
+async def upload_documents(files: List[UploadFile] = File(...), folder: Optional[str] = Form(None)):
+    """批量上传文档（可以包含zip/tar压缩包），文件移入监控目录后由一个导入任务批量处理"""
+    target = _upload_target(folder)
+    if len(files) > config.UPLOAD_MAX_FILES:
+        raise HTTPException(status_code=400, detail=f"单次最多上传 {config.UPLOAD_MAX_FILES} 个文件")
+    batch = UploadBatch()
+    try:
+        for upload in files:
+            await run_in_threadpool(batch.add, upload.filename or "", upload.file)
+        result = await run_in_threadpool(_commit_upload, batch, target)
+        return JSONResponse({"success": True, **result})
+    except Exception as e:
+        batch.discard()
+        raise HTTPException(status_code=500, detail=f"上传失败: {str(e)}")
+
+@router.post("/documents/upload/archive", dependencies=[Depends(_require_indexer), Depends(_require_ready)])
+async def upload_archive(request: Request, filename: str, folder: Optional[str] = None):
+    """流式上传一个压缩包（请求体为 tar / tar.gz / zip 的原始字节），适合大批量迁移"""
+    if not is_archive(filename):
+        raise HTTPException(status_code=400, detail="filename必须为 .zip / .tar / .tar.gz 等压缩包文件名")
+    target = _upload_target(folder)
+    batch = UploadBatch()
+    try:
+        # 请求体分块写入暂存目录中的临时文件，内存占用与压缩包大小无关
+        with tempfile.TemporaryFile(dir=batch.staging) as spool:
+            buffer = bytearray()
+            async for chunk in request.stream():
+                buffer += chunk
+                if len(buffer) >= 1024 * 1024:
+                    await run_in_threadpool(spool.write, bytes(buffer))
+                    buffer.clear()
+            await run_in_threadpool(spool.write, bytes(buffer))
+            spool.seek(0)
+            await run_in_threadpool(batch.add_archive, filename, spool)
+        result = await run_in_threadpool(_commit_upload, batch, target)
+        return JSONResponse({"success": True, **result})
+    except Exception as e:
+        batch.discard()
+        raise HTTPException(status_code=500, detail=f"上传失败: {str(e)}")
+
+@router.post("/documents/delete", dependencies=[Depends(_require_indexer), Depends(_require_ready)])
+async def delete_documents(request: DeleteDocumentsRequest):
+    """批量删除文档"""
+    if len(request.document_ids) > config.DELETE_MAX_DOCUMENTS:
+        raise HTTPException(status_code=400, detail=f"单次最多删除 {config.DELETE_MAX_DOCUMENTS} 个文档")
     try:
-        success = kb.delete_document(document_id)
-        if success:
+        # 经由文件夹监控删除：来自监控目录的文档需同时删除文件和文件记录，避免被重新导入
+        result = await run_in_threadpool(folder_watcher.delete_documents, request.document_ids, request.delete_files)
+        handled = set(result["deleted"]) | set(result["watched"])
+        return JSONResponse({
+            "success": True,
+            "deleted": result["deleted"],
+            "watched": result["watched"],
+            "not_found": [doc_id for doc_id in dict.fromkeys(request.document_ids) if doc_id not in handled]
+        })
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"批量删除文档失败: {str(e)}")
+
+@router.delete("/documents/{document_id}", dependencies=[Depends(_require_indexer), Depends(_require_ready)])
+async def delete_document(document_id: str, delete_file: bool = False):
+    """删除文档（delete_file为True时同时删除监控目录中的文件）"""
+    try:
+        result = await run_in_threadpool(folder_watcher.delete_documents, [document_id], delete_file)
+        if result["deleted"]:
             return JSONResponse({
                 "success": True,
                 "message": "文档删除成功"
             })
+        elif result["watched"]:
+            raise HTTPException(status_code=409,
+                                detail="文档来自监控文件夹中的文件，只删除文档会在文件修改或重新扫描时重新导入；"
+                                       "请删除该文件，或使用 delete_file=true 同时删除文件")
         else:
             raise HTTPException(status_code=404, detail="文档不存在")
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"删除文档失败: {str(e)}")
 
-@router.get("/search")
+@router.get("/search", dependencies=[Depends(_require_ready)])
 async def search_documents(q: str, limit: int = 5):
     """搜索文档"""
     try:
-        results = kb.search(q, limit)
+        results = await run_in_threadpool(kb.search, q, limit)
         return JSONResponse({
             "success": True,
             "query": q,
@@ -176,7 +770,7 @@ async def search_documents(q: str, limit: int = 5):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"搜索失败: {str(e)}")
 
-@router.get("/stats")
+@router.get("/stats", dependencies=[Depends(_require_ready)])
 async def get_stats():
     """获取知识库统计信息"""
     try:
@@ -188,22 +782,36 @@ async def get_stats():
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"获取统计信息失败: {str(e)}")
 
+@router.get("/llm/stats")
+async def get_llm_stats():
+    """获取大模型请求调度统计（并发、排队深度、排队耗时）和Ollama节点状态"""
+    return JSONResponse({
+        "success": True,
+        "stats": llm_scheduler.get_stats(),
+        "ollama": ollama.get_stats(),
+        "chat_sessions": chat_sessions.get_stats(),
+        "answer_cache": answer_cache.get_stats() if answer_cache is not None else None,
+        "context": context_packer.get_stats()
+    })
+
 @router.get("/health")
 async def health_check():
-    """健康检查"""
-    try:
-        # 检查Ollama模型
-        model_available = ollama.check_model_availability()
-        
-        return JSONResponse({
-            "success": True,
-            "status": "healthy",
-            "ollama_available": model_available,
-            "model": config.OLLAMA_MODEL
-        })
-    except Exception as e:
-        return JSONResponse({
-            "success": False,
-            "status": "unhealthy",
-            "error": str(e)
-        }) 
\ No newline at end of file
+    """存活检查：进程启动后立即可用，不等待知识库加载，也不同步探测Ollama（节点状态来自后台健康检查）"""
+    healthy_backends = ollama.pool.healthy_count()
+    return JSONResponse({
+        "success": True,
+        "status": "healthy",
+        "role": config.SERVICE_ROLE,
+        "ready": service_loader.ready,
+        "uptime_seconds": round(time.time() - service_loader.started_at, 3),
+        "ollama_available": healthy_backends > 0,
+        "ollama_backends": {"healthy": healthy_backends, "total": len(ollama.pool.backends)},
+        "model": config.OLLAMA_MODEL
+    })
+
+@router.get("/ready")
+async def readiness_check():
+    """就绪检查：知识库加载和预热完成后返回200，之前（或加载失败时）返回503"""
+    status = service_loader.get_status()
+    return JSONResponse({"success": service_loader.ready, **status},
+                        status_code=200 if service_loader.ready else 503) 
\ No newline at end of file
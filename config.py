@@ -1,23 +1,109 @@
 """
 配置文件 - 私人知识库系统
 """
+import os
 
 # Ollama配置
 OLLAMA_HOST = "http://localhost:11434"
 OLLAMA_MODEL = "deepseek-r1:1.5b"
+OLLAMA_CONNECT_TIMEOUT = 5  # 连接超时（秒）
+OLLAMA_READ_TIMEOUT = 120  # 读取超时（秒），生成较长回答时需要足够长
+OLLAMA_MAX_CONNECTIONS = 10  # 每个节点的连接池大小（长连接复用）
+OLLAMA_HOSTS = [OLLAMA_HOST]  # Ollama节点列表，请求发往未完成请求数最少的健康节点
+OLLAMA_HEALTH_INTERVAL = 15  # 节点健康检查间隔（秒）
+OLLAMA_EJECT_FAILURES = 3  # 连续失败多少次后摘除节点，健康检查通过后恢复
+OLLAMA_HEDGE_AFTER = None  # 非流式请求超过该秒数未返回时向另一节点发送对冲请求，None 表示不对冲
+OLLAMA_KEEP_ALIVE = "30m"  # 请求结束后模型保持加载的时间
+
+# 多轮对话会话配置（保存Ollama返回的上下文，后续轮次只发送新消息）
+CHAT_SESSION_MAX = 1000  # 最多保存的会话数（LRU淘汰）
+CHAT_SESSION_TTL = 1800  # 会话闲置过期时间（秒）
+
+# 大模型请求准入控制
+LLM_MAX_CONCURRENCY = 2  # 同时发往Ollama的请求数
+LLM_QUEUE_SIZE = 32  # 等待队列上限，超出时返回429
+LLM_QUEUE_TIMEOUT = 30  # 排队截止时间（秒），超时返回503
+LLM_RETRY_AFTER = 2  # 429/503响应中建议的重试间隔（秒）
+LLM_WAIT_SAMPLES = 1000  # 统计排队耗时分位数的样本数
+BATCH_QUESTION_MAX = 500  # 批量问答单次请求的问题数上限
+BATCH_QUESTION_CONCURRENCY = 2  # 批量问答同时生成的回答数（最多为LLM_MAX_CONCURRENCY - 1，留出名额给交互式请求）
 
 # 向量数据库配置
+VECTOR_STORE = "chroma"  # 向量存储后端: chroma / flat（内存映射的平铺矩阵，暴力检索）
 CHROMA_DB_PATH = "./chroma_db"
+FLAT_INDEX_PATH = "./flat_index"  # flat后端的存储目录（vectors.npy + 元数据表）
+FLAT_INDEX_QUANTIZE = False  # flat后端新建索引时是否将向量量化为int8（占用为float32的1/4）
+FLAT_INDEX_BLOCK_ROWS = 4096  # flat后端检索时每次计算点积的行数（int8索引需要逐块转换为float32）
+DOCUMENT_REGISTRY_PATH = "./document_registry.sqlite3"  # 文档登记表（与向量库不一致时启动时自动重建）
+DOCUMENT_PAGE_SIZE = 100  # 文档列表接口默认每页数量
+DOCUMENT_PAGE_MAX = 1000  # 文档列表接口每页数量上限
+DELETE_MAX_DOCUMENTS = 10000  # 批量删除接口单次最多删除的文档数
 EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+EMBEDDING_BATCH_SIZE = 64  # 每批编码/写入的分块数量
+
+# 嵌入缓存配置（按 模型+分块文本 哈希缓存向量，未变化的分块不再重复编码）
+EMBEDDING_CACHE_ENABLED = True
+EMBEDDING_CACHE_PATH = "./embedding_cache.sqlite3"
+EMBEDDING_CACHE_MAX_ENTRIES = 200000  # LRU淘汰的容量上限（条）
 
 # 文档处理配置
 UPLOAD_DIR = "./uploads"
-MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB
+UPLOAD_STAGING_DIR = "./upload_staging"  # 上传文件的暂存目录（需与监控目录在同一文件系统，以便原子移入）
+UPLOAD_MAX_FILES = 10000  # 批量上传单次最多接收的文件数（含压缩包中的文件）
+MAX_FILE_SIZE = None  # 单文件大小上限（字节），None 表示不限制；文本按块流式读取，内存占用与文件大小无关
+CHUNK_SIZE = 1000  # 分块长度上限（字符）
+CHUNK_OVERLAP = 200  # 相邻分块重叠长度（字符），不超过分块长度的一半
+CHUNK_READ_SIZE = 1024 * 1024  # 分块时每次从内存映射中解码的字节数
+STREAMING_EXTRACT_THRESHOLD = 32 * 1024 * 1024  # 达到该大小的文件边读取边编码写入，不整体分块
 SUPPORTED_EXTENSIONS = ['.txt']
+WATCHER_STATE_PATH = "./watcher_state.sqlite3"  # 文件夹监控状态（文件 -> 大小/修改时间/哈希/文档ID）
+WATCHER_BACKEND = "auto"  # 监控方式: auto（优先inotify）/ inotify / polling
+WATCHER_DEBOUNCE_SECONDS = 0.5  # inotify事件合并窗口（秒）
+WATCHER_DEBOUNCE_MAX_WAIT = 10  # 持续变化的文件从第一次事件起最多等待的时间（秒），之后即使仍在写入也处理一次
+WATCHER_HASH_WORKERS = 4  # 并行计算文件哈希的线程数
+
+# 导入任务配置
+INGEST_WORKERS = 2  # 后台导入工作线程数
+INGEST_QUEUE_SIZE = 1000  # 排队任务上限，超出时提交接口返回429
+INGEST_JOB_HISTORY = 500  # 保留的任务记录数
+INGEST_PROCESS_WORKERS = 4  # 大批量导入时提取和分块的进程数
+INGEST_MAX_PENDING = 64  # 大批量导入时同时处理中的文件上限（背压）
+INGEST_PARALLEL_THRESHOLD = 32  # 一次导入的文件数达到该值时使用进程池
+INGEST_CHECKPOINT_FILES = 1000  # 批量导入时每处理多少个文件保存一次进度
 
 # 检索配置
 TOP_K_RESULTS = 5
-MAX_CONTEXT_LENGTH = 2000
+MAX_CONTEXT_LENGTH = 2000  # 发送给大模型的参考内容token预算（中文按1字1个token估算）
+CONTEXT_MMR_LAMBDA = 0.7  # MMR中相关度的权重，越小越偏向选择与已选内容不同的片段
+CONTEXT_DUPLICATE_THRESHOLD = 0.8  # 与已选片段的相似度（字符二元组Jaccard）达到该值时丢弃
+CONTEXT_MIN_PIECE_TOKENS = 50  # 剩余预算少于该值时不再截断加入片段
+QUERY_ENCODE_WINDOW_MS = 5  # 合并并发查询编码的等待窗口（毫秒），0 表示不合并
+QUERY_ENCODE_MAX_BATCH = 32  # 每批合并编码的查询数上限
+QUERY_EMBEDDING_CACHE_SIZE = 10000  # 查询向量LRU缓存容量（条）
+SEARCH_LATENCY_SAMPLES = 1000  # 统计检索耗时分位数的样本数
+
+# 混合检索配置（BM25关键词检索与向量检索按倒数排名融合）
+HYBRID_SEARCH_ENABLED = True
+LEXICAL_INDEX_PATH = "./lexical_index.sqlite3"  # 关键词倒排索引（与向量库不一致时启动时自动重建）
+HYBRID_CANDIDATES = 20  # 每路检索参与融合的候选数
+HYBRID_RRF_K = 60  # 倒数排名融合常数，越大排名靠后的结果影响越大
+
+# 语义回答缓存配置（相似问题直接返回已生成的回答）
+ANSWER_CACHE_ENABLED = True
+ANSWER_CACHE_THRESHOLD = 0.95  # 与已缓存问题的余弦相似度达到该值视为同一问题
+ANSWER_CACHE_MAX_ENTRIES = 1000  # LRU淘汰的容量上限（条）
+ANSWER_CACHE_TTL = 24 * 3600  # 回答缓存有效期（秒），新增文档后旧回答最迟在此之后刷新
+
+# 启动配置（知识库在应用启动后于后台加载，完成前就绪检查返回503）
+WARMUP_ENABLED = True  # 就绪前先编码一条查询并检索一次，加载嵌入模型和向量索引
+WARMUP_QUERY = "知识库预热"  # 预热使用的查询文本
+STARTUP_RETRY_AFTER = 5  # 加载完成前依赖知识库的接口返回503时建议的重试间隔（秒）
+
+# 部署配置（多进程部署: 一个索引进程 + 多个只读查询进程）
+SERVICE_ROLE = os.environ.get("KB_ROLE", "indexer")  # indexer（文件夹监控、导入并提供全部接口）/ query（只读查询，写入接口返回403）
+INDEX_REFRESH_INTERVAL = 2  # 查询进程检查索引变更的间隔（秒）
+INDEX_CHANGE_LOG_SIZE = 10000  # 保留的索引变更记录数，查询进程落后更多时清空其回答缓存
+PRELOAD_EMBEDDING_MODEL = False  # 导入应用时加载嵌入模型（配合 gunicorn --preload，fork出的工作进程共享模型权重）
 
 # API配置
 API_HOST = "0.0.0.0"
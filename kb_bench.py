@@ -0,0 +1,155 @@
+"""
+向量存储后端对比 - 比较ChromaDB与平铺向量存储（float32 / int8）的召回率和检索延迟
+
+用法:
+    python -m kb_bench --synthetic 200000 --dim 384
+    python -m kb_bench --db ./chroma_db --queries 500 --top-k 5 --report bench.json
+
+使用 --db 时读取已有ChromaDB向量库中的嵌入，否则生成带聚类结构的随机向量。
+查询为随机抽取的库内向量加噪声，以精确的余弦相似度排序结果为基准计算 recall@k。
+各后端在临时目录中构建，不修改已有向量库。
+"""
+import sys
+import json
+import time
+import shutil
+import tempfile
+import argparse
+from typing import Dict, Any, List
+
+import numpy as np
+
+import config
+
+def parse_args(argv=None) -> argparse.Namespace:
+    """解析命令行参数"""
+    parser = argparse.ArgumentParser(prog="kb_bench", description="向量存储后端召回率与延迟对比")
+    parser.add_argument("--db", default=None, help="读取该ChromaDB向量库中的嵌入（默认生成随机向量）")
+    parser.add_argument("--synthetic", type=int, default=100000, help="随机向量数量")
+    parser.add_argument("--dim", type=int, default=384, help="随机向量维度")
+    parser.add_argument("--queries", type=int, default=200, help="查询数量")
+    parser.add_argument("--top-k", type=int, default=config.TOP_K_RESULTS, help="每次查询返回的结果数")
+    parser.add_argument("--backends", default="chroma,flat,flat-int8", help="参与对比的后端，逗号分隔")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子")
+    parser.add_argument("--report", default=None, help="将对比结果写入JSON文件")
+    return parser.parse_args(argv)
+
+def load_embeddings(args: argparse.Namespace, rng: np.random.Generator) -> np.ndarray:
+    """读取已有向量库的嵌入，或生成带聚类结构的随机向量"""
+    if args.db:
+        import chromadb
+        collection = chromadb.PersistentClient(path=args.db).get_collection("knowledge_base")
+        total = collection.count()
+        embeddings = []
+        for offset in range(0, total, 5000):
+            embeddings.extend(collection.get(include=["embeddings"], limit=5000, offset=offset)['embeddings'])
+        return np.asarray(embeddings, dtype=np.float32)
+    
+    centers = rng.standard_normal((max(1, args.synthetic // 200), args.dim)).astype(np.float32)
+    labels = rng.integers(0, len(centers), args.synthetic)
+    return centers[labels] + 0.5 * rng.standard_normal((args.synthetic, args.dim)).astype(np.float32)
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms > 0, norms, 1.0)
+
+def exact_top_k(embeddings: np.ndarray, queries: np.ndarray, top_k: int) -> List[set]:
+    """精确的余弦相似度前k个（基准）"""
+    matrix = _normalize(embeddings)
+    truth = []
+    for query in _normalize(queries):
+        scores = matrix @ query
+        truth.append(set(np.argsort(-scores)[:top_k].tolist()))
+    return truth
+
+def _open_backend(name: str, path: str):
+    """在临时目录中创建后端"""
+    if name == "chroma":
+        import chromadb
+        client = chromadb.PersistentClient(path=path)
+        return client.get_or_create_collection(name="knowledge_base", metadata={"hnsw:space": "cosine"})
+    from models.vector_store import FlatVectorStore
+    return FlatVectorStore(path, quantize=(name == "flat-int8"), block_rows=config.FLAT_INDEX_BLOCK_ROWS)
+
+def bench_backend(name: str, embeddings: np.ndarray, queries: np.ndarray, truth: List[set],
+                  top_k: int) -> Dict[str, Any]:
+    """构建后端并执行所有查询"""
+    directory = tempfile.mkdtemp(prefix=f"kb_bench_{name}_")
+    try:
+        store = _open_backend(name, directory)
+        
+        start = time.perf_counter()
+        batch_size = 5000  # ChromaDB单次写入的数量有上限
+        for offset in range(0, len(embeddings), batch_size):
+            batch = embeddings[offset:offset + batch_size]
+            store.add(
+                ids=[str(i) for i in range(offset, offset + len(batch))],
+                embeddings=batch.tolist(),
+                documents=[""] * len(batch),
+                metadatas=[{"document_id": "bench"}] * len(batch)
+            )
+        build_seconds = time.perf_counter() - start
+        
+        latencies = []
+        hits = 0
+        for query, expected in zip(queries, truth):
+            start = time.perf_counter()
+            result = store.query(query_embeddings=[query.tolist()], n_results=top_k, include=["distances"])
+            latencies.append(time.perf_counter() - start)
+            hits += len(expected & {int(chunk_id) for chunk_id in result['ids'][0]})
+        
+        latencies.sort()
+        return {
+            "backend": name,
+            "build_seconds": round(build_seconds, 2),
+            "recall_at_k": round(hits / (len(truth) * top_k), 4),
+            "latency_ms": {
+                "p50": round(latencies[len(latencies) // 2] * 1000, 3),
+                "p99": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000, 3),
+                "mean": round(sum(latencies) / len(latencies) * 1000, 3)
+            }
+        }
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+def main(argv=None) -> int:
+    """命令行入口"""
+    args = parse_args(argv)
+    rng = np.random.default_rng(args.seed)
+    
+    try:
+        embeddings = load_embeddings(args, rng)
+        if len(embeddings) == 0:
+            raise Exception("向量库为空")
+        # 查询为库内向量（归一化）加上范数约0.3的噪声
+        base = _normalize(embeddings[rng.integers(0, len(embeddings), args.queries)])
+        queries = base + rng.standard_normal(base.shape).astype(np.float32) * (0.3 / np.sqrt(base.shape[1]))
+        truth = exact_top_k(embeddings, queries, args.top_k)
+        
+        print(f"📊 向量数 {len(embeddings)}, 维度 {embeddings.shape[1]}, 查询 {args.queries}, top_k {args.top_k}")
+        results = []
+        for name in [b.strip() for b in args.backends.split(",") if b.strip()]:
+            result = bench_backend(name, embeddings, queries, truth, args.top_k)
+            results.append(result)
+            print(f"   {name:10s} 构建 {result['build_seconds']:8.2f} 秒, recall@{args.top_k} {result['recall_at_k']:.4f}, "
+                  f"延迟 p50 {result['latency_ms']['p50']:.3f} ms, p99 {result['latency_ms']['p99']:.3f} ms")
+    except Exception as e:
+        print(f"❌ 对比失败: {str(e)}")
+        return 1
+    
+    if args.report:
+        report = {
+            "vectors": len(embeddings),
+            "dim": int(embeddings.shape[1]),
+            "queries": args.queries,
+            "top_k": args.top_k,
+            "results": results
+        }
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"💾 对比结果已保存: {args.report}")
+    
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,110 @@
+"""
+离线构建知识库索引 - 不启动Web服务，直接从语料目录构建或更新向量库
+
+用法:
+    python -m kb_build ./corpus --db ./chroma_db
+    python -m kb_build ./corpus --db ./chroma_db --workers 8 --batch-size 128 --report report.json
+
+状态表记录了每个文件的大小、修改时间和内容哈希，重复执行时只处理新增、修改和删除的文件；
+导入过程中每处理 config.INGEST_CHECKPOINT_FILES 个文件保存一次进度，中断后重新执行即可继续。
+部署时把生成的向量库、状态表、嵌入缓存和关键词索引一起拷贝到服务器，服务启动后无需重新导入。
+"""
+import os
+import sys
+import json
+import time
+import argparse
+from pathlib import Path
+
+import config
+
+def parse_args(argv=None) -> argparse.Namespace:
+    """解析命令行参数"""
+    parser = argparse.ArgumentParser(prog="kb_build", description="离线构建知识库索引")
+    parser.add_argument("corpus_dir", help="语料目录（相当于服务端的监控目录）")
+    default_db = config.FLAT_INDEX_PATH if config.VECTOR_STORE == "flat" else config.CHROMA_DB_PATH
+    parser.add_argument("--db", default=default_db, help=f"向量库目录（默认 {default_db}）")
+    parser.add_argument("--state", default=None, help="文件状态表路径（默认放在向量库目录旁的 watcher_state.sqlite3）")
+    parser.add_argument("--cache", default=None, help="嵌入缓存路径（默认放在向量库目录旁的 embedding_cache.sqlite3）")
+    parser.add_argument("--no-cache", action="store_true", help="不使用嵌入缓存")
+    parser.add_argument("--workers", type=int, default=config.INGEST_PROCESS_WORKERS, help="文本提取进程数")
+    parser.add_argument("--batch-size", type=int, default=config.EMBEDDING_BATCH_SIZE, help="向量编码批大小")
+    parser.add_argument("--checkpoint", type=int, default=config.INGEST_CHECKPOINT_FILES, help="每处理多少个文件保存一次进度")
+    parser.add_argument("--report", default=None, help="将统计报告写入JSON文件")
+    return parser.parse_args(argv)
+
+def build(args: argparse.Namespace) -> dict:
+    """构建或更新索引，返回统计报告"""
+    corpus_dir = Path(args.corpus_dir)
+    if not corpus_dir.is_dir():
+        raise Exception(f"语料目录不存在: {corpus_dir}")
+    
+    # 命令行参数覆盖默认配置，必须在创建知识库之前设置
+    config.INGEST_PROCESS_WORKERS = max(1, args.workers)
+    config.EMBEDDING_BATCH_SIZE = max(1, args.batch_size)
+    config.INGEST_CHECKPOINT_FILES = max(1, args.checkpoint)
+    config.EMBEDDING_CACHE_ENABLED = config.EMBEDDING_CACHE_ENABLED and not args.no_cache
+    
+    from models.knowledge_base import KnowledgeBase, sidecar_path
+    from services.folder_watcher import FolderWatcher
+    
+    # 嵌入缓存、关键词索引和文档登记表由知识库放在向量库目录旁
+    state_path = args.state or sidecar_path(args.db, "watcher_state.sqlite3")
+    kb = KnowledgeBase(db_path=args.db, embedding_cache_path=args.cache)
+    if kb.mode == "simple":
+        raise Exception("离线构建需要安装 sentence-transformers（chroma后端还需要 chromadb）")
+    
+    chunk_count = 0
+    def count_chunks(count: int):
+        nonlocal chunk_count
+        chunk_count += count
+    kb.progress_callback = count_chunks
+    
+    watcher = FolderWatcher(kb, str(corpus_dir), auto_start=False, state_path=state_path)
+    
+    start = time.time()
+    summary = watcher.sync_folder()
+    elapsed = time.time() - start
+    
+    processed = summary["added"] + summary["modified"]
+    report = {
+        "corpus_dir": str(corpus_dir.absolute()),
+        "db_path": os.path.abspath(args.db),
+        "state_path": os.path.abspath(state_path),
+        **summary,
+        "chunks": chunk_count,
+        "seconds": round(elapsed, 3),
+        "files_per_sec": round(processed / elapsed, 2) if elapsed > 0 else 0.0,
+        "chunks_per_sec": round(chunk_count / elapsed, 2) if elapsed > 0 else 0.0,
+        "mb_per_sec": round(summary["bytes"] / 1024 / 1024 / elapsed, 2) if elapsed > 0 else 0.0,
+        "total_chunks": kb.collection.count()
+    }
+    if getattr(kb, "embedding_cache", None) is not None:
+        report["embedding_cache"] = kb.embedding_cache.stats()
+    return report
+
+def main(argv=None) -> int:
+    """命令行入口"""
+    args = parse_args(argv)
+    try:
+        report = build(args)
+    except Exception as e:
+        print(f"❌ 构建索引失败: {str(e)}")
+        return 1
+    
+    print("📊 索引构建完成")
+    print(f"   文件: 共 {report['files']}, 新增 {report['added']}, 修改 {report['modified']}, "
+          f"未变化 {report['unchanged']}, 删除 {report['deleted']}, 失败 {report['failed']}")
+    print(f"   分块: 写入 {report['chunks']}, 索引总数 {report['total_chunks']}")
+    print(f"   数据量: {report['bytes']} 字节, 耗时 {report['seconds']} 秒")
+    print(f"   吞吐: {report['files_per_sec']} 文件/秒, {report['chunks_per_sec']} 分块/秒, {report['mb_per_sec']} MB/秒")
+    
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"💾 统计报告已保存: {args.report}")
+    
+    return 1 if report["failed"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -9,14 +9,15 @@ from fastapi.responses import HTMLResponse
 import uvicorn
 import os
 
-from api.routes import router
+from api.routes import router, lifespan
 import config
 
 # 创建FastAPI应用
 app = FastAPI(
     title="私人知识库系统",
     description="基于Ollama DeepSeek的智能问答知识库",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan  # 知识库在启动后于后台加载，见 api/routes.py
 )
 
 # 挂载API路由
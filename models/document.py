@@ -2,8 +2,18 @@
 文档处理模型
 """
 import os
-from typing import List, Optional
+import mmap
+import time
+import codecs
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from typing import List, Optional, Iterable, Iterator, Union
 from dataclasses import dataclass
+import config
+
+# 句子边界字符：中文句末标点、换行及英文句末标点
+SENTENCE_BOUNDARIES = ("。", "！", "？", "；", "\n", ".", "!", "?", ";")
 
 @dataclass
 class Document:
@@ -12,6 +22,15 @@ class Document:
     filename: str
     content: str
     metadata: dict
+
+@dataclass
+class ExtractedDocument:
+    """提取并分块后的文档"""
+    file_path: str
+    chunks: Optional[Union[List[str], Iterator[str]]]  # 大文件为惰性生成的分块
+    size: int = 0  # 文件字节数
+    seconds: float = 0.0  # 提取和分块耗时
+    error: Optional[str] = None
     
 class DocumentProcessor:
     """文档处理器"""
@@ -33,26 +52,188 @@ class DocumentProcessor:
         with open(file_path, 'r', encoding='utf-8') as f:
             return f.read()
     
-    def chunk_text(self, text: str, chunk_size: int = 1000, overlap: int = 200) -> List[str]:
-        """将文本分块"""
-        if len(text) <= chunk_size:
-            return [text]
+    def iter_text(self, file_path: str) -> Iterator[str]:
+        """分段读取文件文本，内存占用与文件大小无关"""
+        _, ext = os.path.splitext(file_path.lower())
         
-        chunks = []
-        start = 0
+        if config.MAX_FILE_SIZE is not None and os.path.getsize(file_path) > config.MAX_FILE_SIZE:
+            raise ValueError(f"文件超过大小限制 {config.MAX_FILE_SIZE} 字节: {file_path}")
         
-        while start < len(text):
-            end = start + chunk_size
-            if end >= len(text):
-                chunks.append(text[start:])
-                break
+        if ext == '.txt':
+            return self._iter_text_file(file_path)
+        else:
+            raise ValueError(f"不支持的文件类型: {ext}")
+    
+    def _iter_text_file(self, file_path: str) -> Iterator[str]:
+        """内存映射读取文本文件，按块增量解码UTF-8
+        
+        跨块的多字节字符由增量解码器保留到下一块，不会被截断；
+        已解码的页面通知内核回收，峰值内存不随文件大小增长。
+        """
+        with open(file_path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size == 0:
+                return
             
-            # 尝试在句号处分割
-            split_point = text.rfind('.', start, end)
-            if split_point == -1:
-                split_point = end
+            decoder = codecs.getincrementaldecoder('utf-8')()
+            step = max(mmap.PAGESIZE, config.CHUNK_READ_SIZE // mmap.PAGESIZE * mmap.PAGESIZE)
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                _madvise(mm, "MADV_SEQUENTIAL")
+                for offset in range(0, size, step):
+                    piece = decoder.decode(mm[offset:offset + step])
+                    if piece:
+                        yield piece
+                    _madvise(mm, "MADV_DONTNEED", offset, min(step, size - offset))
+                
+                tail = decoder.decode(b"", final=True)
+                if tail:
+                    yield tail
+    
+    def chunk_text(self, text: str, chunk_size: int = None, overlap: int = None) -> List[str]:
+        """将文本分块"""
+        return list(self.iter_chunks([text], chunk_size, overlap))
+    
+    def chunk_file(self, file_path: str, chunk_size: int = None, overlap: int = None) -> List[str]:
+        """分段读取文件并分块"""
+        return list(self.iter_file_chunks(file_path, chunk_size, overlap))
+    
+    def iter_file_chunks(self, file_path: str, chunk_size: int = None, overlap: int = None) -> Iterator[str]:
+        """边读取边分块，不在内存中保留完整文本和分块列表"""
+        return self.iter_chunks(self.iter_text(file_path), chunk_size, overlap)
+    
+    def iter_chunks(self, pieces: Iterable[str], chunk_size: int = None,
+                    overlap: int = None) -> Iterator[str]:
+        """流式分块
+        
+        依次消费文本片段，缓冲区只保留未输出的部分。每个分块尽量在
+        chunk_size 以内最后一个句子边界处结束（中文 。！？； 、换行及英文标点），
+        边界只在分块后半段查找，找不到时按 chunk_size 硬切；相邻分块重叠 overlap 个字符。
+        每个分块至少向前推进 chunk_size // 2 - overlap 个字符，
+        分块数量不超过 文本长度 / (chunk_size // 2 - overlap) + 1。
+        """
+        chunk_size = max(2, chunk_size or config.CHUNK_SIZE)
+        overlap = config.CHUNK_OVERLAP if overlap is None else overlap
+        overlap = max(0, min(overlap, chunk_size // 2 - 1))
+        min_cut = chunk_size // 2  # 分割点不早于分块中点，保证推进距离
+        
+        buffer = ""
+        emitted = False
+        for piece in pieces:
+            buffer += piece
+            pos = 0
+            while len(buffer) - pos > chunk_size:
+                cut = self._find_boundary(buffer, pos + min_cut, pos + chunk_size)
+                yield buffer[pos:cut]
+                emitted = True
+                pos = cut - overlap
+            if pos:
+                buffer = buffer[pos:]
+        
+        # 剩余部分：文本不足一个分块时原样返回；否则只在含有新内容时输出
+        if not emitted or len(buffer) > overlap:
+            yield buffer
+    
+    @staticmethod
+    def _find_boundary(text: str, start: int, end: int) -> int:
+        """在 text[start:end] 中查找最后一个句子边界，返回分割位置（边界字符之后）"""
+        best = -1
+        for mark in SENTENCE_BOUNDARIES:
+            index = text.rfind(mark, start, end)
+            if index > best:
+                best = index
+        return best + 1 if best != -1 else end
+    
+    def iter_extract(self, file_paths: Iterable[str]) -> Iterator[ExtractedDocument]:
+        """在当前进程中依次提取并分块"""
+        for file_path in file_paths:
+            if self._should_stream(file_path):
+                yield self._extract_streaming(file_path)
+            else:
+                yield extract_and_chunk(file_path)
+    
+    def _should_stream(self, file_path: str) -> bool:
+        """文件是否需要流式分块（超过 config.STREAMING_EXTRACT_THRESHOLD）"""
+        try:
+            return os.path.getsize(file_path) >= config.STREAMING_EXTRACT_THRESHOLD
+        except OSError:
+            return False
+    
+    def _extract_streaming(self, file_path: str) -> ExtractedDocument:
+        """返回惰性分块的文档，读取和分块在消费分块时进行"""
+        try:
+            chunks = self.iter_file_chunks(file_path)
+            size = os.path.getsize(file_path)
+        except Exception as e:
+            return ExtractedDocument(file_path, None, error=str(e))
+        return ExtractedDocument(file_path, chunks, size)
+    
+    def iter_extract_parallel(self, file_paths: Iterable[str], workers: int = None,
+                              max_pending: int = None) -> Iterator[ExtractedDocument]:
+        """使用进程池并行提取并分块，按完成顺序返回结果
+        
+        同时在处理中的文件不超过max_pending个，消费端（嵌入编码）跟不上时
+        不会继续提交新文件，内存占用保持有界。大文件不进入进程池（分块列表
+        需要整体传回主进程），而是在主进程中流式分块，期间进程池继续处理其他文件。
+        """
+        workers = workers or config.INGEST_PROCESS_WORKERS
+        max_pending = max_pending or config.INGEST_MAX_PENDING
+        paths = iter(file_paths)
+        
+        with ProcessPoolExecutor(max_workers=workers, mp_context=_pool_context()) as executor:
+            pending = {}
+            streamed = deque()
             
-            chunks.append(text[start:split_point + 1])
-            start = split_point + 1 - overlap
+            def fill():
+                while len(pending) < max_pending:
+                    file_path = next(paths, None)
+                    if file_path is None:
+                        break
+                    if self._should_stream(file_path):
+                        streamed.append(file_path)
+                    else:
+                        pending[executor.submit(extract_and_chunk, file_path)] = file_path
             
-        return chunks 
\ No newline at end of file
+            fill()
+            while pending or streamed:
+                if streamed:
+                    yield self._extract_streaming(streamed.popleft())
+                else:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        file_path = pending.pop(future)
+                        try:
+                            yield future.result()
+                        except Exception as e:
+                            yield ExtractedDocument(file_path, None, error=str(e))
+                fill()
+
+def extract_and_chunk(file_path: str) -> ExtractedDocument:
+    """提取并分块单个文件（模块级函数，可在子进程中执行）"""
+    start = time.perf_counter()
+    try:
+        processor = DocumentProcessor()
+        chunks = processor.chunk_file(file_path)
+        size = os.path.getsize(file_path)
+    except Exception as e:
+        return ExtractedDocument(file_path, None, seconds=time.perf_counter() - start, error=str(e))
+    return ExtractedDocument(file_path, chunks, size, time.perf_counter() - start)
+
+def _madvise(mm: mmap.mmap, option: str, start: int = 0, length: Optional[int] = None):
+    """向内核提示映射区域的访问方式（平台不支持时忽略），length为空表示到映射末尾"""
+    if not hasattr(mm, "madvise") or not hasattr(mmap, option):
+        return
+    try:
+        mm.madvise(getattr(mmap, option), start, len(mm) - start if length is None else length)
+    except OSError:
+        pass
+
+def _pool_context():
+    """进程池启动方式
+    
+    不使用fork：Web服务中还有监控、导入、编码等线程在运行，fork出的子进程可能继承
+    其他线程持有的锁（如print使用的stdout锁）而死锁。支持时使用forkserver，
+    主模块只在forkserver进程中导入一次，工作进程从这个单线程进程fork；否则使用spawn。
+    """
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("forkserver")
+    return multiprocessing.get_context("spawn")
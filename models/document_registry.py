@@ -0,0 +1,199 @@
+"""
+文档登记表 - 文档级的元数据和计数，文档列表和统计信息不再扫描所有分块
+"""
+import os
+import json
+import sqlite3
+import threading
+import time
+from typing import List, Dict, Any, Optional, Iterable, Tuple
+
+class DocumentRegistry:
+    """基于SQLite的文档登记表
+    
+    每个文档一行（ID、文件名、分块数、文件大小、导入时间），随文档的添加、更新和删除维护；
+    文档总数和分块总数保存在内存计数器中，读取统计信息时不需要查询。
+    每次写入同时追加一条变更记录（版本号递增，附带失效的分块ID），
+    只读的查询进程通过 poll_changes 得知索引进程写入了新数据。
+    """
+    
+    def __init__(self, path: str = ":memory:", change_log_size: int = 10000):
+        self.path = path
+        self.change_log_size = max(1, change_log_size)  # 保留的变更记录数
+        self._lock = threading.Lock()
+        
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        if path != ":memory:":
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS documents (
+                id TEXT PRIMARY KEY,
+                filename TEXT NOT NULL,
+                chunk_count INTEGER NOT NULL,
+                size INTEGER,
+                ingested_at REAL
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_documents_filename ON documents(filename)")
+        # chunk_ids为JSON数组，NULL表示失效范围未知（登记表被重建）
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS changes (
+                version INTEGER PRIMARY KEY AUTOINCREMENT,
+                chunk_ids TEXT
+            )
+        """)
+        self.conn.commit()
+        self._documents, self._chunks = self._read_counts()
+        self.version = self.conn.execute("SELECT COALESCE(MAX(version), 0) FROM changes").fetchone()[0]
+    
+    def put(self, document_id: str, filename: str, chunk_count: int, size: Optional[int] = None,
+            ingested_at: Optional[float] = None):
+        """登记文档，已存在时更新（保持列表中的位置）"""
+        ingested_at = time.time() if ingested_at is None else ingested_at
+        with self._lock:
+            row = self.conn.execute("SELECT chunk_count FROM documents WHERE id = ?", (document_id,)).fetchone()
+            if row is None:
+                self.conn.execute(
+                    "INSERT INTO documents (id, filename, chunk_count, size, ingested_at) VALUES (?, ?, ?, ?, ?)",
+                    (document_id, filename, chunk_count, size, ingested_at)
+                )
+                self._documents += 1
+                self._chunks += chunk_count
+            else:
+                self.conn.execute(
+                    "UPDATE documents SET filename = ?, chunk_count = ?, size = ?, ingested_at = ? WHERE id = ?",
+                    (filename, chunk_count, size, ingested_at, document_id)
+                )
+                self._chunks += chunk_count - row[0]
+            self._log_change([])
+            self.conn.commit()
+    
+    def remove(self, document_id: str) -> bool:
+        """删除文档记录，返回是否存在"""
+        with self._lock:
+            row = self.conn.execute("SELECT chunk_count FROM documents WHERE id = ?", (document_id,)).fetchone()
+            if row is None:
+                return False
+            self.conn.execute("DELETE FROM documents WHERE id = ?", (document_id,))
+            self._log_change([])
+            self.conn.commit()
+            self._documents -= 1
+            self._chunks -= row[0]
+            return True
+    
+    def get(self, document_id: str) -> Optional[Dict[str, Any]]:
+        """读取单个文档"""
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT id, filename, chunk_count, size, ingested_at FROM documents WHERE id = ?",
+                (document_id,)
+            ).fetchone()
+        return self._format(row) if row else None
+    
+    def list(self, offset: int = 0, limit: Optional[int] = None, filename: Optional[str] = None) -> List[Dict[str, Any]]:
+        """按登记顺序分页列出文档，filename为文件名子串（不区分大小写）"""
+        where, params = self._filter(filename)
+        with self._lock:
+            rows = self.conn.execute(
+                f"SELECT id, filename, chunk_count, size, ingested_at FROM documents{where} "
+                f"ORDER BY rowid LIMIT ? OFFSET ?",
+                params + [-1 if limit is None else limit, offset]
+            ).fetchall()
+        return [self._format(row) for row in rows]
+    
+    def count(self, filename: Optional[str] = None) -> int:
+        """文档数，不带过滤条件时直接读取计数器"""
+        if not filename:
+            return self._documents
+        where, params = self._filter(filename)
+        with self._lock:
+            return self.conn.execute(f"SELECT COUNT(*) FROM documents{where}", params).fetchone()[0]
+    
+    @property
+    def total_chunks(self) -> int:
+        """所有文档的分块总数"""
+        return self._chunks
+    
+    def rebuild(self, rows: Iterable[Tuple[str, str, int]]):
+        """以 (文档ID, 文件名, 分块数) 重建登记表
+        
+        已登记的文档沿用原有的文件大小和导入时间，新出现的文档这两项未知。
+        """
+        with self._lock:
+            known = {
+                doc_id: (size, ingested_at)
+                for doc_id, size, ingested_at in self.conn.execute("SELECT id, size, ingested_at FROM documents")
+            }
+            self.conn.execute("DELETE FROM documents")
+            self.conn.executemany(
+                "INSERT INTO documents (id, filename, chunk_count, size, ingested_at) VALUES (?, ?, ?, ?, ?)",
+                ((doc_id, filename, count, *known.get(doc_id, (None, None))) for doc_id, filename, count in rows)
+            )
+            self._log_change(None)
+            self.conn.commit()
+            self._documents, self._chunks = self._read_counts()
+    
+    def log_change(self, chunk_ids: List[str]):
+        """记录分块被删除或重新索引"""
+        with self._lock:
+            self._log_change(chunk_ids)
+            self.conn.commit()
+    
+    def poll_changes(self) -> Tuple[bool, Optional[List[str]]]:
+        """读取其他进程写入的变更（只读进程定期调用），返回 (是否有变更, 失效的分块ID)
+        
+        失效的分块ID为None表示变更记录已被清理或登记表被重建，无法确定失效范围。
+        有变更时同时刷新文档数和分块数的计数器。
+        """
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT version, chunk_ids FROM changes WHERE version > ? ORDER BY version", (self.version,)
+            ).fetchall()
+            if not rows:
+                return False, []
+            
+            complete = rows[0][0] == self.version + 1
+            invalidated = []
+            for _, chunk_ids in rows:
+                if chunk_ids is None:
+                    complete = False
+                elif complete:
+                    invalidated.extend(json.loads(chunk_ids))
+            self.version = rows[-1][0]
+            self._documents, self._chunks = self._read_counts()
+        return True, (invalidated if complete else None)
+    
+    def _log_change(self, chunk_ids: Optional[List[str]]):
+        """追加一条变更记录并清理过旧的记录（调用方持有锁并负责提交）"""
+        cursor = self.conn.execute(
+            "INSERT INTO changes (chunk_ids) VALUES (?)",
+            (None if chunk_ids is None else json.dumps(chunk_ids),)
+        )
+        self.version = cursor.lastrowid
+        self.conn.execute("DELETE FROM changes WHERE version <= ?", (self.version - self.change_log_size,))
+    
+    def _read_counts(self) -> Tuple[int, int]:
+        return self.conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(chunk_count), 0) FROM documents"
+        ).fetchone()
+    
+    @staticmethod
+    def _filter(filename: Optional[str]) -> Tuple[str, list]:
+        if not filename:
+            return "", []
+        pattern = filename.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        return " WHERE filename LIKE ? ESCAPE '\\'", [f"%{pattern}%"]
+    
+    @staticmethod
+    def _format(row: tuple) -> Dict[str, Any]:
+        return {
+            "id": row[0],
+            "filename": row[1],
+            "chunk_count": row[2],
+            "size": row[3],
+            "ingested_at": row[4]
+        }
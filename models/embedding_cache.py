@@ -0,0 +1,148 @@
+"""
+嵌入向量缓存 - 按内容寻址，避免重复编码未变化的分块
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from typing import List, Optional, Dict, Any
+
+class EmbeddingCache:
+    """基于SQLite的持久化嵌入缓存
+    
+    键为 (嵌入模型名称, 分块文本) 的SHA-256哈希，值为float32向量。
+    超过容量上限时按最近使用时间淘汰（LRU）。
+    """
+    
+    # SQLite单条语句的参数数量有限，批量查询时分段执行
+    _QUERY_BATCH = 500
+    
+    def __init__(self, path: str, model_name: str, max_entries: int = 200000):
+        self.path = path
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                key TEXT PRIMARY KEY,
+                vector BLOB NOT NULL,
+                last_used INTEGER NOT NULL
+            )
+        """)
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings(last_used)"
+        )
+        self.conn.commit()
+        self._size = self.conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+    
+    def _key(self, text: str) -> str:
+        """计算缓存键"""
+        digest = hashlib.sha256()
+        digest.update(self.model_name.encode("utf-8"))
+        digest.update(b"\0")
+        digest.update(text.encode("utf-8"))
+        return digest.hexdigest()
+    
+    def get_many(self, texts: List[str]) -> List[Optional[List[float]]]:
+        """批量查询缓存，未命中的位置返回None"""
+        keys = [self._key(text) for text in texts]
+        found: Dict[str, bytes] = {}
+        
+        with self._lock:
+            unique_keys = list(dict.fromkeys(keys))
+            for i in range(0, len(unique_keys), self._QUERY_BATCH):
+                batch = unique_keys[i:i + self._QUERY_BATCH]
+                placeholders = ",".join("?" * len(batch))
+                rows = self.conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})",
+                    batch
+                ).fetchall()
+                found.update(rows)
+            
+            if found:
+                now = time.time_ns()
+                self.conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                    [(now, key) for key in found]
+                )
+                self.conn.commit()
+            
+            results = []
+            for key in keys:
+                blob = found.get(key)
+                if blob is None:
+                    self.misses += 1
+                    results.append(None)
+                else:
+                    self.hits += 1
+                    vector = array("f")
+                    vector.frombytes(blob)
+                    results.append(vector.tolist())
+        
+        return results
+    
+    def put_many(self, texts: List[str], vectors: List[List[float]]):
+        """批量写入缓存"""
+        if not texts:
+            return
+        
+        now = time.time_ns()
+        rows = [
+            (self._key(text), array("f", vector).tobytes(), now)
+            for text, vector in zip(texts, vectors)
+        ]
+        
+        with self._lock:
+            before = self.conn.total_changes
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+                rows
+            )
+            self._size += self.conn.total_changes - before
+            self._evict()
+            self.conn.commit()
+    
+    def _evict(self):
+        """超过容量上限时淘汰最久未使用的条目（调用方持有锁）"""
+        overflow = self._size - self.max_entries
+        if overflow <= 0:
+            return
+        
+        self.conn.execute(
+            "DELETE FROM embeddings WHERE key IN "
+            "(SELECT key FROM embeddings ORDER BY last_used LIMIT ?)",
+            (overflow,)
+        )
+        self._size -= overflow
+        self.evictions += overflow
+    
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self.conn.execute("DELETE FROM embeddings")
+            self.conn.commit()
+            self._size = 0
+    
+    def stats(self) -> Dict[str, Any]:
+        """获取缓存统计信息"""
+        lookups = self.hits + self.misses
+        return {
+            "entries": self._size,
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+        }
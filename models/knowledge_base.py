@@ -2,116 +2,299 @@
 知识库核心模型
 """
 import os
+import time
 import uuid
-from typing import List, Dict, Any, Optional
-from .document import DocumentProcessor, Document
+import hashlib
+import threading
+import importlib.util
+from collections import deque
+from typing import List, Dict, Any, Optional, Callable, Iterable
+import numpy as np
+from .document import DocumentProcessor, Document, ExtractedDocument
+from .embedding_cache import EmbeddingCache
+from .query_encoder import QueryEncoder
+from .lexical_index import LexicalIndex
+from .document_registry import DocumentRegistry
+from .vector_store import FlatVectorStore
 import config
 
-# 可选依赖导入
-try:
-    import chromadb
-    CHROMADB_AVAILABLE = True
-except ImportError:
+# 可选依赖检测（两者导入都需要数秒，创建知识库时才导入，应用启动不必等待）
+CHROMADB_AVAILABLE = importlib.util.find_spec("chromadb") is not None
+if not CHROMADB_AVAILABLE:
     print("警告: ChromaDB未安装，将使用简单的内存存储")
-    CHROMADB_AVAILABLE = False
 
-try:
-    from sentence_transformers import SentenceTransformer
-    EMBEDDINGS_AVAILABLE = True
-except ImportError:
+EMBEDDINGS_AVAILABLE = importlib.util.find_spec("sentence_transformers") is not None
+if not EMBEDDINGS_AVAILABLE:
     print("警告: sentence-transformers未安装，将使用简单的文本匹配")
-    EMBEDDINGS_AVAILABLE = False
+
+_preloaded_models: Dict[str, Any] = {}  # 预先加载的嵌入模型（模型名 -> 模型）
+
+def preload_embedding_model():
+    """在当前进程中加载嵌入模型，之后创建的知识库直接使用
+    
+    在fork工作进程之前调用（如 gunicorn --preload），各工作进程以写时复制的方式共享模型权重，不再各自加载一份。
+    """
+    if EMBEDDINGS_AVAILABLE and config.EMBEDDING_MODEL not in _preloaded_models:
+        from sentence_transformers import SentenceTransformer
+        _preloaded_models[config.EMBEDDING_MODEL] = SentenceTransformer(config.EMBEDDING_MODEL)
+
+def sidecar_path(db_path: str, filename: str) -> str:
+    """向量库目录旁的文件路径（嵌入缓存、关键词索引、文档登记表等随向量库存放的文件）"""
+    return os.path.join(os.path.dirname(os.path.abspath(db_path)), filename)
+
+def _chunk_hash(text: str) -> str:
+    """计算分块内容哈希，用于增量更新时比对分块"""
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
 
 class SimpleKnowledgeBase:
     """简化版知识库（无向量搜索）"""
     
     def __init__(self):
-        self.documents = {}  # 存储文档 {doc_id: {"filename": str, "chunks": [str]}}
+        self.documents = {}  # 存储文档 {doc_id: {"filename": str, "chunks": [str], "size": int, "ingested_at": float}}
         self.doc_processor = DocumentProcessor()
+        self.lexical_index = LexicalIndex()  # 内存中的BM25倒排索引，分块ID为 "文档ID:分块序号"
+    
+    def _index_chunks(self, doc_id: str, chunks: List[str]):
+        """将文档的分块写入倒排索引"""
+        self.lexical_index.add_many((f"{doc_id}:{i}", doc_id, chunk) for i, chunk in enumerate(chunks))
     
     def add_document(self, file_path: str, filename: str) -> str:
         """添加文档"""
         try:
-            text = self.doc_processor.extract_text(file_path)
-            chunks = self.doc_processor.chunk_text(text)
+            chunks = self.doc_processor.chunk_file(file_path)
             doc_id = str(uuid.uuid4())
             
             self.documents[doc_id] = {
                 "filename": filename,
-                "chunks": chunks
+                "chunks": chunks,
+                "size": os.path.getsize(file_path),
+                "ingested_at": time.time()
             }
+            self._index_chunks(doc_id, chunks)
             return doc_id
         except Exception as e:
             raise Exception(f"添加文档失败: {str(e)}")
     
+    def add_documents(self, file_paths: List[str]) -> List[Dict[str, Any]]:
+        """批量添加文档"""
+        results = []
+        for file_path in file_paths:
+            filename = os.path.basename(file_path)
+            try:
+                doc_id = self.add_document(file_path, filename)
+                results.append({"file_path": file_path, "filename": filename,
+                                "document_id": doc_id, "success": True})
+            except Exception as e:
+                results.append({"file_path": file_path, "filename": filename,
+                                "document_id": None, "success": False, "error": str(e)})
+        return results
+    
+    def update_document(self, document_id: str, file_path: str, filename: str) -> Dict[str, Any]:
+        """更新文档内容，保持文档ID不变"""
+        try:
+            chunks = self.doc_processor.chunk_file(file_path)
+            
+            old_chunks = self.documents.get(document_id, {}).get("chunks", [])
+            unchanged = sum(1 for old, new in zip(old_chunks, chunks) if old == new)
+            
+            self.documents[document_id] = {
+                "filename": filename,
+                "chunks": chunks,
+                "size": os.path.getsize(file_path),
+                "ingested_at": time.time()
+            }
+            self.lexical_index.remove_document(document_id)
+            self._index_chunks(document_id, chunks)
+            return {
+                "document_id": document_id,
+                "added": len(chunks) - unchanged,
+                "removed": len(old_chunks) - unchanged,
+                "updated": 0,
+                "unchanged": unchanged
+            }
+        except Exception as e:
+            raise Exception(f"更新文档失败: {str(e)}")
+    
     def search(self, query: str, top_k: int = 5) -> List[Dict[str, Any]]:
-        """简单文本搜索"""
+        """BM25关键词搜索，按得分从高到低返回"""
         results = []
-        query_lower = query.lower()
-        
-        for doc_id, doc_data in self.documents.items():
-            for i, chunk in enumerate(doc_data["chunks"]):
-                if query_lower in chunk.lower():
-                    results.append({
-                        "content": chunk,
-                        "metadata": {
-                            "document_id": doc_id,
-                            "filename": doc_data["filename"],
-                            "chunk_index": i
-                        },
-                        "similarity": 0.8  # 固定相似度
-                    })
-        
-        return results[:top_k]
+        for chunk_id, score in self.lexical_index.search(query, top_k):
+            doc_id, index = chunk_id.rsplit(":", 1)
+            doc_data = self.documents.get(doc_id)
+            if doc_data is None:
+                continue
+            i = int(index)
+            results.append({
+                "id": chunk_id,
+                "content": doc_data["chunks"][i],
+                "metadata": {
+                    "document_id": doc_id,
+                    "filename": doc_data["filename"],
+                    "chunk_index": i
+                },
+                "similarity": round(score / (score + 1), 4)  # BM25得分映射到0~1
+            })
+        
+        return results
     
     def delete_document(self, document_id: str) -> bool:
         """删除文档"""
         if document_id in self.documents:
             del self.documents[document_id]
+            self.lexical_index.remove_document(document_id)
             return True
         return False
     
-    def list_documents(self) -> List[Dict[str, Any]]:
-        """列出文档"""
+    def _matching_documents(self, filename: Optional[str]) -> List[tuple]:
+        """文件名包含filename（不区分大小写）的文档"""
+        needle = (filename or "").lower()
+        return [(doc_id, doc_data) for doc_id, doc_data in self.documents.items()
+                if needle in doc_data["filename"].lower()]
+    
+    def list_documents(self, offset: int = 0, limit: Optional[int] = None,
+                       filename: Optional[str] = None) -> List[Dict[str, Any]]:
+        """分页列出文档"""
+        documents = self._matching_documents(filename)
+        end = None if limit is None else offset + limit
         return [
             {
                 "id": doc_id,
                 "filename": doc_data["filename"],
-                "chunk_count": len(doc_data["chunks"])
+                "chunk_count": len(doc_data["chunks"]),
+                "size": doc_data["size"],
+                "ingested_at": doc_data["ingested_at"]
             }
-            for doc_id, doc_data in self.documents.items()
+            for doc_id, doc_data in documents[offset:end]
         ]
     
+    def count_documents(self, filename: Optional[str] = None) -> int:
+        """文档数"""
+        return len(self._matching_documents(filename)) if filename else len(self.documents)
+    
     def get_stats(self) -> Dict[str, Any]:
         """获取统计信息"""
         total_chunks = sum(len(doc_data["chunks"]) for doc_data in self.documents.values())
         return {
             "total_chunks": total_chunks,
-            "total_documents": len(self.documents),
-            "documents": self.list_documents()
+            "total_documents": len(self.documents)
         }
 
 class KnowledgeBase:
     """知识库管理器"""
     
-    def __init__(self):
-        if CHROMADB_AVAILABLE and EMBEDDINGS_AVAILABLE:
+    # 批量删除时每次查询的文档数
+    _DELETE_BATCH = 500
+
+    def __init__(self, db_path: Optional[str] = None, read_only: bool = False,
+                 embedding_cache_path: Optional[str] = None):
+        self.vector_store = config.VECTOR_STORE
+        self.read_only = read_only  # 只读打开（多进程部署中的查询进程），写入由索引进程完成
+        if read_only and self.vector_store != "flat":
+            # ChromaDB不支持多个进程打开同一目录，进程内缓存的索引也无法安全地重新加载
+            raise Exception("只读打开需要flat向量存储后端（config.VECTOR_STORE = \"flat\"）")
+        self.db_path = db_path or (config.FLAT_INDEX_PATH if self.vector_store == "flat" else config.CHROMA_DB_PATH)
+        # 指定db_path时，嵌入缓存、关键词索引和文档登记表放在该向量库目录旁，不与默认向量库共用
+        if db_path is None:
+            self.embedding_cache_path = embedding_cache_path or config.EMBEDDING_CACHE_PATH
+            self.lexical_index_path = config.LEXICAL_INDEX_PATH
+            self.registry_path = config.DOCUMENT_REGISTRY_PATH
+        else:
+            self.embedding_cache_path = embedding_cache_path or sidecar_path(db_path, "embedding_cache.sqlite3")
+            self.lexical_index_path = sidecar_path(db_path, "lexical_index.sqlite3")
+            self.registry_path = sidecar_path(db_path, "document_registry.sqlite3")
+        if EMBEDDINGS_AVAILABLE and (CHROMADB_AVAILABLE or self.vector_store == "flat"):
             self._init_advanced()
         else:
             self._init_simple()
         
         # 初始化文档处理器
         self.doc_processor = DocumentProcessor()
+        
+        # 分块写入回调（参数为本次写入的分块数），用于统计导入进度
+        self.progress_callback: Optional[Callable[[int], None]] = None
+        
+        # 分块删除或重新索引回调（参数为分块ID列表，None表示无法确定范围、全部失效），用于失效依赖这些分块的缓存
+        self.invalidation_callback: Optional[Callable[[Optional[List[str]]], None]] = None
     
     def _init_advanced(self):
-        """初始化高级版本（ChromaDB + 向量搜索）"""
+        """初始化高级版本（向量库 + 向量搜索）"""
+        from sentence_transformers import SentenceTransformer
+        
         self.mode = "advanced"
-        self.chroma_client = chromadb.PersistentClient(path=config.CHROMA_DB_PATH)
-        self.collection = self.chroma_client.get_or_create_collection(
-            name="knowledge_base",
-            metadata={"hnsw:space": "cosine"}
+        if self.vector_store == "flat":
+            # 内存映射的平铺向量存储，接口与ChromaDB collection相同
+            self.collection = FlatVectorStore(self.db_path, config.FLAT_INDEX_QUANTIZE, config.FLAT_INDEX_BLOCK_ROWS,
+                                              read_only=self.read_only)
+        else:
+            import chromadb
+            self.chroma_client = chromadb.PersistentClient(path=self.db_path)
+            self.collection = self.chroma_client.get_or_create_collection(
+                name="knowledge_base",
+                metadata={"hnsw:space": "cosine"}
+            )
+        self.embedding_model = _preloaded_models.get(config.EMBEDDING_MODEL) or SentenceTransformer(config.EMBEDDING_MODEL)
+        self.embedding_cache = None
+        if config.EMBEDDING_CACHE_ENABLED and not self.read_only:
+            self.embedding_cache = EmbeddingCache(
+                self.embedding_cache_path,
+                config.EMBEDDING_MODEL,
+                config.EMBEDDING_CACHE_MAX_ENTRIES
+            )
+        self.query_encoder = QueryEncoder(
+            self.embedding_model,
+            config.QUERY_ENCODE_WINDOW_MS,
+            config.QUERY_ENCODE_MAX_BATCH,
+            config.QUERY_EMBEDDING_CACHE_SIZE
         )
-        self.embedding_model = SentenceTransformer(config.EMBEDDING_MODEL)
+        self._search_latencies: deque = deque(maxlen=config.SEARCH_LATENCY_SAMPLES)  # 最近的检索耗时（秒）
+        
+        # BM25关键词索引，与向量检索结果融合
+        self.lexical_index = None
+        if config.HYBRID_SEARCH_ENABLED:
+            self.lexical_index = LexicalIndex(self.lexical_index_path)
+        
+        # 文档登记表，文档列表和统计信息不再扫描所有分块的元数据；其变更记录通知只读进程
+        self.registry = DocumentRegistry(self.registry_path, config.INDEX_CHANGE_LOG_SIZE)
+        
+        # 与向量库不一致时重建（只读进程不写入，由索引进程负责）
+        if not self.read_only:
+            if self.lexical_index is not None:
+                self._sync_lexical_index()
+            self._sync_registry()
+    
+    def _sync_lexical_index(self):
+        """关键词索引与向量库的分块数不一致时（首次启用或上次异常退出），从向量库重建"""
+        total = self.collection.count()
+        if self.lexical_index.count() == total:
+            return
+        
+        print(f"🔄 重建关键词索引（{total} 个分块）...")
+        self.lexical_index.clear()
+        page_size = 1000
+        for offset in range(0, total, page_size):
+            page = self.collection.get(include=["documents", "metadatas"], limit=page_size, offset=offset)
+            self.lexical_index.add_many(
+                (chunk_id, (metadata or {}).get("document_id"), content)
+                for chunk_id, metadata, content in zip(page['ids'], page['metadatas'], page['documents'])
+            )
+        print("✅ 关键词索引重建完成")
+    
+    def _sync_registry(self):
+        """登记表与向量库的分块数不一致时（首次启用或上次异常退出），从分块元数据重建"""
+        total = self.collection.count()
+        if self.registry.total_chunks == total:
+            return
+        
+        print(f"🔄 重建文档登记表（{total} 个分块）...")
+        documents: Dict[str, list] = {}
+        page_size = 1000
+        for offset in range(0, total, page_size):
+            page = self.collection.get(include=["metadatas"], limit=page_size, offset=offset)
+            for metadata in page['metadatas']:
+                entry = documents.setdefault(metadata['document_id'], [metadata['filename'], 0])
+                entry[1] += 1
+        self.registry.rebuild((doc_id, filename, count) for doc_id, (filename, count) in documents.items())
+        print(f"✅ 文档登记表重建完成（{len(documents)} 个文档）")
     
     def _init_simple(self):
         """初始化简化版本（内存存储 + 文本搜索）"""
@@ -122,137 +305,669 @@ class KnowledgeBase:
         """添加文档到知识库"""
         if self.mode == "simple":
             return self.simple_kb.add_document(file_path, filename)
+        self._check_writable()
         
         try:
-            # 提取文本
-            text = self.doc_processor.extract_text(file_path)
+            chunks = self.doc_processor.iter_file_chunks(file_path)
+            doc_id = str(uuid.uuid4())
             
-            # 分块
-            chunks = self.doc_processor.chunk_text(text)
+            # 分块边读取边编码写入，读取中途失败时已写入的分块一并清理
+            writer = _ChunkBatchWriter(self)
+            chunk_count = 0
+            try:
+                chunk_count = self._queue_chunks(writer, doc_id, filename, chunks)
+                writer.flush()
+            except Exception as e:
+                writer.failed.setdefault(doc_id, str(e))
             
-            # 生成文档ID
-            doc_id = str(uuid.uuid4())
+            if doc_id in writer.failed:
+                self._discard_documents([doc_id])
+                raise Exception(writer.failed[doc_id])
+            
+            self.registry.put(doc_id, filename, chunk_count, os.path.getsize(file_path))
+            return doc_id
+            
+        except Exception as e:
+            raise Exception(f"添加文档失败: {str(e)}")
+    
+    def add_documents(self, file_paths: List[str], batch_size: int = None) -> List[Dict[str, Any]]:
+        """批量添加文档
+        
+        所有文档的分块跨文档累积，每批只调用一次encode和一次collection.add。
+        返回每个文件的处理结果。
+        """
+        if self.mode == "simple":
+            return self.simple_kb.add_documents(file_paths)
+        self._check_writable()
+        
+        extracted = self.doc_processor.iter_extract(file_paths)
+        return self._ingest(extracted, batch_size)["results"]
+    
+    def bulk_import(self, file_paths: Iterable[str], workers: int = None, batch_size: int = None) -> Dict[str, Any]:
+        """大批量导入
+        
+        提取和分块在进程池中并行执行，结果按完成顺序流式送入批量编码阶段，
+        处理中的文件数有上限（config.INGEST_MAX_PENDING）。
+        返回每个文件的处理结果和各阶段的吞吐统计。
+        """
+        if self.mode == "simple":
+            return {"results": self.simple_kb.add_documents(list(file_paths)), "stages": {}}
+        self._check_writable()
+        
+        workers = workers or config.INGEST_PROCESS_WORKERS
+        extracted = self.doc_processor.iter_extract_parallel(file_paths, workers)
+        report = self._ingest(extracted, batch_size)
+        report["stages"]["extract"]["workers"] = workers
+        return report
+    
+    def _ingest(self, extracted: Iterable[ExtractedDocument], batch_size: int = None) -> Dict[str, Any]:
+        """将已分块的文档送入批量写入器，返回处理结果和各阶段统计"""
+        writer = _ChunkBatchWriter(self, batch_size)
+        results = []
+        sizes: Dict[str, int] = {}  # 文档ID -> 文件大小
+        extract_seconds = 0.0
+        wait_seconds = 0.0
+        total_bytes = 0
+        started = time.perf_counter()
+        
+        items = iter(extracted)
+        while True:
+            wait_start = time.perf_counter()
+            item = next(items, None)
+            wait_seconds += time.perf_counter() - wait_start
+            if item is None:
+                break
             
-            # 为每个块生成嵌入并添加到向量数据库
-            embeddings = []
-            chunk_ids = []
-            metadatas = []
+            filename = os.path.basename(item.file_path)
+            result = {"file_path": item.file_path, "filename": filename, "document_id": None}
+            extract_seconds += item.seconds
             
-            for i, chunk in enumerate(chunks):
-                chunk_id = f"{doc_id}_chunk_{i}"
-                embedding = self.embedding_model.encode(chunk).tolist()
+            if item.error is not None:
+                result["success"] = False
+                result["error"] = f"添加文档失败: {item.error}"
+            else:
+                doc_id = str(uuid.uuid4())
+                result["document_id"] = doc_id
+                result["success"] = True
+                sizes[doc_id] = item.size
                 
-                chunk_ids.append(chunk_id)
-                embeddings.append(embedding)
-                metadatas.append({
-                    "document_id": doc_id,
-                    "filename": filename,
-                    "chunk_index": i,
-                    "chunk_count": len(chunks)
-                })
+                # 大文件的分块是惰性生成的，读取和分块耗时计入提取阶段
+                queue_start = time.perf_counter()
+                busy = writer.encode_seconds + writer.write_seconds
+                try:
+                    result["chunk_count"] = self._queue_chunks(writer, doc_id, filename, item.chunks)
+                except Exception as e:
+                    # 按写入失败处理，统一在下面清理已写入的分块
+                    writer.failed.setdefault(doc_id, str(e))
+                extract_seconds += (time.perf_counter() - queue_start
+                                    - (writer.encode_seconds + writer.write_seconds - busy))
+                total_bytes += item.size
+            results.append(result)
+        
+        writer.flush()
+        
+        # 写入失败的批次可能只写入了部分分块，清理这些文档
+        if writer.failed:
+            self._discard_documents(list(writer.failed))
+            for result in results:
+                doc_id = result["document_id"]
+                if doc_id in writer.failed:
+                    result["success"] = False
+                    result["document_id"] = None
+                    result["error"] = f"添加文档失败: {writer.failed[doc_id]}"
+        
+        # 分块全部写入后再登记文档
+        for result in results:
+            if result["success"]:
+                self.registry.put(result["document_id"], result["filename"], result["chunk_count"],
+                                  sizes[result["document_id"]])
+        
+        wall_seconds = time.perf_counter() - started
+        
+        def rate(count, seconds):
+            return round(count / seconds, 2) if seconds > 0 else 0.0
+        
+        return {
+            "results": results,
+            "stages": {
+                # 提取阶段：cpu_seconds为各文件耗时之和，wait_seconds为编码阶段等待提取结果的时间
+                "extract": {
+                    "files": len(results),
+                    "bytes": total_bytes,
+                    "cpu_seconds": round(extract_seconds, 3),
+                    "wait_seconds": round(wait_seconds, 3),
+                    "files_per_cpu_sec": rate(len(results), extract_seconds)
+                },
+                "encode": {
+                    "chunks": writer.chunks_written,
+                    "seconds": round(writer.encode_seconds, 3),
+                    "chunks_per_sec": rate(writer.chunks_written, writer.encode_seconds)
+                },
+                "write": {
+                    "chunks": writer.chunks_written,
+                    "seconds": round(writer.write_seconds, 3),
+                    "chunks_per_sec": rate(writer.chunks_written, writer.write_seconds)
+                },
+                "total": {
+                    "seconds": round(wall_seconds, 3),
+                    "files_per_sec": rate(len(results), wall_seconds),
+                    "chunks_per_sec": rate(writer.chunks_written, wall_seconds)
+                }
+            }
+        }
+    
+    def _queue_chunks(self, writer: "_ChunkBatchWriter", doc_id: str, filename: str,
+                      chunks: Iterable[str]) -> int:
+        """将文档的分块依次放入批量写入器，返回分块数量
+        
+        chunks 可以是生成器，写入器每凑满一批就编码写入，不需要保留全部分块。
+        """
+        count = 0
+        occurrences: Dict[str, int] = {}
+        for i, chunk in enumerate(chunks):
+            chunk_hash = _chunk_hash(chunk)
+            occurrence = occurrences.get(chunk_hash, 0)
+            occurrences[chunk_hash] = occurrence + 1
+            writer.add(
+                self._chunk_id(doc_id, chunk_hash, occurrence),
+                chunk,
+                self._chunk_metadata(doc_id, filename, i, chunk_hash)
+            )
+            count += 1
+        
+        return count
+    
+    def _chunk_id(self, document_id: str, chunk_hash: str, occurrence: int) -> str:
+        """按内容生成分块ID，内容不变的分块在更新后ID保持不变"""
+        return f"{document_id}_{chunk_hash[:16]}_{occurrence}"
+    
+    def _chunk_metadata(self, document_id: str, filename: str, chunk_index: int, chunk_hash: str) -> Dict[str, Any]:
+        """生成分块元数据"""
+        return {
+            "document_id": document_id,
+            "filename": filename,
+            "chunk_index": chunk_index,
+            "chunk_hash": chunk_hash
+        }
+    
+    def update_document(self, document_id: str, file_path: str, filename: str) -> Dict[str, Any]:
+        """增量更新文档
+        
+        保持文档ID不变，重新分块后按分块哈希与已存储的分块比对：
+        只写入新增或变化的分块，删除已消失的分块，位置变化的分块仅更新元数据。
+        """
+        if self.mode == "simple":
+            return self.simple_kb.update_document(document_id, file_path, filename)
+        self._check_writable()
+        
+        try:
+            chunks = self.doc_processor.iter_file_chunks(file_path)
             
-            # 添加到ChromaDB
-            self.collection.add(
-                embeddings=embeddings,
-                documents=chunks,
-                metadatas=metadatas,
-                ids=chunk_ids
+            # 只读取元数据，早期没有记录分块哈希的分块再单独读取内容计算
+            existing = self.collection.get(
+                where={"document_id": document_id},
+                include=["metadatas"]
             )
+            legacy_ids = [chunk_id for chunk_id, metadata in zip(existing['ids'], existing['metadatas'])
+                          if not metadata.get('chunk_hash')]
+            legacy_hashes = {}
+            if legacy_ids:
+                legacy = self.collection.get(ids=legacy_ids, include=["documents"])
+                legacy_hashes = {chunk_id: _chunk_hash(content)
+                                 for chunk_id, content in zip(legacy['ids'], legacy['documents'])}
             
-            return doc_id
+            # (分块哈希, 同内容出现序号) -> (分块ID, 元数据)
+            stored: Dict[tuple, tuple] = {}
+            occurrences: Dict[str, int] = {}
+            rows = sorted(
+                zip(existing['ids'], existing['metadatas']),
+                key=lambda row: row[1].get('chunk_index', 0)
+            )
+            for chunk_id, metadata in rows:
+                chunk_hash = metadata.get('chunk_hash') or legacy_hashes[chunk_id]
+                occurrence = occurrences.get(chunk_hash, 0)
+                occurrences[chunk_hash] = occurrence + 1
+                stored[(chunk_hash, occurrence)] = (chunk_id, metadata)
+            
+            writer = _ChunkBatchWriter(self)
+            added_ids = []
+            moved_ids = []
+            moved_metadatas = []
+            unchanged = 0
+            occurrences = {}
+            
+            try:
+                for i, chunk in enumerate(chunks):
+                    chunk_hash = _chunk_hash(chunk)
+                    occurrence = occurrences.get(chunk_hash, 0)
+                    occurrences[chunk_hash] = occurrence + 1
+                    metadata = self._chunk_metadata(document_id, filename, i, chunk_hash)
+                    
+                    old = stored.pop((chunk_hash, occurrence), None)
+                    if old is None:
+                        chunk_id = self._chunk_id(document_id, chunk_hash, occurrence)
+                        added_ids.append(chunk_id)
+                        writer.add(chunk_id, chunk, metadata)
+                    elif (old[1].get('chunk_index') != i or old[1].get('filename') != filename
+                            or old[1].get('chunk_hash') != chunk_hash):
+                        moved_ids.append(old[0])
+                        moved_metadatas.append(metadata)
+                    else:
+                        unchanged += 1
+                
+                writer.flush()
+            except Exception as e:
+                writer.failed.setdefault(document_id, str(e))
+            
+            if writer.failed:
+                # 回滚本次新写入的分块，旧版本保持完整
+                if added_ids:
+                    self._delete_chunks(added_ids)
+                raise Exception(writer.failed[document_id])
+            
+            if moved_ids:
+                self.collection.update(ids=moved_ids, metadatas=moved_metadatas)
+            
+            removed_ids = [chunk_id for chunk_id, _ in stored.values()]
+            if removed_ids:
+                self._delete_chunks(removed_ids)
+            self._notify_invalidated(removed_ids + moved_ids)
+            self.registry.put(document_id, filename, len(added_ids) + len(moved_ids) + unchanged,
+                              os.path.getsize(file_path))
+            
+            return {
+                "document_id": document_id,
+                "added": len(added_ids),
+                "removed": len(removed_ids),
+                "updated": len(moved_ids),
+                "unchanged": unchanged
+            }
             
         except Exception as e:
-            raise Exception(f"添加文档失败: {str(e)}")
+            raise Exception(f"更新文档失败: {str(e)}")
+    
+    def _encode(self, texts: List[str]) -> List[List[float]]:
+        """批量生成嵌入，先查嵌入缓存，未命中的文本一次encode调用处理"""
+        if self.embedding_cache is None:
+            return self._encode_uncached(texts)
+        
+        embeddings = self.embedding_cache.get_many(texts)
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        
+        if missing:
+            missing_texts = [texts[i] for i in missing]
+            encoded = self._encode_uncached(missing_texts)
+            self.embedding_cache.put_many(missing_texts, encoded)
+            for i, embedding in zip(missing, encoded):
+                embeddings[i] = embedding
+        
+        return embeddings
+    
+    def _encode_uncached(self, texts: List[str]) -> List[List[float]]:
+        """调用嵌入模型批量编码"""
+        embeddings = self.embedding_model.encode(
+            texts,
+            batch_size=config.EMBEDDING_BATCH_SIZE,
+            convert_to_numpy=True
+        )
+        # ChromaDB 0.4 校验嵌入必须为list，整批矩阵一次性转换
+        return embeddings.tolist()
+    
+    def _discard_documents(self, document_ids: List[str]):
+        """删除写入失败的文档残留分块"""
+        for doc_id in document_ids:
+            try:
+                chunk_ids = self.collection.get(where={"document_id": doc_id}, include=[])['ids']
+                if chunk_ids:
+                    self._delete_chunks(chunk_ids)
+                    self._notify_invalidated(chunk_ids)
+                self.registry.remove(doc_id)
+            except Exception as e:
+                print(f"❌ 清理文档残留分块失败 {doc_id}: {e}")
+    
+    def _delete_chunks(self, chunk_ids: List[str]):
+        """从向量库和关键词索引中删除分块"""
+        self.collection.delete(ids=chunk_ids)
+        if self.lexical_index is not None:
+            self.lexical_index.remove(chunk_ids)
+    
+    def _notify_invalidated(self, chunk_ids: List[str]):
+        """通知分块已被删除或重新索引，并记入变更记录（只读进程据此失效各自的缓存）"""
+        if chunk_ids:
+            self.registry.log_change(chunk_ids)
+            self._run_invalidation_callback(chunk_ids)
+    
+    def _run_invalidation_callback(self, chunk_ids: Optional[List[str]]):
+        if self.invalidation_callback is not None:
+            try:
+                self.invalidation_callback(chunk_ids)
+            except Exception as e:
+                print(f"❌ 分块失效回调失败: {e}")
+    
+    def _check_writable(self):
+        if self.read_only:
+            raise Exception("知识库以只读方式打开，写入需由索引进程完成")
+    
+    def refresh(self) -> bool:
+        """读取索引进程写入的变更（只读模式），返回是否有变更
+        
+        平铺向量存储和关键词索引每次查询时读取最新数据，这里刷新文档计数，并使依赖已失效分块的缓存失效
+        （变更记录不完整时以None调用失效回调，表示全部失效）。
+        """
+        if self.mode == "simple":
+            return False
+        changed, invalidated = self.registry.poll_changes()
+        if changed and (invalidated is None or invalidated):
+            self._run_invalidation_callback(invalidated)
+        return changed
+    
+    def start_refresh(self, interval: float = None):
+        """启动后台线程，每隔interval秒（默认config.INDEX_REFRESH_INTERVAL）读取一次索引进程的变更"""
+        interval = interval or config.INDEX_REFRESH_INTERVAL
+        
+        def loop():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.refresh()
+                except Exception as e:
+                    print(f"❌ 读取索引变更失败: {e}")
+        
+        threading.Thread(target=loop, daemon=True).start()
+    
+    def warm_up(self):
+        """预热：编码一条查询并检索一次，嵌入模型的首次推理和向量索引的加载不再由第一个请求承担"""
+        if self.mode == "simple":
+            return
+        embedding = self._encode_uncached([config.WARMUP_QUERY])[0]
+        if self.collection.count() > 0:
+            self.collection.query(query_embeddings=[embedding], n_results=1, include=["distances"])
+    
+    def embed_query(self, query: str) -> Optional[List[float]]:
+        """生成查询嵌入，简化模式下返回None"""
+        if self.mode == "simple":
+            return None
+        return self.query_encoder.encode(query)
     
-    def search(self, query: str, top_k: int = config.TOP_K_RESULTS) -> List[Dict[str, Any]]:
-        """搜索相关文档"""
+    def embed_queries(self, queries: List[str]) -> Optional[List[List[float]]]:
+        """一次encode调用生成多条查询的嵌入，简化模式下返回None"""
+        if self.mode == "simple":
+            return None
+        return self.query_encoder.encode_many(queries)
+    
+    def search(self, query: str, top_k: int = config.TOP_K_RESULTS,
+               query_embedding: Optional[List[float]] = None) -> List[Dict[str, Any]]:
+        """搜索相关文档（已生成查询嵌入时可通过query_embedding传入，避免重复编码）"""
         if self.mode == "simple":
             return self.simple_kb.search(query, top_k)
         
         try:
-            # 生成查询嵌入
-            query_embedding = self.embedding_model.encode(query).tolist()
+            started = time.perf_counter()
             
-            # 搜索
-            results = self.collection.query(
-                query_embeddings=[query_embedding],
-                n_results=top_k,
-                include=["documents", "metadatas", "distances"]
-            )
+            # 生成查询嵌入（并发的查询合并为一批编码）
+            if query_embedding is None:
+                query_embedding = self.embed_query(query)
+            
+            search_results = self._vector_search([query], [query_embedding], top_k)[0]
+            self._search_latencies.append(time.perf_counter() - started)
+            return search_results
+        
+        except Exception as e:
+            raise Exception(f"搜索失败: {str(e)}")
+    
+    def search_many(self, queries: List[str], top_k: int = config.TOP_K_RESULTS,
+                    query_embeddings: Optional[List[List[float]]] = None) -> List[List[Dict[str, Any]]]:
+        """批量搜索：所有查询一次编码、一次向量库查询，返回与queries对应的结果列表"""
+        if self.mode == "simple":
+            return [self.simple_kb.search(query, top_k) for query in queries]
+        if not queries:
+            return []
+        
+        try:
+            started = time.perf_counter()
+            if query_embeddings is None:
+                query_embeddings = self.embed_queries(queries)
             
+            search_results = self._vector_search(queries, query_embeddings, top_k)
+            # 按平均每条查询的耗时计入检索延迟统计
+            elapsed = (time.perf_counter() - started) / len(queries)
+            self._search_latencies.extend([elapsed] * len(queries))
+            return search_results
+        
+        except Exception as e:
+            raise Exception(f"批量搜索失败: {str(e)}")
+    
+    def _vector_search(self, queries: List[str], query_embeddings: List[List[float]],
+                       top_k: int) -> List[List[Dict[str, Any]]]:
+        """一次向量库查询检索多条查询，启用混合检索时逐条与BM25结果融合"""
+        # 启用混合检索时多取一些候选参与融合
+        candidates = max(top_k, config.HYBRID_CANDIDATES) if self.lexical_index is not None else top_k
+        candidates = min(candidates, max(1, self.collection.count()))  # 不超过分块总数，避免ChromaDB告警
+        results = self.collection.query(
+            query_embeddings=query_embeddings,
+            n_results=candidates,
+            include=["documents", "metadatas", "distances"]
+        )
+        
+        all_results = []
+        for q, (query, query_embedding) in enumerate(zip(queries, query_embeddings)):
             # 格式化结果
             search_results = []
-            for i in range(len(results['documents'][0])):
+            for i in range(len(results['documents'][q])):
                 search_results.append({
-                    "content": results['documents'][0][i],
-                    "metadata": results['metadatas'][0][i],
-                    "similarity": 1 - results['distances'][0][i]  # 转换为相似度分数
+                    "id": results['ids'][q][i],
+                    "content": results['documents'][q][i],
+                    "metadata": results['metadatas'][q][i],
+                    "similarity": 1 - results['distances'][q][i]  # 转换为相似度分数
                 })
             
-            return search_results
-            
-        except Exception as e:
-            raise Exception(f"搜索失败: {str(e)}")
+            if self.lexical_index is not None:
+                search_results = self._fuse(query, query_embedding, search_results, top_k)
+            all_results.append(search_results)
+        return all_results
+    
+    def _fuse(self, query: str, query_embedding: List[float], vector_results: List[Dict[str, Any]],
+              top_k: int) -> List[Dict[str, Any]]:
+        """倒数排名融合（RRF）：分块得分为 Σ 1/(k + 在向量检索和BM25检索中的排名)
+        
+        score 为融合得分除以两路均排第一时的得分（0~1）；只被BM25检索到的分块
+        从向量库读取内容，并用其嵌入计算与查询的相似度。
+        """
+        k = config.HYBRID_RRF_K
+        lexical_hits = self.lexical_index.search(query, max(top_k, config.HYBRID_CANDIDATES))
+        
+        scores: Dict[str, float] = {}
+        for rank, result in enumerate(vector_results, 1):
+            scores[result["id"]] = scores.get(result["id"], 0.0) + 1 / (k + rank)
+        for rank, (chunk_id, _) in enumerate(lexical_hits, 1):
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + 1 / (k + rank)
+        ranked = sorted(scores, key=scores.get, reverse=True)[:top_k]
+        
+        by_id = {result["id"]: result for result in vector_results}
+        missing = [chunk_id for chunk_id in ranked if chunk_id not in by_id]
+        if missing:
+            fetched = self.collection.get(ids=missing, include=["documents", "metadatas", "embeddings"])
+            query_vector = np.asarray(query_embedding, dtype=np.float32)
+            query_norm = np.linalg.norm(query_vector) or 1.0
+            for chunk_id, content, metadata, embedding in zip(fetched['ids'], fetched['documents'],
+                                                              fetched['metadatas'], fetched['embeddings']):
+                vector = np.asarray(embedding, dtype=np.float32)
+                by_id[chunk_id] = {
+                    "id": chunk_id,
+                    "content": content,
+                    "metadata": metadata,
+                    "similarity": float(vector @ query_vector / ((np.linalg.norm(vector) or 1.0) * query_norm))
+                }
+        
+        best = 2 / (k + 1)
+        fused = []
+        for chunk_id in ranked:
+            if chunk_id in by_id:  # 关键词索引中残留的已删除分块
+                fused.append({**by_id[chunk_id], "score": round(scores[chunk_id] / best, 4)})
+        return fused
     
     def delete_document(self, document_id: str) -> bool:
         """删除文档"""
         if self.mode == "simple":
             return self.simple_kb.delete_document(document_id)
+        self._check_writable()
         
         try:
             # 查找所有相关的块
             results = self.collection.get(
-                where={"document_id": document_id}
+                where={"document_id": document_id},
+                include=[]
             )
             
             if results['ids']:
                 # 删除所有块
-                self.collection.delete(ids=results['ids'])
-                return True
-            return False
+                self._delete_chunks(results['ids'])
+                self._notify_invalidated(results['ids'])
+            registered = self.registry.remove(document_id)
+            return bool(results['ids']) or registered
             
         except Exception as e:
             raise Exception(f"删除文档失败: {str(e)}")
     
-    def list_documents(self) -> List[Dict[str, Any]]:
-        """列出所有文档"""
+    def delete_documents(self, document_ids: List[str]) -> List[str]:
+        """批量删除文档，返回实际删除的文档ID
+        
+        每批文档的分块用一次 $in 查询找出、一次delete删除，不再逐个文档往返向量库。
+        """
         if self.mode == "simple":
-            return self.simple_kb.list_documents()
+            return [doc_id for doc_id in document_ids if self.simple_kb.delete_document(doc_id)]
+        self._check_writable()
         
         try:
-            # 获取所有元数据
-            results = self.collection.get(include=["metadatas"])
-            
-            # 按文档ID分组
-            documents = {}
-            for metadata in results['metadatas']:
-                doc_id = metadata['document_id']
-                if doc_id not in documents:
-                    documents[doc_id] = {
-                        "id": doc_id,
-                        "filename": metadata['filename'],
-                        "chunk_count": metadata['chunk_count']
-                    }
-            
-            return list(documents.values())
-            
+            document_ids = list(dict.fromkeys(document_ids))
+            deleted = []
+            for i in range(0, len(document_ids), self._DELETE_BATCH):
+                batch = document_ids[i:i + self._DELETE_BATCH]
+                results = self.collection.get(where={"document_id": {"$in": batch}}, include=["metadatas"])
+                found = {metadata['document_id'] for metadata in results['metadatas']}
+                if results['ids']:
+                    self._delete_chunks(results['ids'])
+                    self._notify_invalidated(results['ids'])
+                for doc_id in batch:
+                    if self.registry.remove(doc_id) or doc_id in found:
+                        deleted.append(doc_id)
+            return deleted
+        
+        except Exception as e:
+            raise Exception(f"批量删除文档失败: {str(e)}")
+    
+    def list_documents(self, offset: int = 0, limit: Optional[int] = None,
+                       filename: Optional[str] = None) -> List[Dict[str, Any]]:
+        """分页列出文档（按导入顺序），filename为文件名子串"""
+        if self.mode == "simple":
+            return self.simple_kb.list_documents(offset, limit, filename)
+        
+        try:
+            return self.registry.list(offset, limit, filename)
         except Exception as e:
             raise Exception(f"获取文档列表失败: {str(e)}")
     
+    def count_documents(self, filename: Optional[str] = None) -> int:
+        """文档数，filename为文件名子串"""
+        if self.mode == "simple":
+            return self.simple_kb.count_documents(filename)
+        return self.registry.count(filename)
+    
     def get_stats(self) -> Dict[str, Any]:
         """获取知识库统计信息"""
         if self.mode == "simple":
             return self.simple_kb.get_stats()
         
         try:
-            count = self.collection.count()
-            documents = self.list_documents()
-            
-            return {
-                "total_chunks": count,
-                "total_documents": len(documents),
-                "documents": documents
+            # 总数来自登记表的计数器，不扫描分块
+            stats = {
+                "total_chunks": self.registry.total_chunks,
+                "total_documents": self.registry.count()
             }
+            if self.embedding_cache is not None:
+                stats["embedding_cache"] = self.embedding_cache.stats()
+            stats["query_encoder"] = self.query_encoder.stats()
+            if isinstance(self.collection, FlatVectorStore):
+                stats["vector_store"] = self.collection.stats()
+            else:
+                stats["vector_store"] = {"backend": "chroma", "path": self.db_path, "count": self.collection.count()}
+            if self.lexical_index is not None:
+                stats["lexical_index"] = self.lexical_index.stats()
+            stats["search_latency_ms"] = self._search_latency_stats()
+            
+            return stats
             
         except Exception as e:
-            raise Exception(f"获取统计信息失败: {str(e)}") 
\ No newline at end of file
+            raise Exception(f"获取统计信息失败: {str(e)}") 
+    
+    def _search_latency_stats(self) -> Dict[str, float]:
+        """最近检索耗时的分位数（毫秒）"""
+        latencies = sorted(self._search_latencies)
+        
+        def percentile(p: float) -> float:
+            if not latencies:
+                return 0.0
+            return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000, 2)
+        
+        return {
+            "samples": len(latencies),
+            "p50": percentile(0.5),
+            "p95": percentile(0.95),
+            "p99": percentile(0.99),
+            "max": round(latencies[-1] * 1000, 2) if latencies else 0.0
+        }
+
+class _ChunkBatchWriter:
+    """批量写入器：跨文档累积分块，凑满一批后统一编码并写入ChromaDB"""
+    
+    def __init__(self, kb: KnowledgeBase, batch_size: int = None):
+        self.kb = kb
+        self.batch_size = batch_size or config.EMBEDDING_BATCH_SIZE
+        self.ids: List[str] = []
+        self.texts: List[str] = []
+        self.metadatas: List[Dict[str, Any]] = []
+        self.failed: Dict[str, str] = {}  # 文档ID -> 错误信息
+        self.chunks_written = 0
+        self.encode_seconds = 0.0
+        self.write_seconds = 0.0
+    
+    def add(self, chunk_id: str, text: str, metadata: Dict[str, Any]):
+        """加入一个分块，缓冲区满时自动写入"""
+        self.ids.append(chunk_id)
+        self.texts.append(text)
+        self.metadatas.append(metadata)
+        if len(self.ids) >= self.batch_size:
+            self.flush()
+    
+    def flush(self):
+        """编码并写入缓冲区中的所有分块"""
+        if not self.ids:
+            return
+        
+        ids, texts, metadatas = self.ids, self.texts, self.metadatas
+        self.ids, self.texts, self.metadatas = [], [], []
+        
+        try:
+            encode_start = time.perf_counter()
+            embeddings = self.kb._encode(texts)
+            write_start = time.perf_counter()
+            self.kb.collection.add(
+                embeddings=embeddings,
+                documents=texts,
+                metadatas=metadatas,
+                ids=ids
+            )
+            if self.kb.lexical_index is not None:
+                self.kb.lexical_index.add_many(
+                    zip(ids, (metadata["document_id"] for metadata in metadatas), texts)
+                )
+            self.encode_seconds += write_start - encode_start
+            self.write_seconds += time.perf_counter() - write_start
+            self.chunks_written += len(ids)
+        except Exception as e:
+            for metadata in metadatas:
+                self.failed.setdefault(metadata["document_id"], str(e))
+            return
+        
+        if self.kb.progress_callback is not None:
+            self.kb.progress_callback(len(ids))
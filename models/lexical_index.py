@@ -0,0 +1,147 @@
+"""
+关键词倒排索引 - 基于SQLite FTS5的BM25检索，弥补向量检索对人名、课程代码等精确词的遗漏
+"""
+import os
+import re
+import sqlite3
+import threading
+from typing import List, Dict, Any, Iterable, Tuple
+
+# 英文单词/数字（课程代码等）和中日韩文字片段
+_WORD_PATTERN = re.compile(r"[a-z0-9]+")
+_CJK_PATTERN = re.compile(r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff]+")
+
+def tokenize(text: str) -> List[str]:
+    """分词：英文按单词（转小写），中日韩文字按相邻两字切分（单字片段保留单字）"""
+    text = text.lower()
+    tokens = _WORD_PATTERN.findall(text)
+    for run in _CJK_PATTERN.findall(text):
+        if len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+class LexicalIndex:
+    """BM25倒排索引
+    
+    分块文本按 tokenize 分词后以空格连接写入FTS5全文索引，查询时由FTS5的bm25()打分。
+    索引随分块的写入和删除增量维护；path为":memory:"时只保存在内存中。
+    """
+    
+    # SQLite单条语句的参数数量有限，批量删除时分段执行
+    _QUERY_BATCH = 500
+    
+    def __init__(self, path: str = ":memory:"):
+        self.path = path
+        self.searches = 0
+        self._lock = threading.Lock()
+        
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        if path != ":memory:":
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+        # chunk_map的rowid与全文索引的rowid一致，按分块ID或文档ID删除时不需要扫描全文索引
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS chunk_map (
+                rowid INTEGER PRIMARY KEY,
+                chunk_id TEXT NOT NULL UNIQUE,
+                document_id TEXT
+            )
+        """)
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_chunk_map_document ON chunk_map(document_id)"
+        )
+        self.conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS chunk_terms USING fts5(terms)")
+        self.conn.commit()
+    
+    def add_many(self, rows: Iterable[Tuple[str, str, str]]):
+        """批量写入 (分块ID, 文档ID, 文本)，已存在的分块ID会被覆盖"""
+        rows = list(rows)
+        if not rows:
+            return
+        
+        with self._lock:
+            self._delete_ids([chunk_id for chunk_id, _, _ in rows])
+            for chunk_id, document_id, text in rows:
+                cursor = self.conn.execute(
+                    "INSERT INTO chunk_map (chunk_id, document_id) VALUES (?, ?)",
+                    (chunk_id, document_id)
+                )
+                self.conn.execute(
+                    "INSERT INTO chunk_terms (rowid, terms) VALUES (?, ?)",
+                    (cursor.lastrowid, " ".join(tokenize(text)))
+                )
+            self.conn.commit()
+    
+    def remove(self, chunk_ids: Iterable[str]):
+        """删除分块"""
+        chunk_ids = list(chunk_ids)
+        if not chunk_ids:
+            return
+        
+        with self._lock:
+            self._delete_ids(chunk_ids)
+            self.conn.commit()
+    
+    def remove_document(self, document_id: str):
+        """删除文档的所有分块"""
+        with self._lock:
+            self.conn.execute(
+                "DELETE FROM chunk_terms WHERE rowid IN (SELECT rowid FROM chunk_map WHERE document_id = ?)",
+                (document_id,)
+            )
+            self.conn.execute("DELETE FROM chunk_map WHERE document_id = ?", (document_id,))
+            self.conn.commit()
+    
+    def _delete_ids(self, chunk_ids: List[str]):
+        """按分块ID删除（调用方持有锁）"""
+        for i in range(0, len(chunk_ids), self._QUERY_BATCH):
+            batch = chunk_ids[i:i + self._QUERY_BATCH]
+            placeholders = ",".join("?" * len(batch))
+            self.conn.execute(
+                f"DELETE FROM chunk_terms WHERE rowid IN "
+                f"(SELECT rowid FROM chunk_map WHERE chunk_id IN ({placeholders}))",
+                batch
+            )
+            self.conn.execute(f"DELETE FROM chunk_map WHERE chunk_id IN ({placeholders})", batch)
+    
+    def search(self, query: str, top_k: int = 5) -> List[Tuple[str, float]]:
+        """BM25检索，返回按得分从高到低排列的 (分块ID, 得分)"""
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms:
+            return []
+        
+        # 任一词命中即参与排序，得分由bm25()计算（值越小越相关，取反后返回）
+        match = " OR ".join(f'"{term}"' for term in terms)
+        with self._lock:
+            self.searches += 1
+            rows = self.conn.execute(
+                "SELECT chunk_map.chunk_id, bm25(chunk_terms) AS rank FROM chunk_terms "
+                "JOIN chunk_map ON chunk_map.rowid = chunk_terms.rowid "
+                "WHERE chunk_terms MATCH ? ORDER BY rank LIMIT ?",
+                (match, top_k)
+            ).fetchall()
+        return [(chunk_id, -rank) for chunk_id, rank in rows]
+    
+    def count(self) -> int:
+        """索引中的分块数"""
+        with self._lock:
+            return self.conn.execute("SELECT COUNT(*) FROM chunk_map").fetchone()[0]
+    
+    def clear(self):
+        """清空索引"""
+        with self._lock:
+            self.conn.execute("DELETE FROM chunk_terms")
+            self.conn.execute("DELETE FROM chunk_map")
+            self.conn.commit()
+    
+    def stats(self) -> Dict[str, Any]:
+        """获取索引统计信息"""
+        return {
+            "entries": self.count(),
+            "searches": self.searches
+        }
@@ -0,0 +1,131 @@
+"""
+查询向量编码 - 合并并发的查询编码请求批量执行，并缓存最近的查询向量
+"""
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Dict, Any, List, Optional, Tuple
+
+class QueryEncoder:
+    """查询编码器
+    
+    单条文本编码无法利用模型的批处理能力。encode在调用线程中阻塞等待，
+    后台线程收集window_ms毫秒内到达的请求（最多max_batch条）合并为一次encode调用；
+    window_ms为0时直接在调用线程中编码。最近的查询向量按LRU缓存，重复查询不再编码。
+    """
+    
+    def __init__(self, model, window_ms: float = 5, max_batch: int = 32, cache_size: int = 10000):
+        self.model = model
+        self.window = max(0.0, window_ms) / 1000
+        self.max_batch = max(1, max_batch)
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._queue: "queue.Queue[Tuple[str, Future]]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._thread_lock = threading.Lock()
+        self.requests = 0
+        self.cache_hits = 0
+        self.batches = 0
+        self.encoded = 0  # 实际编码的文本数（批内重复的查询只编码一次）
+    
+    def encode(self, query: str) -> List[float]:
+        """编码一条查询"""
+        self.requests += 1
+        cached = self._cache_get(query)
+        if cached is not None:
+            self.cache_hits += 1
+            return cached
+        
+        if self.window <= 0:
+            return self._encode_batch([query])[0]
+        
+        self._ensure_thread()
+        future: Future = Future()
+        self._queue.put((query, future))
+        return future.result()
+    
+    def encode_many(self, queries: List[str]) -> List[List[float]]:
+        """编码一组查询：未缓存的查询在调用线程中一次encode调用完成（批量问答等场景）"""
+        self.requests += len(queries)
+        vectors: Dict[str, List[float]] = {}
+        for query in queries:
+            if query not in vectors:
+                cached = self._cache_get(query)
+                if cached is not None:
+                    vectors[query] = cached
+        self.cache_hits += sum(1 for query in queries if query in vectors)
+        
+        missing = [query for query in dict.fromkeys(queries) if query not in vectors]
+        if missing:
+            vectors.update(zip(missing, self._encode_batch(missing)))
+        return [vectors[query] for query in queries]
+    
+    def _ensure_thread(self):
+        """启动后台批处理线程"""
+        if self._thread is None or not self._thread.is_alive():
+            with self._thread_lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._run, name="query-encoder", daemon=True)
+                    self._thread.start()
+    
+    def _run(self):
+        """收集一个时间窗口内的请求，合并编码"""
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.perf_counter() + self.window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            
+            texts = list(dict.fromkeys(query for query, _ in batch))
+            try:
+                vectors = dict(zip(texts, self._encode_batch(texts)))
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for query, future in batch:
+                future.set_result(vectors[query])
+    
+    def _encode_batch(self, texts: List[str]) -> List[List[float]]:
+        """调用模型批量编码并写入缓存"""
+        embeddings = self.model.encode(texts, batch_size=len(texts), convert_to_numpy=True).tolist()
+        self.batches += 1
+        self.encoded += len(texts)
+        with self._cache_lock:
+            for text, embedding in zip(texts, embeddings):
+                self._cache[text] = embedding
+                self._cache.move_to_end(text)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return embeddings
+    
+    def _cache_get(self, query: str) -> Optional[List[float]]:
+        """查询缓存"""
+        with self._cache_lock:
+            embedding = self._cache.get(query)
+            if embedding is not None:
+                self._cache.move_to_end(query)
+            return embedding
+    
+    def stats(self) -> Dict[str, Any]:
+        """获取编码统计信息"""
+        return {
+            "window_ms": round(self.window * 1000, 3),
+            "max_batch": self.max_batch,
+            "requests": self.requests,
+            "cache_entries": len(self._cache),
+            "cache_hits": self.cache_hits,
+            "cache_hit_rate": round(self.cache_hits / self.requests, 4) if self.requests else 0.0,
+            "batches": self.batches,
+            "encoded": self.encoded,
+            "avg_batch_size": round(self.encoded / self.batches, 2) if self.batches else 0.0
+        }
@@ -0,0 +1,397 @@
+"""
+平铺向量存储 - 嵌入保存在内存映射的 .npy 文件中，检索为向量化点积 + argpartition
+"""
+import os
+import json
+import sqlite3
+import threading
+from typing import List, Dict, Any, Optional, Iterable
+import numpy as np
+
+class FlatVectorStore:
+    """基于内存映射的暴力检索向量存储
+    
+    提供 KnowledgeBase 使用的 ChromaDB collection 接口子集（add / get / update / delete / query / count），
+    可以直接替换 collection。归一化后的嵌入按行保存在 vectors.npy（float32，或按行缩放量化为int8，
+    缩放系数保存在 scales.npy），alive.npy 标记有效行，分块ID、文本和元数据保存在旁边的SQLite表中，行号与矩阵行对应。
+    检索时分块计算点积，用argpartition取前k个。多个进程打开同一目录时共享操作系统的页缓存，
+    每次读取前检查文件和行数的变化，只读打开（read_only）的进程可以看到写入进程新写入的数据。
+    距离为余弦距离（1 - 余弦相似度），与ChromaDB的 hnsw:space=cosine 一致。
+    """
+    
+    _INITIAL_CAPACITY = 1024
+    _QUERY_BATCH = 500  # SQLite单条语句的参数数量有限，批量查询时分段执行
+    _QUERY_GROUP = 32  # 多条查询时每组一起计算点积（矩阵乘法），得分矩阵为 组大小 x 行数
+    
+    def __init__(self, path: str, quantize: bool = False, block_rows: int = 4096, read_only: bool = False):
+        self.path = path
+        self.block_rows = max(1, block_rows)
+        self.read_only = read_only
+        self._lock = threading.RLock()  # 保护SQLite连接和映射切换，点积计算在锁外进行
+        os.makedirs(path, exist_ok=True)
+        
+        self.conn = sqlite3.connect(os.path.join(path, "meta.sqlite3"), check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS chunks (
+                row INTEGER PRIMARY KEY,
+                id TEXT NOT NULL UNIQUE,
+                document_id TEXT,
+                document TEXT,
+                metadata TEXT
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_chunks_document ON chunks(document_id)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS free_rows (row INTEGER PRIMARY KEY)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT)")
+        self.conn.commit()
+        
+        # 已有索引沿用创建时的存储格式
+        stored = self._setting("dtype")
+        self.dtype = np.dtype(stored) if stored else np.dtype(np.int8 if quantize else np.float32)
+        if not read_only:
+            self._set_setting("dtype", self.dtype.name)
+        self.size = int(self._setting("size") or 0)  # 已使用的行数（含已删除的空行）
+        
+        self._vectors: Optional[np.ndarray] = None
+        self._scales: Optional[np.ndarray] = None
+        self._alive: Optional[np.ndarray] = None
+        self._mapped_stat = None
+        self._open_arrays()
+    
+    # 设置
+    
+    def _setting(self, key: str) -> Optional[str]:
+        row = self.conn.execute("SELECT value FROM settings WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+    
+    def _set_setting(self, key: str, value: Any):
+        self.conn.execute("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)", (key, str(value)))
+        self.conn.commit()
+    
+    # 内存映射文件
+    
+    @property
+    def _vectors_path(self) -> str:
+        return os.path.join(self.path, "vectors.npy")
+    
+    @property
+    def _scales_path(self) -> str:
+        return os.path.join(self.path, "scales.npy")
+    
+    @property
+    def _alive_path(self) -> str:
+        return os.path.join(self.path, "alive.npy")
+    
+    @property
+    def _quantized(self) -> bool:
+        return self.dtype == np.int8
+    
+    def _open_arrays(self):
+        """映射已有的向量文件（只读打开时映射为只读）"""
+        if os.path.exists(self._vectors_path) and os.path.exists(self._alive_path):
+            mode = "r" if self.read_only else "r+"
+            self._vectors = np.load(self._vectors_path, mmap_mode=mode)
+            self._alive = np.load(self._alive_path, mmap_mode=mode)
+            if self._quantized:
+                self._scales = np.load(self._scales_path, mmap_mode=mode)
+            self._mapped_stat = self._stat()
+    
+    def _stat(self):
+        stat = os.stat(self._vectors_path)
+        return (stat.st_ino, stat.st_size)
+    
+    def _refresh(self):
+        """其他进程扩容或写入后重新映射文件，并读取最新的行数"""
+        if not os.path.exists(self._vectors_path):
+            return
+        if self._vectors is None or self._stat() != self._mapped_stat:
+            self._open_arrays()
+        self.size = int(self._setting("size") or 0)
+    
+    def _ensure_capacity(self, rows: int, dim: int):
+        """保证可以写入到第rows行，容量不足时按两倍扩容（写入新文件后替换，已有映射不受影响）"""
+        if self._vectors is not None:
+            if self._vectors.shape[1] != dim:
+                raise ValueError(f"嵌入维度不一致: 索引为 {self._vectors.shape[1]}，写入为 {dim}")
+            if rows <= self._vectors.shape[0]:
+                return
+        
+        capacity = self._INITIAL_CAPACITY if self._vectors is None else self._vectors.shape[0]
+        while capacity < rows:
+            capacity *= 2
+        
+        vectors = np.lib.format.open_memmap(self._vectors_path + ".tmp", mode="w+", dtype=self.dtype,
+                                            shape=(capacity, dim))
+        alive = np.lib.format.open_memmap(self._alive_path + ".tmp", mode="w+", dtype=np.uint8,
+                                          shape=(capacity,))
+        scales = None
+        if self._quantized:
+            scales = np.lib.format.open_memmap(self._scales_path + ".tmp", mode="w+", dtype=np.float32,
+                                               shape=(capacity,))
+        if self._vectors is not None:
+            vectors[:self.size] = self._vectors[:self.size]
+            alive[:self.size] = self._alive[:self.size]
+            if scales is not None:
+                scales[:self.size] = self._scales[:self.size]
+        for array in (vectors, alive, scales):
+            if array is not None:
+                array.flush()
+        del vectors, alive, scales
+        # 向量文件最后替换，其他进程发现它变化时其余文件已就绪
+        if self._quantized:
+            os.replace(self._scales_path + ".tmp", self._scales_path)
+        os.replace(self._alive_path + ".tmp", self._alive_path)
+        os.replace(self._vectors_path + ".tmp", self._vectors_path)
+        self._open_arrays()
+    
+    def _encode_rows(self, embeddings: np.ndarray):
+        """归一化，按存储格式量化，返回 (行向量, 每行缩放系数)；float32存储时缩放系数为None"""
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        embeddings = embeddings / np.where(norms > 0, norms, 1.0)
+        if not self._quantized:
+            return embeddings.astype(np.float32), None
+        # 每行按最大绝对值缩放到 [-127, 127]，比统一缩放保留更多精度
+        peaks = np.abs(embeddings).max(axis=1, keepdims=True)
+        scales = np.where(peaks > 0, peaks, 1.0) / 127.0
+        return np.rint(embeddings / scales).astype(np.int8), scales[:, 0].astype(np.float32)
+    
+    def _decode_rows(self, rows: np.ndarray) -> np.ndarray:
+        """按行号还原为float32（归一化后的）嵌入"""
+        if self._quantized:
+            return self._vectors[rows].astype(np.float32) * self._scales[rows][:, None]
+        return np.asarray(self._vectors[rows], dtype=np.float32)
+    
+    # collection 接口
+    
+    def count(self) -> int:
+        """分块数"""
+        with self._lock:
+            return self.conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+    
+    def add(self, ids: List[str], embeddings: List[List[float]], documents: List[str] = None,
+            metadatas: List[Dict[str, Any]] = None):
+        """写入分块，已存在的ID被忽略（与ChromaDB一致）"""
+        self._check_writable()
+        if not ids:
+            return
+        documents = documents or [None] * len(ids)
+        metadatas = metadatas or [{}] * len(ids)
+        
+        with self._lock:
+            self._refresh()
+            existing = set(self._lookup_rows(ids))
+            items = [(chunk_id, embedding, document, metadata)
+                     for chunk_id, embedding, document, metadata in zip(ids, embeddings, documents, metadatas)
+                     if chunk_id not in existing]
+            if not items:
+                return
+            
+            vectors, scales = self._encode_rows(np.asarray([item[1] for item in items], dtype=np.float32))
+            
+            # 优先复用已删除的行
+            free = [row for (row,) in self.conn.execute("SELECT row FROM free_rows ORDER BY row LIMIT ?",
+                                                        (len(items),))]
+            rows = free + list(range(self.size, self.size + len(items) - len(free)))
+            new_size = max(self.size, max(rows) + 1)
+            self._ensure_capacity(new_size, vectors.shape[1])
+            
+            row_array = np.asarray(rows)
+            self._vectors[row_array] = vectors
+            self._vectors.flush()
+            if scales is not None:
+                self._scales[row_array] = scales
+                self._scales.flush()
+            self._alive[row_array] = 1
+            self._alive.flush()
+            
+            if free:
+                self.conn.executemany("DELETE FROM free_rows WHERE row = ?", [(row,) for row in free])
+            self.conn.executemany(
+                "INSERT INTO chunks (row, id, document_id, document, metadata) VALUES (?, ?, ?, ?, ?)",
+                [(row, chunk_id, (metadata or {}).get("document_id"), document, json.dumps(metadata or {}))
+                 for row, (chunk_id, _, document, metadata) in zip(rows, items)]
+            )
+            self.size = new_size
+            self.conn.execute("INSERT OR REPLACE INTO settings (key, value) VALUES ('size', ?)", (str(new_size),))
+            self.conn.commit()
+    
+    def update(self, ids: List[str], metadatas: List[Dict[str, Any]]):
+        """更新分块元数据"""
+        self._check_writable()
+        with self._lock:
+            self.conn.executemany(
+                "UPDATE chunks SET metadata = ?, document_id = ? WHERE id = ?",
+                [(json.dumps(metadata), metadata.get("document_id"), chunk_id)
+                 for chunk_id, metadata in zip(ids, metadatas)]
+            )
+            self.conn.commit()
+    
+    def delete(self, ids: List[str] = None, where: Dict[str, Any] = None):
+        """按ID或 {"document_id": ...} 删除分块"""
+        self._check_writable()
+        with self._lock:
+            self._refresh()
+            rows = list(self._lookup_rows(ids).values()) if ids else self._where_rows(where)
+            if not rows:
+                return
+            if self._alive is not None:
+                self._alive[np.asarray(rows)] = 0
+                self._alive.flush()
+            for i in range(0, len(rows), self._QUERY_BATCH):
+                batch = rows[i:i + self._QUERY_BATCH]
+                self.conn.execute(f"DELETE FROM chunks WHERE row IN ({','.join('?' * len(batch))})", batch)
+            self.conn.executemany("INSERT OR IGNORE INTO free_rows (row) VALUES (?)", [(row,) for row in rows])
+            self.conn.commit()
+    
+    def get(self, ids: List[str] = None, where: Dict[str, Any] = None, include: Iterable[str] = None,
+            limit: int = None, offset: int = None) -> Dict[str, Any]:
+        """按ID、{"document_id": ...} 或分页读取分块"""
+        include = ["metadatas", "documents"] if include is None else list(include)
+        with self._lock:
+            self._refresh()
+            if ids is not None:
+                found = self._fetch_rows(list(self._lookup_rows(ids).values()))
+                by_id = {row[1]: row for row in found}
+                records = [by_id[chunk_id] for chunk_id in ids if chunk_id in by_id]
+            elif where:
+                records = self._fetch_rows(self._where_rows(where))
+            else:
+                records = self.conn.execute(
+                    "SELECT row, id, document, metadata FROM chunks ORDER BY row LIMIT ? OFFSET ?",
+                    (-1 if limit is None else limit, offset or 0)
+                ).fetchall()
+            return self._format(records, include)
+    
+    def query(self, query_embeddings: List[List[float]], n_results: int = 10,
+              include: Iterable[str] = None) -> Dict[str, Any]:
+        """暴力检索余弦距离最小的n_results个分块，多条查询按组以矩阵乘法一起计算"""
+        include = ["metadatas", "documents", "distances"] if include is None else list(include)
+        with self._lock:
+            self._refresh()
+            arrays = (self._vectors, self._scales, self._alive, self.size)
+        
+        results = {"ids": [], "documents": [], "metadatas": [], "distances": [], "embeddings": []}
+        top = []
+        for start in range(0, len(query_embeddings), self._QUERY_GROUP):
+            group = np.asarray(query_embeddings[start:start + self._QUERY_GROUP], dtype=np.float32)
+            top.extend(self._top_k(group, n_results, *arrays))
+        
+        for rows, scores in top:
+            with self._lock:
+                # 计算期间被删除的行不返回
+                records = {record[0]: record for record in self._fetch_rows(rows.tolist())}
+                kept = [(row, score) for row, score in zip(rows.tolist(), scores.tolist()) if row in records]
+                formatted = self._format([records[row] for row, _ in kept], include)
+            for key in ("ids", "documents", "metadatas", "embeddings"):
+                results[key].append(formatted[key])
+            results["distances"].append([1.0 - score for _, score in kept])
+        
+        return {key: (value if key == "ids" or key in include else None) for key, value in results.items()}
+    
+    # 内部实现
+    
+    def _check_writable(self):
+        if self.read_only:
+            raise ValueError(f"向量存储以只读方式打开: {self.path}")
+
+    def _top_k(self, queries: np.ndarray, k: int, vectors: Optional[np.ndarray], scales: Optional[np.ndarray],
+               alive: Optional[np.ndarray], size: int) -> List[tuple]:
+        """分块计算所有有效行与每条查询的点积，返回每条查询得分最高的k行及其得分"""
+        if vectors is None or size == 0 or k <= 0:
+            return [(np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32))] * len(queries)
+        norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        queries = queries / np.where(norms > 0, norms, 1.0)
+        
+        # 每个数据块只读取一次，与组内所有查询相乘
+        scores = np.empty((len(queries), size), dtype=np.float32)
+        for start in range(0, size, self.block_rows):
+            end = min(size, start + self.block_rows)
+            block = vectors[start:end]
+            if scales is not None:
+                scores[:, start:end] = (queries @ block.astype(np.float32).T) * scales[start:end]
+            else:
+                scores[:, start:end] = queries @ block.T
+        scores[:, alive[:size] == 0] = -np.inf
+        
+        k = min(k, size)
+        results = []
+        for row_scores in scores:
+            top = np.argpartition(-row_scores, k - 1)[:k]
+            top = top[np.argsort(-row_scores[top])]
+            top = top[np.isfinite(row_scores[top])]
+            results.append((top, row_scores[top]))
+        return results
+    
+    def _lookup_rows(self, ids: List[str]) -> Dict[str, int]:
+        """分块ID -> 行号"""
+        found = {}
+        for i in range(0, len(ids), self._QUERY_BATCH):
+            batch = ids[i:i + self._QUERY_BATCH]
+            found.update(self.conn.execute(
+                f"SELECT id, row FROM chunks WHERE id IN ({','.join('?' * len(batch))})", batch
+            ).fetchall())
+        return found
+    
+    def _where_rows(self, where: Optional[Dict[str, Any]]) -> List[int]:
+        """只支持按文档ID过滤：{"document_id": ID} 或 {"document_id": {"$in": [ID, ...]}}"""
+        if not where:
+            return [row for (row,) in self.conn.execute("SELECT row FROM chunks ORDER BY row")]
+        if set(where) != {"document_id"}:
+            raise ValueError(f"不支持的过滤条件: {where}")
+        condition = where["document_id"]
+        if not isinstance(condition, dict):
+            condition = {"$in": [condition]}
+        if set(condition) != {"$in"}:
+            raise ValueError(f"不支持的过滤条件: {where}")
+        rows = []
+        values = list(condition["$in"])
+        for i in range(0, len(values), self._QUERY_BATCH):
+            batch = values[i:i + self._QUERY_BATCH]
+            rows.extend(row for (row,) in self.conn.execute(
+                f"SELECT row FROM chunks WHERE document_id IN ({','.join('?' * len(batch))})", batch
+            ))
+        return sorted(rows)
+    
+    def _fetch_rows(self, rows: List[int]) -> List[tuple]:
+        """按行号读取 (行号, ID, 文本, 元数据JSON)"""
+        records = []
+        for i in range(0, len(rows), self._QUERY_BATCH):
+            batch = rows[i:i + self._QUERY_BATCH]
+            records.extend(self.conn.execute(
+                f"SELECT row, id, document, metadata FROM chunks WHERE row IN ({','.join('?' * len(batch))})",
+                batch
+            ).fetchall())
+        return records
+    
+    def _format(self, records: List[tuple], include: List[str]) -> Dict[str, Any]:
+        """转换为ChromaDB get的返回格式"""
+        embeddings = None
+        if "embeddings" in include:
+            rows = np.asarray([record[0] for record in records], dtype=np.int64)
+            embeddings = self._decode_rows(rows).tolist() if len(rows) else []
+        return {
+            "ids": [record[1] for record in records],
+            "documents": [record[2] for record in records] if "documents" in include else None,
+            "metadatas": [json.loads(record[3]) for record in records] if "metadatas" in include else None,
+            "embeddings": embeddings
+        }
+    
+    def stats(self) -> Dict[str, Any]:
+        """获取存储统计信息"""
+        count = self.count()
+        with self._lock:
+            return self._stats(count)
+    
+    def _stats(self, count: int) -> Dict[str, Any]:
+        return {
+            "backend": "flat",
+            "path": self.path,
+            "dtype": self.dtype.name,
+            "count": count,
+            "rows": self.size,
+            "capacity": int(self._vectors.shape[0]) if self._vectors is not None else 0,
+            "dim": int(self._vectors.shape[1]) if self._vectors is not None else None,
+            "file_bytes": os.path.getsize(self._vectors_path) if os.path.exists(self._vectors_path) else 0
+        }
@@ -0,0 +1,199 @@
+"""
+语义回答缓存 - 相似问题直接返回已生成的回答，依据的分块变化时自动失效
+"""
+import time
+import threading
+import itertools
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, Any, List, Optional, Set
+import numpy as np
+import config
+
+@dataclass
+class CachedAnswer:
+    """缓存的回答"""
+    id: int
+    question: str
+    embedding: np.ndarray  # 归一化后的问题嵌入
+    answer: str
+    chunk_ids: Set[str]  # 回答依据的分块ID
+    sources: int
+    created_at: float = field(default_factory=time.time)
+    hits: int = 0
+
+class AnswerCache:
+    """语义回答缓存
+    
+    以问题嵌入为键，与已缓存问题的余弦相似度达到阈值即视为命中。每条回答记录其依据的分块ID，
+    知识库删除或重新索引这些分块时（invalidate）对应回答立即失效。容量超限按最近使用淘汰（LRU），
+    超过TTL的回答过期。查询在事件循环中执行，失效通知来自导入线程，内部加锁。
+    """
+    
+    def __init__(self, max_entries: int = None, ttl: float = None, threshold: float = None):
+        self.max_entries = max_entries or config.ANSWER_CACHE_MAX_ENTRIES
+        self.ttl = ttl or config.ANSWER_CACHE_TTL
+        self.threshold = threshold or config.ANSWER_CACHE_THRESHOLD
+        self._entries: "OrderedDict[int, CachedAnswer]" = OrderedDict()
+        self._by_chunk: Dict[str, Set[int]] = {}  # 分块ID -> 依赖该分块的回答
+        self._matrix: Optional[np.ndarray] = None  # 所有问题嵌入组成的矩阵（条目变化后重建）
+        self._matrix_ids: List[int] = []
+        self._ids = itertools.count()
+        self._generation = 0  # 每次失效加一，用于丢弃生成期间依据已失效的回答
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.inserts = 0
+        self.invalidated = 0
+        self.expired = 0
+        self.evicted = 0
+    
+    @property
+    def generation(self) -> int:
+        """当前失效代数，检索前记录，写入时传给put"""
+        return self._generation
+    
+    def lookup(self, embedding: List[float]) -> Optional[Dict[str, Any]]:
+        """查找相似问题的缓存回答，未命中返回None"""
+        query = self._normalize(embedding)
+        with self._lock:
+            self._expire()
+            entry, similarity = None, 0.0
+            if self._entries:
+                matrix = self._get_matrix()
+                scores = matrix @ query
+                best = int(np.argmax(scores))
+                if scores[best] >= self.threshold:
+                    entry = self._entries[self._matrix_ids[best]]
+                    similarity = float(scores[best])
+            
+            if entry is None:
+                self.misses += 1
+                return None
+            
+            self.hits += 1
+            entry.hits += 1
+            self._entries.move_to_end(entry.id)
+            return {
+                "question": entry.question,
+                "answer": entry.answer,
+                "sources": entry.sources,
+                "similarity": round(similarity, 4),
+                "age_seconds": round(time.time() - entry.created_at, 1)
+            }
+    
+    def put(self, question: str, embedding: List[float], answer: str, chunk_ids: List[str],
+            generation: int) -> bool:
+        """缓存回答
+        
+        generation 为检索前读取的失效代数；期间发生过失效时不缓存，
+        避免依据已删除分块的回答写入缓存。
+        """
+        if not answer or not chunk_ids:
+            return False
+        
+        entry_embedding = self._normalize(embedding)
+        with self._lock:
+            if generation != self._generation:
+                return False
+            
+            entry = CachedAnswer(
+                id=next(self._ids),
+                question=question,
+                embedding=entry_embedding,
+                answer=answer,
+                chunk_ids=set(chunk_ids),
+                sources=len(chunk_ids)
+            )
+            self._entries[entry.id] = entry
+            for chunk_id in entry.chunk_ids:
+                self._by_chunk.setdefault(chunk_id, set()).add(entry.id)
+            self._matrix = None
+            self.inserts += 1
+            
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.evicted += 1
+            return True
+    
+    def invalidate(self, chunk_ids: Optional[List[str]]) -> int:
+        """分块被删除或重新索引时，删除依据这些分块的回答，返回删除数量；chunk_ids为None时清空缓存"""
+        if chunk_ids is None:
+            with self._lock:
+                count = len(self._entries)
+                self.invalidated += count
+            self.clear()
+            return count
+        with self._lock:
+            self._generation += 1
+            entry_ids = set()
+            for chunk_id in chunk_ids:
+                entry_ids.update(self._by_chunk.get(chunk_id, ()))
+            for entry_id in entry_ids:
+                self._remove(entry_id)
+            self.invalidated += len(entry_ids)
+            return len(entry_ids)
+    
+    def record_bypass(self):
+        """记录一次跳过缓存的请求"""
+        self.bypassed += 1
+    
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self._by_chunk.clear()
+            self._matrix = None
+    
+    def _normalize(self, embedding: List[float]) -> np.ndarray:
+        """归一化嵌入，点积即余弦相似度"""
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+    
+    def _get_matrix(self) -> np.ndarray:
+        """获取问题嵌入矩阵（调用方持有锁）"""
+        if self._matrix is None:
+            self._matrix_ids = list(self._entries.keys())
+            self._matrix = np.stack([self._entries[entry_id].embedding for entry_id in self._matrix_ids])
+        return self._matrix
+    
+    def _expire(self):
+        """删除过期回答（调用方持有锁）"""
+        now = time.time()
+        for entry_id in [e.id for e in self._entries.values() if now - e.created_at > self.ttl]:
+            self._remove(entry_id)
+            self.expired += 1
+    
+    def _remove(self, entry_id: int):
+        """删除一条回答及其分块索引（调用方持有锁）"""
+        entry = self._entries.pop(entry_id, None)
+        if entry is None:
+            return
+        for chunk_id in entry.chunk_ids:
+            dependents = self._by_chunk.get(chunk_id)
+            if dependents is not None:
+                dependents.discard(entry_id)
+                if not dependents:
+                    del self._by_chunk[chunk_id]
+        self._matrix = None
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """获取缓存统计信息"""
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+            "threshold": self.threshold,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "bypassed": self.bypassed,
+            "inserts": self.inserts,
+            "invalidated": self.invalidated,
+            "expired": self.expired,
+            "evicted": self.evicted
+        }
@@ -0,0 +1,134 @@
+"""
+批量上传 - 接收多个文件或压缩包，先写入暂存目录，全部接收后移入监控目录统一导入
+"""
+import os
+import shutil
+import tarfile
+import tempfile
+import zipfile
+from pathlib import Path, PurePosixPath
+from typing import List, Dict, BinaryIO, Optional
+import config
+
+ARCHIVE_SUFFIXES = (".zip", ".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tbz2", ".tar.xz", ".txz")
+
+def is_archive(filename: str) -> bool:
+    """按文件名判断是否为压缩包"""
+    return filename.lower().endswith(ARCHIVE_SUFFIXES)
+
+class UploadBatch:
+    """一次批量上传
+    
+    文件边接收边写入暂存目录（不在监控目录内，监控器不会读到写了一半的文件），
+    压缩包逐个成员流式解压，只保留支持的文件类型。commit时移入监控目录，
+    之后由一个导入任务处理整批文件，新文件走批量编码写入的路径。
+    """
+    
+    _COPY_BUFFER = 1024 * 1024
+    
+    def __init__(self, staging_dir: str = None, max_files: int = None):
+        staging_root = Path(staging_dir or config.UPLOAD_STAGING_DIR)
+        staging_root.mkdir(parents=True, exist_ok=True)
+        self.staging = Path(tempfile.mkdtemp(prefix="batch-", dir=staging_root))
+        self.max_files = max_files or config.UPLOAD_MAX_FILES
+        self.files: Dict[str, int] = {}  # 已接收的文件: 相对路径 -> 字节数（同一批中重名的文件以后上传的为准）
+        self.skipped: List[Dict[str, str]] = []  # 跳过的文件 {"name": 名称, "reason": 原因}
+    
+    def add(self, filename: str, stream: BinaryIO):
+        """接收一个上传文件，压缩包会被解压"""
+        if is_archive(filename):
+            self.add_archive(filename, stream)
+        else:
+            name = PurePosixPath(filename.replace("\\", "/")).name
+            self._add_member(name, stream, name)
+    
+    def add_archive(self, filename: str, stream: BinaryIO):
+        """解压压缩包中支持的文件（保留目录结构）"""
+        try:
+            if filename.lower().endswith(".zip"):
+                with zipfile.ZipFile(stream) as archive:
+                    for info in archive.infolist():
+                        if info.is_dir():
+                            continue
+                        if self._check_member(info.filename, info.file_size, filename):
+                            with archive.open(info) as member:
+                                self._add_member(info.filename, member, filename)
+            else:
+                # 流式读取，不需要整个压缩包可随机访问
+                with tarfile.open(fileobj=stream, mode="r|*") as archive:
+                    for info in archive:
+                        if not info.isfile():
+                            continue
+                        if self._check_member(info.name, info.size, filename):
+                            self._add_member(info.name, archive.extractfile(info), filename)
+        except (zipfile.BadZipFile, tarfile.TarError, EOFError) as e:
+            self.skipped.append({"name": filename, "reason": f"压缩包无法读取: {str(e)}"})
+    
+    def _check_member(self, name: str, size: int, source: str) -> bool:
+        """检查压缩包成员的路径、类型和大小，不符合时记录原因"""
+        reason = self._reject_reason(name, size)
+        if reason:
+            self.skipped.append({"name": f"{source}:{name}", "reason": reason})
+            return False
+        return True
+    
+    def _reject_reason(self, name: str, size: Optional[int]) -> Optional[str]:
+        if self._safe_path(name) is None:
+            return "不安全的路径"
+        if Path(name).suffix.lower() not in config.SUPPORTED_EXTENSIONS:
+            return "不支持的文件类型"
+        if config.MAX_FILE_SIZE is not None and size is not None and size > config.MAX_FILE_SIZE:
+            return f"超过大小限制 {config.MAX_FILE_SIZE} 字节"
+        if len(self.files) >= self.max_files and self._safe_path(name).as_posix() not in self.files:
+            return f"超过单次上传文件数上限 {self.max_files}"
+        return None
+    
+    @staticmethod
+    def _safe_path(name: str) -> Optional[PurePosixPath]:
+        """规范化相对路径，拒绝绝对路径和跳出目录的路径"""
+        path = PurePosixPath(name.replace("\\", "/"))
+        parts = [part for part in path.parts if part not in ("", ".")]
+        if not parts or path.is_absolute() or ".." in parts:
+            return None
+        return PurePosixPath(*parts)
+    
+    def _add_member(self, name: str, stream: BinaryIO, source: str):
+        """将一个文件流写入暂存目录"""
+        label = name if name == source else f"{source}:{name}"
+        reason = self._reject_reason(name, None)
+        if reason:
+            self.skipped.append({"name": label, "reason": reason})
+            return
+        
+        relative = self._safe_path(name)
+        target = self.staging / relative
+        target.parent.mkdir(parents=True, exist_ok=True)
+        size = 0
+        with open(target, "wb") as f:
+            while chunk := stream.read(self._COPY_BUFFER):
+                size += len(chunk)
+                if config.MAX_FILE_SIZE is not None and size > config.MAX_FILE_SIZE:
+                    break
+                f.write(chunk)
+        if config.MAX_FILE_SIZE is not None and size > config.MAX_FILE_SIZE:
+            target.unlink()
+            self.skipped.append({"name": label, "reason": f"超过大小限制 {config.MAX_FILE_SIZE} 字节"})
+            return
+        self.files[relative.as_posix()] = size
+    
+    def commit(self, target_dir: Path) -> List[Path]:
+        """将暂存的文件移入目标目录（已存在的同名文件被替换），返回移入后的路径"""
+        paths = []
+        try:
+            for relative in self.files:
+                target = target_dir / relative
+                target.parent.mkdir(parents=True, exist_ok=True)
+                os.replace(self.staging / relative, target)
+                paths.append(target)
+        finally:
+            self.discard()
+        return paths
+    
+    def discard(self):
+        """删除暂存目录"""
+        shutil.rmtree(self.staging, ignore_errors=True)
@@ -0,0 +1,128 @@
+"""
+多轮对话会话 - 保存Ollama返回的上下文，后续轮次只发送新内容
+"""
+import time
+import uuid
+import hashlib
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, Any, List, Optional, Set
+import config
+
+def _digest(content: str) -> str:
+    """参考分块的哈希"""
+    return hashlib.sha1(content.encode("utf-8")).hexdigest()
+
+@dataclass
+class ChatSession:
+    """对话会话"""
+    id: str
+    context: Optional[List[int]] = None  # Ollama返回的上下文（已处理过的token）
+    backend: Optional[str] = None  # 上一轮使用的节点，优先发往同一节点以复用其KV缓存
+    turns: int = 0  # 已完成的轮数
+    seen_chunks: Set[str] = field(default_factory=set)  # 已发送过的参考分块哈希
+    created_at: float = field(default_factory=time.time)
+    last_used: float = field(default_factory=time.time)
+    
+    def reset(self):
+        """丢弃已保存的上下文，下一轮重新发送完整对话"""
+        self.context = None
+        self.backend = None
+        self.turns = 0
+        self.seen_chunks.clear()
+    
+    def new_context(self, contents: List[str]) -> List[str]:
+        """过滤掉之前轮次已发送过的参考分块（不修改会话，本轮完成后由 record_context 记录）"""
+        if self.context is None:
+            # 没有可复用的上下文，本轮会重新发送完整对话
+            return list(contents)
+        fresh = []
+        digests = set()
+        for content in contents:
+            digest = _digest(content)
+            if digest not in self.seen_chunks and digest not in digests:
+                digests.add(digest)
+                fresh.append(content)
+        return fresh
+    
+    def record_context(self, contents: Optional[List[str]]):
+        """记录完整生成的一轮中发送的参考分块（在保存本轮上下文之前调用）"""
+        if self.context is None:
+            # 本轮发送的是完整对话，之前记录的分块不在新的上下文中
+            self.seen_chunks.clear()
+        self.seen_chunks.update(_digest(content) for content in contents or [])
+
+class ChatSessionStore:
+    """会话存储，按最近使用淘汰（LRU），超过TTL未使用的会话过期（只在事件循环中使用）"""
+    
+    def __init__(self, max_sessions: int = None, ttl: float = None):
+        self.max_sessions = max_sessions or config.CHAT_SESSION_MAX
+        self.ttl = ttl or config.CHAT_SESSION_TTL
+        self._sessions: "OrderedDict[str, ChatSession]" = OrderedDict()
+        self.reused = 0  # 复用已保存上下文的轮数
+        self.created = 0
+        self.resets = 0  # 对话记录与会话不一致而重建的次数
+        self.expired = 0
+        self.evicted = 0
+    
+    def get(self, session_id: Optional[str]) -> Optional[ChatSession]:
+        """获取未过期的会话"""
+        if not session_id:
+            return None
+        session = self._sessions.get(session_id)
+        if session is None:
+            return None
+        if time.time() - session.last_used > self.ttl:
+            del self._sessions[session_id]
+            self.expired += 1
+            return None
+        return session
+    
+    def resolve(self, session_id: Optional[str], user_turns: int) -> ChatSession:
+        """获取本轮对话使用的会话
+        
+        user_turns 为请求中的用户消息数。会话已完成的轮数与之不符（客户端清空或编辑了历史、
+        上一轮生成中途取消）时，丢弃已保存的上下文；会话不存在或已过期时新建会话。
+        """
+        session = self.get(session_id)
+        if session is None:
+            session = ChatSession(id=str(uuid.uuid4()))
+            self._sessions[session.id] = session
+            self.created += 1
+            self._evict()
+        elif session.context is not None and session.turns == user_turns - 1:
+            self.reused += 1
+        elif session.context is not None:
+            session.reset()
+            self.resets += 1
+        
+        session.last_used = time.time()
+        self._sessions.move_to_end(session.id)
+        return session
+    
+    def _evict(self):
+        """淘汰过期和最久未使用的会话"""
+        now = time.time()
+        for session_id in [sid for sid, s in self._sessions.items() if now - s.last_used > self.ttl]:
+            del self._sessions[session_id]
+            self.expired += 1
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+            self.evicted += 1
+    
+    def delete(self, session_id: str) -> bool:
+        """删除会话"""
+        return self._sessions.pop(session_id, None) is not None
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """获取会话统计信息"""
+        return {
+            "sessions": len(self._sessions),
+            "max_sessions": self.max_sessions,
+            "ttl": self.ttl,
+            "created": self.created,
+            "reused": self.reused,
+            "resets": self.resets,
+            "expired": self.expired,
+            "evicted": self.evicted
+        }
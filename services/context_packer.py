@@ -0,0 +1,185 @@
+"""
+上下文组装 - 合并检索到的相邻分块、去除重复内容，并按token预算裁剪
+"""
+import threading
+from typing import Dict, Any, List, Optional, Set
+from models.document import SENTENCE_BOUNDARIES
+import config
+
+def estimate_tokens(text: str) -> int:
+    """估算token数：非ASCII字符（中文等）按1个token计，ASCII字符按4个字符1个token计"""
+    ascii_chars = sum(1 for ch in text if ord(ch) < 128)
+    return (len(text) - ascii_chars) + (ascii_chars + 3) // 4
+
+class ContextPacker:
+    """上下文组装器
+    
+    位于检索和大模型之间：
+    1. 同一文档中相邻的分块合并为一段，去掉分块时产生的重叠部分
+    2. 按MMR（最大边际相关性）依次选择片段，与已选片段高度重复的片段直接丢弃
+    3. 片段总token数不超过预算，最后一个放不下的片段在句子边界处截断
+    4. 按相关度从高到低排列
+    """
+    
+    def __init__(self, budget: int = None, mmr_lambda: float = None, duplicate_threshold: float = None):
+        self.budget = budget or config.MAX_CONTEXT_LENGTH
+        self.mmr_lambda = config.CONTEXT_MMR_LAMBDA if mmr_lambda is None else mmr_lambda
+        self.duplicate_threshold = duplicate_threshold or config.CONTEXT_DUPLICATE_THRESHOLD
+        self._lock = threading.Lock()
+        self.packed = 0
+        self.chunks_in = 0
+        self.pieces_out = 0
+        self.tokens_in = 0
+        self.tokens_out = 0
+    
+    def pack(self, search_results: List[Dict[str, Any]], budget: Optional[int] = None) -> List[Dict[str, Any]]:
+        """组装上下文
+        
+        search_results 为 KnowledgeBase.search 的结果，返回格式相同的片段列表，
+        另外带有 chunk_ids（片段包含的分块ID）和 tokens（估算token数）。
+        """
+        if not search_results:
+            return []
+        budget = budget or self.budget
+        
+        pieces = self._merge_adjacent(search_results)
+        selected = self._select(pieces, budget)
+        selected.sort(key=lambda piece: piece["relevance"], reverse=True)
+        for piece in selected:
+            del piece["relevance"]
+        
+        with self._lock:
+            self.packed += 1
+            self.chunks_in += len(search_results)
+            self.pieces_out += len(selected)
+            self.tokens_in += sum(estimate_tokens(result["content"]) for result in search_results)
+            self.tokens_out += sum(piece["tokens"] for piece in selected)
+        return selected
+    
+    def _merge_adjacent(self, search_results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """合并同一文档中分块序号相邻的结果"""
+        by_document: Dict[Any, List[Dict[str, Any]]] = {}
+        for result in search_results:
+            metadata = result.get("metadata") or {}
+            key = metadata.get("document_id", id(result))
+            by_document.setdefault(key, []).append(result)
+        
+        pieces = []
+        for results in by_document.values():
+            results.sort(key=lambda r: (r.get("metadata") or {}).get("chunk_index", 0))
+            piece = None
+            for result in results:
+                index = (result.get("metadata") or {}).get("chunk_index")
+                if piece is not None and index is not None and index == piece["last_index"] + 1:
+                    piece["content"] += result["content"][self._overlap(piece["content"], result["content"]):]
+                    piece["similarity"] = max(piece["similarity"], result.get("similarity") or 0.0)
+                    piece["relevance"] = max(piece["relevance"], self._relevance(result))
+                    piece["last_index"] = index
+                    if result.get("id"):
+                        piece["chunk_ids"].append(result["id"])
+                    continue
+                if piece is not None:
+                    pieces.append(piece)
+                piece = {
+                    "id": result.get("id"),
+                    "content": result["content"],
+                    "metadata": result.get("metadata") or {},
+                    "similarity": result.get("similarity") or 0.0,
+                    "relevance": self._relevance(result),
+                    "chunk_ids": [result["id"]] if result.get("id") else [],
+                    "last_index": index if index is not None else -2
+                }
+            pieces.append(piece)
+        
+        for piece in pieces:
+            del piece["last_index"]
+            piece["tokens"] = estimate_tokens(piece["content"])
+        return pieces
+    
+    @staticmethod
+    def _relevance(result: Dict[str, Any]) -> float:
+        """相关度：混合检索的融合得分，没有时使用向量相似度"""
+        return result.get("score", result.get("similarity") or 0.0)
+    
+    @staticmethod
+    def _overlap(previous: str, current: str) -> int:
+        """current开头与previous结尾重复的长度（分块时相邻分块重叠 CHUNK_OVERLAP 个字符）"""
+        expected = config.CHUNK_OVERLAP
+        if 0 < expected <= min(len(previous), len(current)) and previous.endswith(current[:expected]):
+            return expected
+        for length in range(min(len(previous), len(current), config.CHUNK_SIZE // 2), 0, -1):
+            if previous.endswith(current[:length]):
+                return length
+        return 0
+    
+    def _select(self, pieces: List[Dict[str, Any]], budget: int) -> List[Dict[str, Any]]:
+        """按MMR在预算内选择片段"""
+        shingles = [self._shingles(piece["content"]) for piece in pieces]
+        remaining = list(range(len(pieces)))
+        chosen: List[int] = []
+        selected = []
+        used = 0
+        
+        while remaining and used < budget:
+            best, best_score, best_redundancy = None, None, 0.0
+            for i in remaining:
+                redundancy = max((self._similarity(shingles[i], shingles[j]) for j in chosen), default=0.0)
+                score = self.mmr_lambda * pieces[i]["relevance"] - (1 - self.mmr_lambda) * redundancy
+                if best_score is None or score > best_score:
+                    best, best_score, best_redundancy = i, score, redundancy
+            remaining.remove(best)
+            if best_redundancy >= self.duplicate_threshold:
+                continue
+            
+            piece = pieces[best]
+            if used + piece["tokens"] > budget:
+                piece = self._truncate(piece, budget - used)
+                if piece is None:
+                    continue
+            chosen.append(best)
+            selected.append(piece)
+            used += piece["tokens"]
+        return selected
+    
+    def _truncate(self, piece: Dict[str, Any], tokens: int) -> Optional[Dict[str, Any]]:
+        """截断片段使其不超过tokens，尽量在句子边界处结束；剩余预算过少时返回None"""
+        if tokens < config.CONTEXT_MIN_PIECE_TOKENS:
+            return None
+        content = piece["content"]
+        end, used = 0, 0
+        for ch in content:
+            used += 1 if ord(ch) >= 128 else 0.25
+            if used > tokens:
+                break
+            end += 1
+        boundary = max(content.rfind(mark, end // 2, end) for mark in SENTENCE_BOUNDARIES)
+        if boundary != -1:
+            end = boundary + 1
+        truncated = dict(piece, content=content[:end])
+        truncated["tokens"] = estimate_tokens(truncated["content"])
+        return truncated
+    
+    @staticmethod
+    def _shingles(text: str) -> Set[str]:
+        """字符二元组集合，用于估计片段间的重复程度"""
+        text = "".join(text.split())
+        return {text[i:i + 2] for i in range(len(text) - 1)} or {text}
+    
+    @staticmethod
+    def _similarity(a: Set[str], b: Set[str]) -> float:
+        """Jaccard相似度"""
+        if not a or not b:
+            return 0.0
+        return len(a & b) / len(a | b)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """获取组装统计信息"""
+        return {
+            "budget": self.budget,
+            "packed": self.packed,
+            "chunks_in": self.chunks_in,
+            "pieces_out": self.pieces_out,
+            "tokens_in": self.tokens_in,
+            "tokens_out": self.tokens_out,
+            "token_reduction": round(1 - self.tokens_out / self.tokens_in, 4) if self.tokens_in else 0.0
+        }
@@ -4,23 +4,44 @@
 import os
 import time
 import threading
-from typing import Dict, Set, Callable, Optional
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Set, Callable, Optional, Iterable, Tuple
 from pathlib import Path
 import hashlib
 from models.knowledge_base import KnowledgeBase
+from services.watcher_state import WatcherStateStore
+from services.inotify_backend import InotifyWatcher
+from services.ingest_scheduler import IngestScheduler, IngestJob
 import config
 
 class FolderWatcher:
     """文件夹监控器 - 自动构建知识库"""
     
-    def __init__(self, knowledge_base: KnowledgeBase, watch_folder: str = "./uploads", auto_start: bool = True):
+    def __init__(self, knowledge_base: KnowledgeBase, watch_folder: str = "./uploads", auto_start: bool = True,
+                 state_path: Optional[str] = None, scheduler: Optional[IngestScheduler] = None):
         self.kb = knowledge_base
         self.watch_folder = Path(watch_folder)
         self.file_hashes: Dict[str, str] = {}  # 文件路径 -> 文件哈希
         self.document_mapping: Dict[str, str] = {}  # 文件路径 -> 文档ID
+        self.file_stats: Dict[str, Tuple[int, int, int]] = {}  # 文件路径 -> (大小, 修改时间ns, inode)
+        self.state = WatcherStateStore(state_path or config.WATCHER_STATE_PATH)  # 持久化的文件状态
         self.is_running = False
         self.watch_thread: Optional[threading.Thread] = None
         self.check_interval = 2  # 检查间隔（秒）
+        self.debounce_seconds = config.WATCHER_DEBOUNCE_SECONDS  # 事件合并窗口（秒）
+        self.debounce_max_wait = config.WATCHER_DEBOUNCE_MAX_WAIT  # 持续变化的路径最多等待的时间（秒）
+        self.backend: Optional[str] = None  # inotify / polling
+        self._notifier: Optional[InotifyWatcher] = None
+        
+        # 设置调度器后，文件变化以后台任务的形式提交，不在监控线程中直接导入
+        self.scheduler = scheduler
+        self._lock = threading.RLock()  # 保护文件映射表
+        self._in_flight: Set[str] = set()  # 正在导入或更新的文件路径，同一文件不会被两个同步任务同时处理
+        self._gate = threading.Condition()  # 全量扫描与单文件同步互斥
+        self._active_syncs = 0
+        self._scanning = False
+        self._ready = threading.Event()  # 初始扫描完成后才开始监控
         
         # 确保监控文件夹存在
         self.watch_folder.mkdir(exist_ok=True)
@@ -41,6 +62,24 @@ class FolderWatcher:
         except Exception:
             return ""
     
+    def _hash_files(self, file_paths: List[Path]) -> Dict[str, str]:
+        """计算多个文件的哈希值，文件较多时使用线程池并行读取"""
+        workers = config.WATCHER_HASH_WORKERS
+        if len(file_paths) < 2 or workers <= 1:
+            return {str(f): self._get_file_hash(f) for f in file_paths}
+        
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            hashes = executor.map(self._get_file_hash, file_paths)
+            return {str(f): h for f, h in zip(file_paths, hashes)}
+    
+    def _get_file_signature(self, file_path: Path) -> Optional[Tuple[int, int, int]]:
+        """获取文件签名 (大小, 修改时间ns, inode)，签名不变的文件无需重新计算哈希"""
+        try:
+            stat = file_path.stat()
+            return (stat.st_size, stat.st_mtime_ns, stat.st_ino)
+        except OSError:
+            return None
+    
     def _is_supported_file(self, file_path: Path) -> bool:
         """检查是否为支持的文件类型"""
         return file_path.suffix.lower() in config.SUPPORTED_EXTENSIONS
@@ -56,27 +95,156 @@ class FolderWatcher:
             print(f"❌ 扫描文件夹失败: {e}")
         return files
     
+    def _scan_signatures(self) -> Dict[str, Tuple[int, int, int]]:
+        """扫描文件夹，返回所有支持的文件及其签名（只读取目录项和stat，不读取文件内容）"""
+        signatures = {}
+        directories = [str(self.watch_folder)]
+        while directories:
+            directory = directories.pop()
+            try:
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            directories.append(entry.path)
+                        elif entry.is_file() and self._is_supported_file(Path(entry.name)):
+                            stat = entry.stat()
+                            signatures[entry.path] = (stat.st_size, stat.st_mtime_ns, stat.st_ino)
+            except OSError as e:
+                print(f"❌ 扫描文件夹失败 {directory}: {e}")
+        return signatures
+    
+    def _state_key(self, file_path: Path) -> str:
+        """状态表中的文件键（相对监控目录的路径）"""
+        try:
+            return file_path.relative_to(self.watch_folder).as_posix()
+        except ValueError:
+            return file_path.as_posix()
+    
+    def _record_file(self, file_path: Path, doc_id: str, file_hash: Optional[str] = None):
+        """记录文件与文档的对应关系并持久化"""
+        if file_hash is None:
+            file_hash = self._get_file_hash(file_path)
+        
+        with self._lock:
+            self.document_mapping[str(file_path)] = doc_id
+            self.file_hashes[str(file_path)] = file_hash
+            try:
+                stat = file_path.stat()
+                self.file_stats[str(file_path)] = (stat.st_size, stat.st_mtime_ns, stat.st_ino)
+                self.state.upsert(self._state_key(file_path), stat.st_size, stat.st_mtime_ns, file_hash, doc_id)
+            except OSError:
+                pass
+    
+    def _forget_file(self, file_path: str):
+        """移除文件记录"""
+        with self._lock:
+            self.document_mapping.pop(file_path, None)
+            self.file_hashes.pop(file_path, None)
+            self.file_stats.pop(file_path, None)
+            self.state.delete(self._state_key(Path(file_path)))
+    
+    def _known_files(self) -> Set[str]:
+        """已跟踪文件路径的快照"""
+        with self._lock:
+            return set(self.file_hashes)
+    
+    def _claim(self, paths: Iterable[Path]) -> Set[str]:
+        """标记文件正在处理，返回本次标记成功的路径（其余路径正由其他同步任务处理）"""
+        with self._lock:
+            claimed = {str(path) for path in paths} - self._in_flight
+            self._in_flight |= claimed
+            return claimed
+    
+    def _release(self, claimed: Set[str]):
+        """清除处理中标记"""
+        with self._lock:
+            self._in_flight -= claimed
+    
+    @contextmanager
+    def _sync_section(self):
+        """单文件同步区：可以并发执行，但不与全量扫描同时进行"""
+        with self._gate:
+            while self._scanning:
+                self._gate.wait()
+            self._active_syncs += 1
+        try:
+            yield
+        finally:
+            with self._gate:
+                self._active_syncs -= 1
+                self._gate.notify_all()
+    
+    @contextmanager
+    def _scan_section(self):
+        """全量扫描区：独占执行"""
+        with self._gate:
+            while self._scanning or self._active_syncs:
+                self._gate.wait()
+            self._scanning = True
+        try:
+            yield
+        finally:
+            with self._gate:
+                self._scanning = False
+                self._gate.notify_all()
+    
     def _add_file_to_kb(self, file_path: Path) -> bool:
         """添加文件到知识库"""
         try:
             doc_id = self.kb.add_document(str(file_path), file_path.name)
-            self.document_mapping[str(file_path)] = doc_id
-            self.file_hashes[str(file_path)] = self._get_file_hash(file_path)
+            self._record_file(file_path, doc_id)
             print(f"✅ 已添加文件到知识库: {file_path.name}")
             return True
         except Exception as e:
             print(f"❌ 添加文件失败 {file_path.name}: {e}")
             return False
     
+    def _add_files_to_kb(self, file_paths: List[Path]) -> int:
+        """批量添加文件到知识库，返回成功数量
+        
+        每处理 config.INGEST_CHECKPOINT_FILES 个文件就把结果写入状态表，
+        导入中途中断后重新启动只需处理剩余的文件。
+        """
+        success_count = 0
+        step = max(1, config.INGEST_CHECKPOINT_FILES)
+        
+        for start in range(0, len(file_paths), step):
+            batch = [str(f) for f in file_paths[start:start + step]]
+            if len(batch) >= config.INGEST_PARALLEL_THRESHOLD:
+                report = self.kb.bulk_import(batch)
+                results = report["results"]
+                if report["stages"]:
+                    total = report["stages"]["total"]
+                    print(f"📈 批量导入吞吐: {total['files_per_sec']} 文件/秒, {total['chunks_per_sec']} 分块/秒")
+            else:
+                results = self.kb.add_documents(batch)
+            hashes = self._hash_files([Path(r["file_path"]) for r in results if r["success"]])
+            
+            # 每批的文件状态一次提交（即检查点）
+            with self.state.batch():
+                for result in results:
+                    file_path = result["file_path"]
+                    if result["success"]:
+                        self._record_file(Path(file_path), result["document_id"], hashes[file_path])
+                        success_count += 1
+                    else:
+                        print(f"❌ 添加文件失败 {result['filename']}: {result.get('error')}")
+            
+            if len(file_paths) > step:
+                print(f"💾 导入进度: {min(start + step, len(file_paths))}/{len(file_paths)}")
+        
+        print(f"✅ 已批量添加 {success_count} 个文件到知识库")
+        return success_count
+    
     def _remove_file_from_kb(self, file_path: str) -> bool:
         """从知识库中删除文件"""
         try:
             if file_path in self.document_mapping:
                 doc_id = self.document_mapping[file_path]
                 success = self.kb.delete_document(doc_id)
+                # 文档已不在知识库中时同样清除记录，避免反复重试
+                self._forget_file(file_path)
                 if success:
-                    del self.document_mapping[file_path]
-                    del self.file_hashes[file_path]
                     print(f"🗑️ 已从知识库删除文件: {Path(file_path).name}")
                     return True
             return False
@@ -84,50 +252,254 @@ class FolderWatcher:
             print(f"❌ 删除文件失败 {Path(file_path).name}: {e}")
             return False
     
-    def _update_file_in_kb(self, file_path: Path) -> bool:
-        """更新知识库中的文件"""
+    def delete_documents(self, document_ids: List[str], delete_files: bool = False) -> Dict[str, List[str]]:
+        """删除文档，返回 {deleted: 实际删除的文档ID, watched: 来自监控目录、未删除的文档ID}
+        
+        来自监控目录的文档只删除知识库中的内容会在文件下次修改或重新扫描时被重新导入，
+        因此只有 delete_files 为True时才删除，同时删除对应文件并清除文件记录；否则列入watched。
+        正在由同步任务处理的文件本次不删除，两个列表中都不出现。
+        """
+        with self._sync_section():
+            wanted = set(document_ids)
+            with self._lock:
+                paths = {path: doc_id for path, doc_id in self.document_mapping.items() if doc_id in wanted}
+            if not delete_files:
+                watched = set(paths.values())
+                deleted = self.kb.delete_documents([doc_id for doc_id in document_ids if doc_id not in watched])
+                return {"deleted": deleted, "watched": [doc_id for doc_id in document_ids if doc_id in watched]}
+            
+            claimed = self._claim(Path(path) for path in paths)
+            try:
+                skipped = set()
+                removed_files = []
+                for path, doc_id in paths.items():
+                    if path not in claimed:
+                        skipped.add(doc_id)
+                        continue
+                    try:
+                        Path(path).unlink()
+                    except FileNotFoundError:
+                        pass
+                    except OSError as e:
+                        print(f"❌ 删除文件失败 {Path(path).name}: {e}")
+                        skipped.add(doc_id)
+                        continue
+                    removed_files.append(path)
+                
+                deleted = self.kb.delete_documents([doc_id for doc_id in document_ids if doc_id not in skipped])
+                for path in removed_files:
+                    self._forget_file(path)
+                    print(f"🗑️ 已删除文件: {Path(path).name}")
+                return {"deleted": deleted, "watched": []}
+            finally:
+                self._release(claimed)
+    
+    def _update_file_in_kb(self, file_path: Path, file_hash: Optional[str] = None,
+                           doc_id: Optional[str] = None) -> bool:
+        """更新知识库中的文件（增量更新，文档ID保持不变）
+        
+        doc_id 为空时使用文件已记录的文档；文件与文档的对应关系在更新成功后才记录。
+        """
         try:
-            # 先删除旧版本
-            if str(file_path) in self.document_mapping:
-                self._remove_file_from_kb(str(file_path))
+            doc_id = doc_id or self.document_mapping.get(str(file_path))
+            if doc_id is None:
+                return self._add_file_to_kb(file_path)
             
-            # 添加新版本
-            return self._add_file_to_kb(file_path)
+            result = self.kb.update_document(doc_id, str(file_path), file_path.name)
+            self._record_file(file_path, doc_id, file_hash)
+            print(f"🔄 已更新文件: {file_path.name} "
+                  f"(新增 {result['added']}, 删除 {result['removed']}, 未变 {result['unchanged']})")
+            return True
         except Exception as e:
             print(f"❌ 更新文件失败 {file_path.name}: {e}")
             return False
     
     def _watch_loop(self):
         """监控循环"""
-        print("🔍 开始监控文件夹变化...")
+        # 初始扫描以后台任务执行时，等待其完成后再开始比对
+        while self.is_running and not self._ready.wait(timeout=self.check_interval):
+            pass
         
+        print(f"🔍 开始监控文件夹变化（{self.backend}模式）...")
+        
+        if self.backend == "inotify":
+            self._inotify_loop()
+        else:
+            self._poll_loop()
+    
+    def _poll_loop(self):
+        """轮询模式：定期扫描目录"""
         while self.is_running:
             try:
-                current_files = self._scan_folder()
-                current_file_paths = {str(f) for f in current_files}
-                known_file_paths = set(self.file_hashes.keys())
-                
-                # 检查新增文件
-                new_files = current_file_paths - known_file_paths
-                for file_path in new_files:
-                    self._add_file_to_kb(Path(file_path))
-                
-                # 检查删除的文件
-                deleted_files = known_file_paths - current_file_paths
-                for file_path in deleted_files:
-                    self._remove_file_from_kb(file_path)
+                self._poll_once()
+            except Exception as e:
+                print(f"❌ 监控循环出错: {e}")
+            time.sleep(self.check_interval)
+    
+    def _poll_once(self):
+        """执行一次全量比对，只对签名变化的文件计算哈希"""
+        current = self._scan_signatures()
+        current_file_paths = set(current)
+        known_file_paths = self._known_files()
+        
+        # 新增文件、删除的文件，以及大小、修改时间或inode变化的文件
+        changed = (current_file_paths ^ known_file_paths) | {
+            file_path for file_path in current_file_paths & known_file_paths
+            if current[file_path] != self.file_stats.get(file_path)
+        }
+        if changed:
+            self._dispatch([Path(f) for f in sorted(changed)])
+    
+    def _dispatch(self, paths: List[Path]):
+        """处理变化的路径：有调度器时按文件提交后台任务，否则直接同步"""
+        if self.scheduler is None:
+            self._sync_paths(paths)
+            return
+        
+        for path in paths:
+            # 监控线程提交时队列满则等待，形成背压而不是丢弃变化
+            self.schedule_sync(path, block=True)
+    
+    def schedule_sync(self, path: Path, block: bool = False) -> Optional[IngestJob]:
+        """提交单个路径的同步任务（同一路径排队中的任务会被合并）"""
+        if self.scheduler is None:
+            self._sync_paths([path])
+            return None
+        return self.scheduler.submit("sync", str(path), lambda: self._sync_paths([path]), block=block)
+    
+    def schedule_import(self, paths: List[Path], key: str, block: bool = False) -> Optional[IngestJob]:
+        """提交一批文件的导入任务：未跟踪的文件批量导入，已跟踪的文件按内容变化增量更新"""
+        if self.scheduler is None:
+            self._sync_paths(paths)
+            return None
+        return self.scheduler.submit("import", key, lambda: self._sync_paths(paths), block=block)
+    
+    def schedule_rescan(self) -> Optional[IngestJob]:
+        """提交强制重新扫描任务"""
+        if self.scheduler is None:
+            self.force_rescan()
+            return None
+        return self.scheduler.submit("rescan", "__rescan__", self.force_rescan)
+    
+    def _apply_hash(self, file_path: Path, file_hash: str) -> bool:
+        """根据新的内容哈希决定更新文档还是只刷新文件签名，返回是否更新了文档"""
+        key = str(file_path)
+        if not file_hash or key not in self.document_mapping:
+            return False
+        if file_hash != self.file_hashes.get(key):
+            return self._update_file_in_kb(file_path, file_hash)
+        self._record_file(file_path, self.document_mapping[key], file_hash)
+        return False
+    
+    def _inotify_loop(self):
+        """事件模式：只处理inotify报告变化的路径
+        
+        同一路径的事件在debounce_seconds内合并，编辑器保存时的
+        写临时文件+重命名等一连串事件只触发一次重新索引。持续写入的文件（如不断追加的日志）
+        没有安静期，从第一次事件起最多等待debounce_max_wait秒也会处理一次。
+        """
+        notifier = self._notifier
+        pending: Dict[str, float] = {}  # 路径 -> 最后一次事件时间
+        first_seen: Dict[str, float] = {}  # 路径 -> 本轮合并中第一次事件时间
+        
+        while self.is_running:
+            try:
+                timeout = self.debounce_seconds if pending else self.check_interval
+                events, overflow = notifier.read_events(timeout)
+                now = time.monotonic()
                 
-                # 检查修改的文件
-                for file_path in current_file_paths & known_file_paths:
-                    current_hash = self._get_file_hash(Path(file_path))
-                    if current_hash and current_hash != self.file_hashes.get(file_path):
-                        self._update_file_in_kb(Path(file_path))
+                if overflow:
+                    print("⚠️ inotify事件队列溢出，执行全量扫描")
+                    pending.clear()
+                    first_seen.clear()
+                    self._poll_once()
+                    continue
                 
-                time.sleep(self.check_interval)
+                for path, _ in events:
+                    pending[str(path)] = now
+                    first_seen.setdefault(str(path), now)
                 
+                ready = [path for path, last in pending.items()
+                         if now - last >= self.debounce_seconds or now - first_seen[path] >= self.debounce_max_wait]
+                if ready:
+                    for path in ready:
+                        del pending[path]
+                        del first_seen[path]
+                    self._dispatch([Path(path) for path in sorted(ready)])
+                    
             except Exception as e:
                 print(f"❌ 监控循环出错: {e}")
                 time.sleep(self.check_interval)
+        
+        notifier.close()
+    
+    def _sync_paths(self, paths: Iterable[Path]) -> Dict[str, int]:
+        """同步一组发生变化的路径（文件或目录），返回各类变更的文件数"""
+        with self._sync_section(), self.state.batch():
+            new_files: Set[Path] = set()
+            candidates: List[Path] = []
+            removed = 0
+            
+            for path in paths:
+                key = str(path)
+                
+                if path.is_dir():
+                    # 新建或移入的目录：导入其中尚未跟踪的文件
+                    known = self._known_files()
+                    for file_path in path.rglob("*"):
+                        if file_path.is_file() and self._is_supported_file(file_path) \
+                                and str(file_path) not in known:
+                            new_files.add(file_path)
+                    continue
+                
+                if not path.exists():
+                    # 文件被删除，或整个目录被删除/移出
+                    prefix = key + os.sep
+                    for known in [k for k in self._known_files() if k == key or k.startswith(prefix)]:
+                        if self._remove_file_from_kb(known):
+                            removed += 1
+                    continue
+                
+                if not path.is_file() or not self._is_supported_file(path):
+                    continue
+                
+                if key not in self.file_hashes:
+                    new_files.add(path)
+                elif self._get_file_signature(path) != self.file_stats.get(key):
+                    candidates.append(path)
+            
+            # 上传接口和监控线程可能同时提交同一文件，只由先标记的任务处理
+            claimed = self._claim(list(new_files) + candidates)
+            try:
+                known = self._known_files()
+                new_files = {path for path in new_files if str(path) in claimed and str(path) not in known}
+                candidates = [path for path in candidates if str(path) in claimed]
+                
+                updated = 0
+                if candidates:
+                    hashes = self._hash_files(candidates)
+                    for path in candidates:
+                        if self._apply_hash(path, hashes[str(path)]):
+                            updated += 1
+                
+                added = self._add_files_to_kb(sorted(new_files)) if new_files else 0
+            finally:
+                self._release(claimed)
+            
+            return {"added": added, "updated": updated, "removed": removed}
+    
+    def _select_backend(self) -> str:
+        """选择监控方式：优先inotify，不可用时回退到轮询"""
+        backend = config.WATCHER_BACKEND
+        if backend in ("auto", "inotify") and InotifyWatcher.is_available():
+            try:
+                self._notifier = InotifyWatcher(self.watch_folder)
+                return "inotify"
+            except OSError as e:
+                print(f"⚠️ 启用inotify失败，回退到轮询模式: {e}")
+        elif backend == "inotify":
+            print("⚠️ 当前系统不支持inotify，回退到轮询模式")
+        return "polling"
     
     def start_watching(self):
         """开始监控"""
@@ -139,8 +511,15 @@ class FolderWatcher:
         print(f"📂 监控目录: {self.watch_folder.absolute()}")
         print(f"📋 支持的文件类型: {', '.join(config.SUPPORTED_EXTENSIONS)}")
         
-        # 初始扫描
-        self._initial_scan()
+        # 先注册事件监听，初始扫描期间发生的变化不会丢失
+        self.backend = self._select_backend()
+        
+        # 初始扫描（有调度器时作为后台任务执行，不阻塞启动）
+        self._ready.clear()
+        if self.scheduler is None:
+            self._run_initial_scan()
+        else:
+            self.scheduler.submit("scan", "__scan__", self._run_initial_scan)
         
         # 启动监控线程
         self.is_running = True
@@ -163,49 +542,183 @@ class FolderWatcher:
         
         print("✅ 文件夹监控服务已停止")
     
-    def _initial_scan(self):
-        """初始扫描，添加现有文件"""
+    def _run_initial_scan(self):
+        """执行初始扫描并标记监控可以开始"""
+        try:
+            return self.sync_folder()
+        finally:
+            self._ready.set()
+    
+    def sync_folder(self) -> Dict[str, int]:
+        """将监控目录与知识库同步一次（不启动监控），返回变更统计"""
+        with self._scan_section(), self.state.batch():
+            return self._initial_scan()
+    
+    def _initial_scan(self) -> Dict[str, int]:
+        """初始扫描
+        
+        与持久化的文件状态和知识库中的文档比对，只处理新增、修改和删除的文件；
+        大小和修改时间均未变化的文件直接沿用记录，不读取文件内容。
+        """
         print("🔄 执行初始文件扫描...")
         files = self._scan_folder()
+        saved = self.state.load_all()
         
-        if not files:
+        try:
+            documents = {doc["id"]: doc for doc in self.kb.list_documents()}
+        except Exception as e:
+            print(f"❌ 读取知识库文档列表失败: {e}")
+            documents = None
+        
+        summary = {"files": len(files), "unchanged": 0, "modified": 0, "added": 0,
+                   "failed": 0, "deleted": 0, "bytes": 0}
+        
+        if not files and not saved:
             print("📝 监控文件夹为空，请将文档文件放入以下目录：")
             print(f"   {self.watch_folder.absolute()}")
             print("   支持的文件格式: " + ", ".join(config.SUPPORTED_EXTENSIONS))
-            return
+            return summary
         
-        success_count = 0
-        for file_path in files:
-            if self._add_file_to_kb(file_path):
-                success_count += 1
+        new_files: List[Path] = []
+        changed_files: List[Path] = []
+        unchanged_count = 0
+        
+        for file_path in sorted(files):
+            record = saved.pop(self._state_key(file_path), None)
+            if record is None or (documents is not None and record["document_id"] not in documents):
+                new_files.append(file_path)
+                continue
+            
+            with self._lock:
+                self.document_mapping[str(file_path)] = record["document_id"]
+                self.file_hashes[str(file_path)] = record["hash"]
+            try:
+                stat = file_path.stat()
+            except OSError:
+                continue
+            if stat.st_size == record["size"] and stat.st_mtime_ns == record["mtime_ns"]:
+                with self._lock:
+                    self.file_stats[str(file_path)] = (stat.st_size, stat.st_mtime_ns, stat.st_ino)
+                unchanged_count += 1
+            else:
+                changed_files.append(file_path)
+        
+        # 状态表中有记录但文件已被删除
+        for key, record in saved.items():
+            try:
+                self.kb.delete_document(record["document_id"])
+                print(f"🗑️ 已从知识库删除文件: {Path(key).name}")
+            except Exception as e:
+                print(f"❌ 删除文件失败 {Path(key).name}: {e}")
+            self.state.delete(key)
+        
+        # 大小或修改时间变化的文件，比对内容哈希确认是否真的修改
+        hashes = self._hash_files(changed_files)
+        modified_files: List[Path] = []
+        for file_path in changed_files:
+            current_hash = hashes[str(file_path)]
+            if current_hash == self.file_hashes.get(str(file_path)):
+                self._record_file(file_path, self.document_mapping[str(file_path)], current_hash)
+                unchanged_count += 1
+            elif self._update_file_in_kb(file_path, current_hash):
+                modified_files.append(file_path)
         
-        print(f"📊 初始扫描完成，成功添加 {success_count}/{len(files)} 个文件")
+        if documents is not None:
+            new_files, adopted_files = self._reconcile_orphans(files, new_files, documents)
+            modified_files.extend(adopted_files)
+        
+        success_count = self._add_files_to_kb(new_files) if new_files else 0
+        
+        summary.update({
+            "unchanged": unchanged_count,
+            "modified": len(modified_files),
+            "added": success_count,
+            "failed": len(new_files) - success_count,
+            "deleted": len(saved),
+            "bytes": sum(self._file_size(f) for f in modified_files + new_files)
+        })
+        print(f"📊 初始扫描完成: 未变化 {unchanged_count}, 已修改 {len(modified_files)}, "
+              f"新增 {success_count}/{len(new_files)}, 已删除 {len(saved)}")
+        return summary
+    
+    def _file_size(self, file_path: Path) -> int:
+        """获取文件大小，文件不存在时返回0"""
+        try:
+            return file_path.stat().st_size
+        except OSError:
+            return 0
+    
+    def _reconcile_orphans(self, files: Set[Path], new_files: List[Path],
+                           documents: Dict[str, Dict]) -> Tuple[List[Path], List[Path]]:
+        """处理早期运行遗留的孤立文档
+        
+        知识库中未被状态表引用、但文件名与监控目录中文件相同的文档，
+        是之前每次启动重复导入留下的副本：每个新文件认领其中一份做增量更新，
+        其余副本全部删除。返回 (仍需要全新导入的文件, 已认领旧文档的文件)。
+        """
+        tracked = set(self.document_mapping.values())
+        orphans: Dict[str, List[str]] = {}
+        for doc_id, doc in documents.items():
+            if doc_id not in tracked:
+                orphans.setdefault(doc["filename"], []).append(doc_id)
+        
+        remaining = []
+        adopted = []
+        for file_path in new_files:
+            candidates = orphans.get(file_path.name)
+            if not candidates:
+                remaining.append(file_path)
+                continue
+            doc_id = candidates.pop()
+            if self._update_file_in_kb(file_path, doc_id=doc_id):
+                adopted.append(file_path)
+            else:
+                # 认领失败：旧文档随其余副本一起删除，文件重新导入
+                candidates.append(doc_id)
+                remaining.append(file_path)
+        
+        purged = 0
+        for name in {f.name for f in files}:
+            for doc_id in orphans.get(name, []):
+                try:
+                    if self.kb.delete_document(doc_id):
+                        purged += 1
+                except Exception as e:
+                    print(f"❌ 删除重复文档失败 {doc_id}: {e}")
+        
+        if purged:
+            print(f"🧹 已清理 {purged} 个重复导入的孤立文档")
+        
+        return remaining, adopted
     
     def get_status(self) -> Dict:
         """获取监控状态"""
-        return {
-            "is_running": self.is_running,
-            "watch_folder": str(self.watch_folder.absolute()),
-            "tracked_files": len(self.file_hashes),
-            "supported_extensions": config.SUPPORTED_EXTENSIONS,
-            "files": [
-                {
-                    "path": path,
-                    "name": Path(path).name,
-                    "document_id": self.document_mapping.get(path)
-                }
-                for path in self.file_hashes.keys()
-            ]
-        }
+        with self._lock:
+            return {
+                "is_running": self.is_running,
+                "backend": self.backend,
+                "watch_folder": str(self.watch_folder.absolute()),
+                "tracked_files": len(self.file_hashes),
+                "supported_extensions": config.SUPPORTED_EXTENSIONS,
+                "files": [
+                    {
+                        "path": path,
+                        "name": Path(path).name,
+                        "document_id": self.document_mapping.get(path)
+                    }
+                    for path in self.file_hashes.keys()
+                ]
+            }
     
     def force_rescan(self):
         """强制重新扫描"""
-        print("🔄 执行强制重新扫描...")
-        # 清空现有映射
-        old_files = list(self.file_hashes.keys())
-        for file_path in old_files:
-            self._remove_file_from_kb(file_path)
-        
-        # 重新扫描
-        self._initial_scan()
-        print("✅ 强制重新扫描完成") 
\ No newline at end of file
+        with self._scan_section(), self.state.batch():
+            print("🔄 执行强制重新扫描...")
+            # 清空现有映射
+            old_files = list(self._known_files())
+            for file_path in old_files:
+                self._remove_file_from_kb(file_path)
+            
+            # 重新扫描
+            self._initial_scan()
+            print("✅ 强制重新扫描完成") 
\ No newline at end of file
@@ -0,0 +1,212 @@
+"""
+后台导入任务调度 - 导入/更新/删除任务排队执行，请求处理不再阻塞
+"""
+import time
+import uuid
+import queue
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Any
+import config
+
+class IngestQueueFullError(Exception):
+    """任务队列已满"""
+
+@dataclass
+class IngestJob:
+    """导入任务"""
+    id: str
+    action: str  # sync / delete / scan / rescan ...
+    key: str  # 合并键，同一键的排队任务会合并为一个
+    status: str = "queued"  # queued / running / done / failed
+    submitted_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    chunks: int = 0  # 已写入的分块数
+    coalesced: int = 0  # 被合并的重复提交次数
+    result: Any = None
+    error: Optional[str] = None
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """转换为接口返回格式"""
+        end = self.finished_at or time.time()
+        elapsed = end - self.started_at if self.started_at else 0.0
+        return {
+            "id": self.id,
+            "action": self.action,
+            "key": self.key,
+            "status": self.status,
+            "submitted_at": self.submitted_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "queue_seconds": round((self.started_at or end) - self.submitted_at, 3),
+            "run_seconds": round(elapsed, 3),
+            "chunks": self.chunks,
+            "chunks_per_sec": round(self.chunks / elapsed, 2) if elapsed > 0 else 0.0,
+            "coalesced": self.coalesced,
+            "result": self.result,
+            "error": self.error
+        }
+
+class IngestScheduler:
+    """导入任务调度器
+    
+    每个工作线程有独立的有界队列，任务按合并键哈希分配到固定的工作线程，
+    保证同一文件的任务按提交顺序执行；尚未开始的同键任务会被合并。
+    """
+    
+    def __init__(self, workers: int = None, max_queue: int = None, history: int = None):
+        self.workers = workers or config.INGEST_WORKERS
+        self.max_queue = max_queue or config.INGEST_QUEUE_SIZE
+        self.history = history or config.INGEST_JOB_HISTORY
+        
+        per_worker = max(1, self.max_queue // self.workers)
+        self._queues: List[queue.Queue] = [queue.Queue(maxsize=per_worker) for _ in range(self.workers)]
+        self._lock = threading.Lock()
+        self._finished = threading.Condition(self._lock)
+        self._jobs: "OrderedDict[str, IngestJob]" = OrderedDict()
+        self._funcs: Dict[str, Callable[[], Any]] = {}  # 任务ID -> 执行函数
+        self._pending: Dict[str, IngestJob] = {}  # 合并键 -> 排队中的任务
+        self._local = threading.local()
+        self._threads: List[threading.Thread] = []
+        self.is_running = False
+    
+    def start(self):
+        """启动工作线程"""
+        if self.is_running:
+            return
+        self.is_running = True
+        for i, jobs in enumerate(self._queues):
+            thread = threading.Thread(target=self._worker, args=(jobs,), name=f"ingest-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        print(f"✅ 导入任务调度器已启动，工作线程: {self.workers}")
+    
+    def stop(self, timeout: float = 5):
+        """停止工作线程（已排队的任务会先执行完）"""
+        if not self.is_running:
+            return
+        self.is_running = False
+        for jobs in self._queues:
+            jobs.put(None)
+        for thread in self._threads:
+            thread.join(timeout=timeout)
+        self._threads = []
+    
+    def submit(self, action: str, key: str, func: Callable[[], Any], block: bool = False) -> IngestJob:
+        """提交任务
+        
+        同一合并键已有排队中的任务时，用新的执行函数替换它并返回原任务。
+        队列已满时，block=False 抛出 IngestQueueFullError，block=True 等待空位。
+        """
+        jobs = self._queues[hash(key) % self.workers]
+        
+        while True:
+            with self._lock:
+                existing = self._pending.get(key)
+                if existing is not None:
+                    existing.action = action
+                    existing.coalesced += 1
+                    self._funcs[existing.id] = func
+                    return existing
+                
+                job = IngestJob(id=str(uuid.uuid4()), action=action, key=key)
+                try:
+                    jobs.put_nowait(job.id)
+                except queue.Full:
+                    if not block:
+                        raise IngestQueueFullError(f"导入任务队列已满（{self.max_queue}）")
+                else:
+                    self._pending[key] = job
+                    self._funcs[job.id] = func
+                    self._jobs[job.id] = job
+                    self._trim_history()
+                    return job
+            
+            time.sleep(0.05)
+    
+    def _trim_history(self):
+        """只保留最近的已完成任务（调用方持有锁）"""
+        overflow = len(self._jobs) - self.history
+        if overflow <= 0:
+            return
+        for job_id in list(self._jobs):
+            if overflow <= 0:
+                break
+            if self._jobs[job_id].status in ("done", "failed"):
+                del self._jobs[job_id]
+                overflow -= 1
+    
+    def _worker(self, jobs: queue.Queue):
+        """工作线程主循环"""
+        while True:
+            job_id = jobs.get()
+            if job_id is None:
+                break
+            
+            with self._lock:
+                job = self._jobs[job_id]
+                func = self._funcs.pop(job_id)
+                if self._pending.get(job.key) is job:
+                    del self._pending[job.key]
+                job.status = "running"
+                job.started_at = time.time()
+            
+            self._local.job = job
+            try:
+                job.result = func()
+                job.status = "done"
+            except Exception as e:
+                job.error = str(e)
+                job.status = "failed"
+                print(f"❌ 导入任务失败 {job.action} {job.key}: {e}")
+            finally:
+                self._local.job = None
+                with self._finished:
+                    job.finished_at = time.time()
+                    self._finished.notify_all()
+    
+    def record_chunks(self, count: int):
+        """记录当前线程正在执行的任务写入的分块数（供知识库写入时回调）"""
+        job = getattr(self._local, "job", None)
+        if job is not None:
+            job.chunks += count
+    
+    def wait(self, job_id: str, timeout: Optional[float] = None) -> Optional[IngestJob]:
+        """等待任务结束"""
+        deadline = None if timeout is None else time.time() + timeout
+        with self._finished:
+            while True:
+                job = self._jobs.get(job_id)
+                if job is None or job.finished_at is not None:
+                    return job
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return job
+                self._finished.wait(remaining)
+    
+    def get_job(self, job_id: str) -> Optional[IngestJob]:
+        """获取任务"""
+        with self._lock:
+            return self._jobs.get(job_id)
+    
+    def list_jobs(self, status: Optional[str] = None, limit: int = 100) -> List[IngestJob]:
+        """列出最近的任务（新任务在前）"""
+        with self._lock:
+            jobs = [job for job in reversed(self._jobs.values()) if status is None or job.status == status]
+        return jobs[:limit]
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """获取调度器统计信息"""
+        with self._lock:
+            counts: Dict[str, int] = {"queued": 0, "running": 0, "done": 0, "failed": 0}
+            for job in self._jobs.values():
+                counts[job.status] = counts.get(job.status, 0) + 1
+        return {
+            "is_running": self.is_running,
+            "workers": self.workers,
+            "max_queue": self.max_queue,
+            "queue_depth": sum(jobs.qsize() for jobs in self._queues),
+            "jobs": counts
+        }
@@ -0,0 +1,139 @@
+"""
+Linux inotify 文件事件监听（基于ctypes，无额外依赖）
+"""
+import os
+import sys
+import select
+import struct
+import ctypes
+import ctypes.util
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+# inotify 事件掩码（见 <sys/inotify.h>）
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+
+WATCH_MASK = (IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+              IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF)
+
+_EVENT_HEADER = struct.Struct("iIII")  # wd, mask, cookie, len
+
+def _load_libc():
+    """加载libc，不支持inotify时返回None"""
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+    except OSError:
+        return None
+    if not (hasattr(libc, "inotify_init1") and hasattr(libc, "inotify_add_watch")):
+        return None
+    return libc
+
+_libc = _load_libc()
+
+class InotifyWatcher:
+    """递归监听目录树的文件变化事件"""
+    
+    def __init__(self, root: Path):
+        if _libc is None:
+            raise OSError("当前系统不支持inotify")
+        
+        self.root = Path(root)
+        self.fd = _libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, f"inotify初始化失败: {os.strerror(errno)}")
+        
+        self.watches: Dict[int, Path] = {}  # 监听描述符 -> 目录
+        self.add_watch_recursive(self.root)
+    
+    @staticmethod
+    def is_available() -> bool:
+        """当前系统是否支持inotify"""
+        return _libc is not None
+    
+    def add_watch(self, directory: Path):
+        """监听单个目录"""
+        wd = _libc.inotify_add_watch(self.fd, os.fsencode(str(directory)), WATCH_MASK | IN_ONLYDIR)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, f"监听目录失败 {directory}: {os.strerror(errno)}")
+        self.watches[wd] = directory
+    
+    def add_watch_recursive(self, directory: Path):
+        """监听目录及其所有子目录"""
+        self.add_watch(directory)
+        for dirpath, dirnames, _ in os.walk(directory):
+            for dirname in dirnames:
+                try:
+                    self.add_watch(Path(dirpath) / dirname)
+                except OSError as e:
+                    print(f"⚠️ {e}")
+    
+    def read_events(self, timeout: float) -> Tuple[List[Tuple[Path, int]], bool]:
+        """读取事件
+        
+        最多等待timeout秒，返回 ([(路径, 事件掩码)], 是否发生队列溢出)。
+        队列溢出时事件已丢失，调用方需要做一次全量扫描。
+        """
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return [], False
+        
+        events: List[Tuple[Path, int]] = []
+        overflow = False
+        
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            if not data:
+                break
+            
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, name_len = _EVENT_HEADER.unpack_from(data, offset)
+                offset += _EVENT_HEADER.size
+                name = data[offset:offset + name_len].rstrip(b"\0")
+                offset += name_len
+                
+                if mask & IN_Q_OVERFLOW:
+                    overflow = True
+                    continue
+                
+                directory = self.watches.get(wd)
+                if directory is None:
+                    continue
+                if mask & IN_IGNORED:
+                    self.watches.pop(wd, None)
+                    continue
+                
+                path = directory / os.fsdecode(name) if name else directory
+                # 新建或移入的子目录需要加入监听
+                if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                    try:
+                        self.add_watch_recursive(path)
+                    except OSError as e:
+                        print(f"⚠️ {e}")
+                events.append((path, mask))
+        
+        return events, overflow
+    
+    def close(self):
+        """关闭inotify描述符"""
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
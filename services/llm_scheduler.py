@@ -0,0 +1,161 @@
+"""
+大模型请求准入控制 - 限制同时发往Ollama的请求数，超出部分按优先级排队
+"""
+import time
+import heapq
+import asyncio
+import itertools
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Dict, Any, List, Optional
+import config
+
+# 优先级（数值越小越先执行）
+PRIORITY_CHAT = 0  # 交互式多轮对话
+PRIORITY_QUESTION = 1  # 单次问答
+PRIORITY_BATCH = 2  # 批量任务
+
+PRIORITY_NAMES = {PRIORITY_CHAT: "chat", PRIORITY_QUESTION: "question", PRIORITY_BATCH: "batch"}
+
+class LLMQueueFullError(Exception):
+    """等待队列已满"""
+
+class LLMQueueTimeoutError(Exception):
+    """排队超过截止时间"""
+
+class LLMTicket:
+    """已获得的执行名额，release可重复调用"""
+    
+    def __init__(self, scheduler: "LLMScheduler", priority: int, wait_seconds: float):
+        self.scheduler = scheduler
+        self.priority = priority
+        self.wait_seconds = wait_seconds
+        self.released = False
+    
+    def release(self):
+        """归还名额"""
+        if not self.released:
+            self.released = True
+            self.scheduler._release()
+
+class LLMScheduler:
+    """大模型请求调度器
+    
+    同时执行的请求不超过max_concurrency个，其余请求进入有界等待队列，
+    按优先级和到达顺序获得名额。队列已满时立即拒绝，排队超过截止时间的请求放弃执行，
+    避免所有请求一起变慢直至超时。只能在事件循环中使用。
+    """
+    
+    def __init__(self, max_concurrency: int = None, max_queue: int = None, queue_timeout: float = None):
+        self.max_concurrency = max_concurrency or config.LLM_MAX_CONCURRENCY
+        self.max_queue = config.LLM_QUEUE_SIZE if max_queue is None else max_queue
+        self.queue_timeout = queue_timeout or config.LLM_QUEUE_TIMEOUT
+        
+        self._active = 0
+        self._waiters: List[list] = []  # 堆: [优先级, 序号, future]
+        self._queued: Dict[int, int] = {priority: 0 for priority in PRIORITY_NAMES}
+        self._sequence = itertools.count()
+        self._wait_times: deque = deque(maxlen=config.LLM_WAIT_SAMPLES)  # 最近的排队耗时（秒）
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+    
+    async def acquire(self, priority: int = PRIORITY_QUESTION, timeout: Optional[float] = None) -> LLMTicket:
+        """获取执行名额
+        
+        队列已满时抛出 LLMQueueFullError，等待超过timeout秒（默认config.LLM_QUEUE_TIMEOUT）
+        抛出 LLMQueueTimeoutError。
+        """
+        started = time.perf_counter()
+        
+        if self._active < self.max_concurrency and not self._queue_depth():
+            self._active += 1
+            return self._admit(priority, started)
+        
+        if self._queue_depth() >= self.max_queue:
+            self.rejected += 1
+            raise LLMQueueFullError(f"大模型请求队列已满（{self.max_queue}）")
+        
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, [priority, next(self._sequence), future])
+        self._queued[priority] = self._queued.get(priority, 0) + 1
+        
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout or self.queue_timeout)
+        except asyncio.TimeoutError:
+            self._abandon(future)
+            self.timed_out += 1
+            raise LLMQueueTimeoutError(f"大模型请求排队超时（{timeout or self.queue_timeout}秒）")
+        except asyncio.CancelledError:
+            # 客户端在排队期间断开
+            self._abandon(future)
+            raise
+        finally:
+            self._queued[priority] -= 1
+        
+        return self._admit(priority, started)
+    
+    @asynccontextmanager
+    async def slot(self, priority: int = PRIORITY_QUESTION, timeout: Optional[float] = None):
+        """在名额内执行: async with scheduler.slot(priority): ..."""
+        ticket = await self.acquire(priority, timeout)
+        try:
+            yield ticket
+        finally:
+            ticket.release()
+    
+    def _admit(self, priority: int, started: float) -> LLMTicket:
+        """记录一次成功获得名额"""
+        wait_seconds = time.perf_counter() - started
+        self._wait_times.append(wait_seconds)
+        self.admitted += 1
+        return LLMTicket(self, priority, wait_seconds)
+    
+    def _abandon(self, future: asyncio.Future):
+        """放弃排队；名额恰好已分配时将其转交给下一个请求"""
+        if future.done() and not future.cancelled():
+            self._release()
+        else:
+            future.cancel()
+    
+    def _release(self):
+        """归还名额并唤醒队首请求"""
+        self._active -= 1
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if future.done():
+                continue  # 已超时或取消
+            self._active += 1
+            future.set_result(None)
+            break
+    
+    def _queue_depth(self) -> int:
+        """排队中的请求数"""
+        return sum(self._queued.values())
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """获取调度统计信息"""
+        waits = sorted(self._wait_times)
+        
+        def percentile(p: float) -> float:
+            if not waits:
+                return 0.0
+            return round(waits[min(len(waits) - 1, int(len(waits) * p))], 3)
+        
+        return {
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "queue_timeout": self.queue_timeout,
+            "active": self._active,
+            "queue_depth": self._queue_depth(),
+            "queued": {PRIORITY_NAMES.get(p, str(p)): count for p, count in self._queued.items()},
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "wait_seconds": {
+                "p50": percentile(0.5),
+                "p95": percentile(0.95),
+                "p99": percentile(0.99),
+                "max": round(waits[-1], 3) if waits else 0.0
+            }
+        }
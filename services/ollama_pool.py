@@ -0,0 +1,180 @@
+"""
+Ollama多节点连接池 - 按未完成请求数路由，后台健康检查，自动摘除故障节点
+"""
+import time
+import asyncio
+import itertools
+from typing import Dict, Any, Optional, Iterable
+import httpx
+import config
+
+class OllamaBackend:
+    """单个Ollama节点"""
+    
+    def __init__(self, host: str):
+        self.host = host.rstrip("/")
+        self._client: Optional[httpx.AsyncClient] = None
+        self.healthy = True
+        self.outstanding = 0  # 未完成的请求数
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.latency = None  # 请求耗时的指数移动平均（秒）
+        self.last_error: Optional[str] = None
+        self.last_probe: Optional[float] = None
+    
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """节点的异步HTTP客户端（首次使用时创建，长连接在请求之间复用）"""
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                base_url=self.host,
+                timeout=httpx.Timeout(
+                    config.OLLAMA_READ_TIMEOUT,
+                    connect=config.OLLAMA_CONNECT_TIMEOUT
+                ),
+                limits=httpx.Limits(
+                    max_connections=config.OLLAMA_MAX_CONNECTIONS,
+                    max_keepalive_connections=config.OLLAMA_MAX_CONNECTIONS
+                )
+            )
+        return self._client
+    
+    async def close(self):
+        """关闭连接"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+    
+    def record_success(self, seconds: float):
+        """记录一次成功请求"""
+        self.requests += 1
+        self.consecutive_failures = 0
+        self.latency = seconds if self.latency is None else 0.8 * self.latency + 0.2 * seconds
+    
+    def record_failure(self, error: Exception):
+        """记录一次失败请求，连续失败达到阈值时摘除节点"""
+        self.requests += 1
+        self.failures += 1
+        self.consecutive_failures += 1
+        self.last_error = str(error) or type(error).__name__
+        if self.healthy and self.consecutive_failures >= config.OLLAMA_EJECT_FAILURES:
+            self.healthy = False
+            print(f"⚠️ Ollama节点已摘除: {self.host}（连续失败 {self.consecutive_failures} 次）")
+    
+    async def probe(self, model: str) -> bool:
+        """健康检查：节点可访问且已加载指定模型"""
+        self.last_probe = time.time()
+        try:
+            response = await self.client.get("/api/tags", timeout=10)
+            if response.status_code != 200:
+                raise Exception(f"Ollama API错误: {response.status_code}")
+            models = response.json().get('models', [])
+            if not any(item['name'] == model for item in models):
+                raise Exception(f"节点未加载模型 {model}")
+        except Exception as e:
+            self.last_error = str(e) or type(e).__name__
+            if self.healthy:
+                self.healthy = False
+                print(f"⚠️ Ollama节点已摘除: {self.host}（{self.last_error}）")
+            return False
+        
+        self.consecutive_failures = 0
+        if not self.healthy:
+            self.healthy = True
+            print(f"✅ Ollama节点已恢复: {self.host}")
+        return True
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """获取节点统计信息"""
+        return {
+            "host": self.host,
+            "healthy": self.healthy,
+            "outstanding": self.outstanding,
+            "requests": self.requests,
+            "failures": self.failures,
+            "latency_ms": round(self.latency * 1000, 1) if self.latency is not None else None,
+            "last_error": self.last_error,
+            "last_probe": self.last_probe
+        }
+
+class OllamaPool:
+    """Ollama节点池
+    
+    请求路由到未完成请求数最少的健康节点；后台定期探测所有节点，
+    探测失败或连续请求失败的节点被摘除，探测恢复后重新加入。
+    所有节点都被摘除时仍会尝试这些节点，而不是直接拒绝请求。
+    """
+    
+    def __init__(self, hosts: Iterable[str]):
+        self.backends = [OllamaBackend(host) for host in hosts]
+        if not self.backends:
+            raise ValueError("至少需要配置一个Ollama节点")
+        self.health_interval = config.OLLAMA_HEALTH_INTERVAL
+        self.hedged = 0  # 发出的对冲请求数
+        self.hedge_wins = 0  # 对冲请求先于原请求返回的次数
+        self._round_robin = itertools.count()
+        self._health_task: Optional[asyncio.Task] = None
+    
+    def pick(self, exclude: Iterable[OllamaBackend] = (), prefer: Optional[str] = None) -> Optional[OllamaBackend]:
+        """选择未完成请求数最少的节点，排除exclude中的节点；没有可选节点时返回None
+        
+        prefer 为优先使用的节点地址（如会话上一轮使用的节点），该节点健康时直接返回。
+        """
+        excluded = set(exclude)
+        for backend in self.backends:
+            if backend.host == prefer and backend.healthy and backend not in excluded:
+                return backend
+        candidates = [b for b in self.backends if b.healthy and b not in excluded]
+        if not candidates:
+            candidates = [b for b in self.backends if b not in excluded]
+        if not candidates:
+            return None
+        least = min(b.outstanding for b in candidates)
+        candidates = [b for b in candidates if b.outstanding == least]
+        return candidates[next(self._round_robin) % len(candidates)]
+    
+    def healthy_count(self) -> int:
+        """健康节点数"""
+        return sum(1 for b in self.backends if b.healthy)
+    
+    async def probe_all(self, model: str) -> bool:
+        """探测所有节点，任一节点可用时返回True"""
+        results = await asyncio.gather(*(b.probe(model) for b in self.backends))
+        return any(results)
+    
+    def start_health_checks(self, model: str):
+        """启动后台健康检查（需要在事件循环中调用）"""
+        if self._health_task is None or self._health_task.done():
+            self._health_task = asyncio.get_running_loop().create_task(self._health_loop(model))
+    
+    async def _health_loop(self, model: str):
+        """定期探测所有节点"""
+        while True:
+            try:
+                await self.probe_all(model)
+            except Exception as e:
+                print(f"❌ Ollama健康检查失败: {e}")
+            await asyncio.sleep(self.health_interval)
+    
+    async def close(self):
+        """停止健康检查并关闭所有连接"""
+        if self._health_task is not None:
+            self._health_task.cancel()
+            try:
+                await self._health_task
+            except asyncio.CancelledError:
+                pass
+            self._health_task = None
+        for backend in self.backends:
+            await backend.close()
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """获取节点池统计信息"""
+        return {
+            "healthy": self.healthy_count(),
+            "total": len(self.backends),
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins,
+            "backends": [b.get_stats() for b in self.backends]
+        }
@@ -1,48 +1,211 @@
 """
 Ollama服务集成
 """
-import requests
+import time
+import httpx
 import json
-from typing import List, Dict, Any, Optional
+import asyncio
+from typing import List, Dict, Any, Optional, AsyncIterator, Tuple
+from services.ollama_pool import OllamaPool, OllamaBackend
+from services.chat_sessions import ChatSession
 import config
 
+class OllamaBackendError(Exception):
+    """节点故障（连接失败或5xx），可以换一个节点重试"""
+
 class OllamaService:
-    """Ollama服务管理器"""
+    """Ollama服务管理器
+    
+    使用异步HTTP客户端，连接池中的长连接在请求之间复用，
+    生成过程中不阻塞事件循环，多个生成请求可以同时进行。
+    可以配置多个Ollama节点，请求发往未完成请求数最少的健康节点，节点故障时换节点重试。
+    """
     
-    def __init__(self):
-        self.host = config.OLLAMA_HOST
+    def __init__(self, hosts: Optional[List[str]] = None):
+        self.pool = OllamaPool(hosts or config.OLLAMA_HOSTS)
+        self.host = self.pool.backends[0].host
         self.model = config.OLLAMA_MODEL
+        self.hedge_after = config.OLLAMA_HEDGE_AFTER
+    
+    def start_health_checks(self):
+        """启动节点后台健康检查"""
+        self.pool.start_health_checks(self.model)
+    
+    async def close(self):
+        """停止健康检查并关闭连接池"""
+        await self.pool.close()
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """获取节点池统计信息"""
+        return self.pool.get_stats()
+    
+    def _payload(self, prompt: str, stream: bool, context: Optional[List[int]] = None) -> Dict[str, Any]:
+        """生成接口的请求体，context 为上一轮返回的上下文"""
+        payload = {
+            "model": self.model,
+            "prompt": prompt,
+            "stream": stream,
+            "keep_alive": config.OLLAMA_KEEP_ALIVE,
+            "options": {
+                "temperature": 0.7,
+                "top_p": 0.9,
+                "max_tokens": 1000
+            }
+        }
+        if context:
+            payload["context"] = context
+        return payload
     
-    def generate_response(self, prompt: str, context: List[str] = None) -> str:
+    async def _generate(self, prompt: str, context: Optional[List[int]] = None,
+                        prefer: Optional[str] = None) -> Dict[str, Any]:
+        """调用Ollama生成接口，返回完整结果（回答、上下文、耗时统计和所用节点）
+        
+        节点故障时换一个未尝试过的节点重试；配置了 OLLAMA_HEDGE_AFTER 时，
+        请求超过该时间未返回会向另一节点发送对冲请求，采用先返回的结果。
+        """
+        payload = self._payload(prompt, False, context)
+        tried: List[OllamaBackend] = []
+        
+        while True:
+            backend = self.pool.pick(exclude=tried, prefer=prefer)
+            if backend is None:
+                raise Exception("没有可用的Ollama节点")
+            tried.append(backend)
+            
+            try:
+                return await self._generate_hedged(backend, payload, tried)
+            except OllamaBackendError as e:
+                if len(tried) >= len(self.pool.backends):
+                    raise e.__cause__ or e
+                print(f"⚠️ Ollama节点 {backend.host} 请求失败，切换节点重试: {e}")
+    
+    async def _generate_hedged(self, backend: OllamaBackend, payload: Dict[str, Any],
+                               tried: List[OllamaBackend]) -> Dict[str, Any]:
+        """在指定节点上生成，超过对冲阈值时再向另一节点发送同一请求"""
+        tasks = {asyncio.ensure_future(self._post_generate(backend, payload)): backend}
+        try:
+            if self.hedge_after and self.pool.healthy_count() > 1:
+                done, _ = await asyncio.wait(tasks, timeout=self.hedge_after)
+                hedge = None if done else self.pool.pick(exclude=tried)
+                if hedge is not None and hedge.healthy:
+                    tried.append(hedge)
+                    tasks[asyncio.ensure_future(self._post_generate(hedge, payload))] = hedge
+                    self.pool.hedged += 1
+            
+            error = None
+            while tasks:
+                done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    winner = tasks.pop(task)
+                    if task.exception() is None:
+                        if winner is not backend:
+                            self.pool.hedge_wins += 1
+                        return task.result()
+                    error = task.exception()
+                    if not isinstance(error, OllamaBackendError):
+                        raise error
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+    
+    async def _post_generate(self, backend: OllamaBackend, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """向单个节点发送非流式生成请求"""
+        started = time.perf_counter()
+        backend.outstanding += 1
+        try:
+            response = await backend.client.post("/api/generate", json=payload)
+        except httpx.HTTPError as e:
+            backend.record_failure(e)
+            raise OllamaBackendError(f"{backend.host}: {str(e) or type(e).__name__}") from e
+        finally:
+            backend.outstanding -= 1
+        
+        if response.status_code == 200:
+            backend.record_success(time.perf_counter() - started)
+            result = response.json()
+            result["backend"] = backend.host
+            return result
+        
+        error = Exception(f"Ollama API错误: {response.status_code}")
+        if response.status_code >= 500:
+            backend.record_failure(error)
+            raise OllamaBackendError(f"{backend.host}: {error}") from error
+        raise error
+    
+    async def _stream_generate(self, prompt: str, context: Optional[List[int]] = None, prefer: Optional[str] = None,
+                               final: Optional[Dict[str, Any]] = None) -> AsyncIterator[str]:
+        """调用Ollama流式生成接口，逐个返回生成的文本片段
+        
+        调用方停止迭代（如客户端断开）时关闭连接，Ollama随之停止生成。
+        节点在返回第一段内容之前故障时换节点重试，之后的故障直接抛出。
+        生成完成时最后一条消息（上下文、耗时统计）和所用节点写入 final。
+        """
+        payload = self._payload(prompt, True, context)
+        tried: List[OllamaBackend] = []
+        
+        while True:
+            backend = self.pool.pick(exclude=tried, prefer=prefer)
+            if backend is None:
+                raise Exception("没有可用的Ollama节点")
+            tried.append(backend)
+            
+            started = time.perf_counter()
+            yielded = False
+            backend.outstanding += 1
+            try:
+                async with backend.client.stream("POST", "/api/generate", json=payload) as response:
+                    if response.status_code >= 500:
+                        raise OllamaBackendError(f"Ollama API错误: {response.status_code}")
+                    if response.status_code != 200:
+                        raise Exception(f"Ollama API错误: {response.status_code}")
+                    
+                    async for line in response.aiter_lines():
+                        if not line:
+                            continue
+                        data = json.loads(line)
+                        if data.get('error'):
+                            raise Exception(f"Ollama API错误: {data['error']}")
+                        if data.get('response'):
+                            yielded = True
+                            yield data['response']
+                        if data.get('done'):
+                            if final is not None:
+                                final.update(data)
+                                final["backend"] = backend.host
+                            break
+                backend.record_success(time.perf_counter() - started)
+                return
+            except (httpx.HTTPError, OllamaBackendError) as e:
+                backend.record_failure(e)
+                if yielded or len(tried) >= len(self.pool.backends):
+                    raise
+                print(f"⚠️ Ollama节点 {backend.host} 请求失败，切换节点重试: {e}")
+            finally:
+                backend.outstanding -= 1
+    
+    async def generate_response(self, prompt: str, context: List[str] = None) -> str:
         """生成回答"""
         try:
             # 构建完整的提示词
             full_prompt = self._build_prompt(prompt, context)
             
             # 调用Ollama API
-            response = requests.post(
-                f"{self.host}/api/generate",
-                json={
-                    "model": self.model,
-                    "prompt": full_prompt,
-                    "stream": False,
-                    "options": {
-                        "temperature": 0.7,
-                        "top_p": 0.9,
-                        "max_tokens": 1000
-                    }
-                },
-                timeout=60
-            )
-            
-            if response.status_code == 200:
-                result = response.json()
-                return result.get('response', '抱歉，无法生成回答。')
-            else:
-                raise Exception(f"Ollama API错误: {response.status_code}")
+            result = await self._generate(full_prompt)
+            return result.get('response', '抱歉，无法生成回答。')
                 
-        except requests.exceptions.RequestException as e:
-            raise Exception(f"连接Ollama服务失败: {str(e)}")
+        except httpx.HTTPError as e:
+            raise Exception(f"连接Ollama服务失败: {str(e) or type(e).__name__}")
+        except Exception as e:
+            raise Exception(f"生成回答失败: {str(e)}")
+    
+    async def stream_response(self, prompt: str, context: List[str] = None) -> AsyncIterator[str]:
+        """流式生成回答"""
+        try:
+            async for token in self._stream_generate(self._build_prompt(prompt, context)):
+                yield token
+        except httpx.HTTPError as e:
+            raise Exception(f"连接Ollama服务失败: {str(e) or type(e).__name__}")
         except Exception as e:
             raise Exception(f"生成回答失败: {str(e)}")
     
@@ -60,52 +223,109 @@ class OllamaService:
         
         return prompt
     
-    def check_model_availability(self) -> bool:
-        """检查模型是否可用"""
+    async def check_model_availability(self) -> bool:
+        """检查模型是否可用（探测所有节点，任一节点可用即可）"""
         try:
-            response = requests.get(f"{self.host}/api/tags", timeout=10)
-            if response.status_code == 200:
-                models = response.json().get('models', [])
-                return any(model['name'] == self.model for model in models)
-            return False
+            return await self.pool.probe_all(self.model)
         except:
             return False
     
-    def chat_with_context(self, messages: List[Dict[str, str]], context: List[str] = None) -> str:
+    async def chat_with_context(self, messages: List[Dict[str, str]], context: List[str] = None) -> str:
         """支持多轮对话的聊天功能"""
         try:
-            # 构建对话历史
-            conversation = ""
-            for msg in messages[-5:]:  # 只保留最近5轮对话
-                role = msg.get('role', 'user')
-                content = msg.get('content', '')
-                conversation += f"{role}: {content}\n"
-            
-            # 添加上下文
-            if context:
-                conversation = "参考信息：\n" + "\n".join(context) + "\n\n" + conversation
-            
             # 生成回答
-            response = requests.post(
-                f"{self.host}/api/generate",
-                json={
-                    "model": self.model,
-                    "prompt": conversation + "assistant: ",
-                    "stream": False,
-                    "options": {
-                        "temperature": 0.7,
-                        "top_p": 0.9,
-                        "max_tokens": 1000
-                    }
-                },
-                timeout=60
-            )
-            
-            if response.status_code == 200:
-                result = response.json()
-                return result.get('response', '抱歉，无法生成回答。')
-            else:
-                raise Exception(f"Ollama API错误: {response.status_code}")
+            result = await self._generate(self._build_chat_prompt(messages, context))
+            return result.get('response', '抱歉，无法生成回答。')
                 
+        except httpx.HTTPError as e:
+            raise Exception(f"对话失败: 连接Ollama服务失败: {str(e) or type(e).__name__}")
         except Exception as e:
-            raise Exception(f"对话失败: {str(e)}") 
\ No newline at end of file
+            raise Exception(f"对话失败: {str(e)}")
+    
+    async def chat_with_session(self, session: ChatSession, messages: List[Dict[str, str]],
+                                context: List[str] = None) -> Dict[str, Any]:
+        """基于会话的多轮对话，返回 {answer, prompt_eval_count, prompt_eval_ms}
+        
+        会话中保存了上一轮Ollama返回的上下文时，只发送本轮的新消息和新的参考信息，
+        之前的对话不再重复处理。
+        """
+        try:
+            prompt, tokens = self._session_prompt(session, messages, context)
+            result = await self._generate(prompt, tokens, prefer=session.backend)
+            self._update_session(session, messages, result, context)
+            return {
+                "answer": result.get('response', '抱歉，无法生成回答。'),
+                **self._eval_stats(result)
+            }
+                
+        except httpx.HTTPError as e:
+            raise Exception(f"对话失败: 连接Ollama服务失败: {str(e) or type(e).__name__}")
+        except Exception as e:
+            raise Exception(f"对话失败: {str(e)}")
+    
+    async def stream_chat(self, messages: List[Dict[str, str]], context: List[str] = None,
+                          session: Optional[ChatSession] = None,
+                          final: Optional[Dict[str, Any]] = None) -> AsyncIterator[str]:
+        """流式多轮对话，指定会话时复用会话上下文，生成完成后的耗时统计写入 final"""
+        result: Dict[str, Any] = {}
+        if session is not None:
+            prompt, tokens = self._session_prompt(session, messages, context)
+        else:
+            prompt, tokens = self._build_chat_prompt(messages, context), None
+        
+        try:
+            async for token in self._stream_generate(prompt, tokens, session.backend if session else None, result):
+                yield token
+        except httpx.HTTPError as e:
+            raise Exception(f"对话失败: 连接Ollama服务失败: {str(e) or type(e).__name__}")
+        except Exception as e:
+            raise Exception(f"对话失败: {str(e)}")
+        
+        # 只有完整生成的轮次才更新会话，中途取消的轮次下次会重建上下文
+        if session is not None and result.get('done'):
+            self._update_session(session, messages, result, context)
+        if final is not None:
+            final.update(self._eval_stats(result))
+    
+    def _session_prompt(self, session: ChatSession, messages: List[Dict[str, str]],
+                        context: List[str] = None) -> Tuple[str, Optional[List[int]]]:
+        """构建会话本轮的提示词，返回 (提示词, 复用的上下文)"""
+        if not session.context or not messages:
+            return self._build_chat_prompt(messages, context), None
+        
+        prompt = ""
+        if context:
+            prompt = "参考信息：\n" + "\n".join(context) + "\n\n"
+        prompt += f"{messages[-1].get('role', 'user')}: {messages[-1].get('content', '')}\n"
+        return prompt + "assistant: ", session.context
+    
+    def _update_session(self, session: ChatSession, messages: List[Dict[str, str]], result: Dict[str, Any],
+                        context: List[str] = None):
+        """保存本轮返回的上下文，并记录本轮发送的参考分块"""
+        session.record_context(context)
+        session.context = result.get('context') or None
+        session.backend = result.get('backend')
+        session.turns = sum(1 for msg in messages if msg.get('role', 'user') == 'user')
+    
+    def _eval_stats(self, result: Dict[str, Any]) -> Dict[str, Any]:
+        """本轮提示词处理的token数和耗时"""
+        duration = result.get('prompt_eval_duration')
+        return {
+            "prompt_eval_count": result.get('prompt_eval_count'),
+            "prompt_eval_ms": round(duration / 1e6, 1) if duration else None
+        }
+    
+    def _build_chat_prompt(self, messages: List[Dict[str, str]], context: List[str] = None) -> str:
+        """构建多轮对话提示词"""
+        # 构建对话历史
+        conversation = ""
+        for msg in messages[-5:]:  # 只保留最近5轮对话
+            role = msg.get('role', 'user')
+            content = msg.get('content', '')
+            conversation += f"{role}: {content}\n"
+        
+        # 添加上下文
+        if context:
+            conversation = "参考信息：\n" + "\n".join(context) + "\n\n" + conversation
+        
+        return conversation + "assistant: " 
\ No newline at end of file
@@ -0,0 +1,96 @@
+"""
+后台服务加载 - 应用启动时不等待知识库加载，存活检查立即可用，加载和预热完成后才报告就绪
+"""
+import time
+import threading
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Any
+
+@dataclass
+class StartupStep:
+    """启动步骤"""
+    name: str
+    func: Callable[[], Any]
+    status: str = "pending"  # pending / running / done / failed
+    seconds: Optional[float] = None
+    error: Optional[str] = None
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """转换为接口返回格式"""
+        return {
+            "name": self.name,
+            "status": self.status,
+            "seconds": self.seconds,
+            "error": self.error
+        }
+
+class ServiceLoader:
+    """在后台线程中按顺序执行启动步骤
+    
+    全部步骤完成后标记就绪；任一步骤失败时停止执行，状态为 failed，
+    进程仍然存活，由就绪检查报告失败原因。
+    """
+    
+    def __init__(self):
+        self.started_at = time.time()
+        self.status = "pending"  # pending / loading / ready / failed
+        self.ready_at: Optional[float] = None
+        self.error: Optional[str] = None
+        self._steps: List[StartupStep] = []
+        self._ready = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+    
+    def add_step(self, name: str, func: Callable[[], Any]):
+        """添加启动步骤（在start之前调用）"""
+        self._steps.append(StartupStep(name, func))
+    
+    def start(self):
+        """启动后台加载线程，重复调用无效"""
+        if self._thread is not None:
+            return
+        self.status = "loading"
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+    
+    def _run(self):
+        """依次执行所有步骤"""
+        for step in self._steps:
+            step.status = "running"
+            started = time.perf_counter()
+            try:
+                step.func()
+                step.status = "done"
+            except Exception as e:
+                step.status = "failed"
+                step.error = str(e)
+                self.error = f"{step.name}: {str(e)}"
+                self.status = "failed"
+                print(f"❌ 服务加载失败（{step.name}）: {e}")
+                return
+            finally:
+                step.seconds = round(time.perf_counter() - started, 3)
+            print(f"✅ 启动步骤完成: {step.name}（{step.seconds} 秒）")
+        
+        self.ready_at = time.time()
+        self.status = "ready"
+        self._ready.set()
+        print(f"✅ 服务已就绪，启动耗时 {self.ready_at - self.started_at:.1f} 秒")
+    
+    @property
+    def ready(self) -> bool:
+        """是否已就绪"""
+        return self._ready.is_set()
+    
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """等待就绪，返回是否已就绪"""
+        return self._ready.wait(timeout)
+    
+    def get_status(self) -> Dict[str, Any]:
+        """获取加载状态"""
+        return {
+            "status": self.status,
+            "uptime_seconds": round(time.time() - self.started_at, 3),
+            "startup_seconds": round(self.ready_at - self.started_at, 3) if self.ready_at else None,
+            "error": self.error,
+            "steps": [step.to_dict() for step in self._steps]
+        }
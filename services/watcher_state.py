@@ -0,0 +1,101 @@
+"""
+文件夹监控状态持久化 - 重启后无需重新导入整个语料库
+"""
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Dict, Any, Optional
+
+class WatcherStateStore:
+    """监控文件状态表（SQLite）
+    
+    记录 文件相对路径 -> (大小, 修改时间, 内容哈希, 文档ID)，
+    路径相对于监控目录保存，索引可以在其他机器上预先构建后拷贝使用。
+    """
+    
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._batch_depth = 0  # 进行中的批量写入数，大于0时写入不单独提交
+        
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS watched_files (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                hash TEXT NOT NULL,
+                document_id TEXT NOT NULL
+            )
+        """)
+        self.conn.commit()
+    
+    @contextmanager
+    def batch(self):
+        """批量写入：期间的写入不单独提交，结束时一次提交
+        
+        可以嵌套，每一层结束时都提交已写入的内容（导入的检查点在内层提交，不必等整次扫描结束）。
+        """
+        with self._lock:
+            self._batch_depth += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._batch_depth -= 1
+                self.conn.commit()
+    
+    def _commit(self):
+        """提交写入（批量写入期间推迟到批量结束时）"""
+        if not self._batch_depth:
+            self.conn.commit()
+    
+    def load_all(self) -> Dict[str, Dict[str, Any]]:
+        """读取全部文件状态"""
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT path, size, mtime_ns, hash, document_id FROM watched_files"
+            ).fetchall()
+        return {
+            path: {"size": size, "mtime_ns": mtime_ns, "hash": file_hash, "document_id": document_id}
+            for path, size, mtime_ns, file_hash, document_id in rows
+        }
+    
+    def get(self, path: str) -> Optional[Dict[str, Any]]:
+        """读取单个文件状态"""
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT size, mtime_ns, hash, document_id FROM watched_files WHERE path = ?",
+                (path,)
+            ).fetchone()
+        if row is None:
+            return None
+        size, mtime_ns, file_hash, document_id = row
+        return {"size": size, "mtime_ns": mtime_ns, "hash": file_hash, "document_id": document_id}
+    
+    def upsert(self, path: str, size: int, mtime_ns: int, file_hash: str, document_id: str):
+        """写入或更新文件状态"""
+        with self._lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO watched_files (path, size, mtime_ns, hash, document_id) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (path, size, mtime_ns, file_hash, document_id)
+            )
+            self._commit()
+    
+    def delete(self, path: str):
+        """删除文件状态"""
+        with self._lock:
+            self.conn.execute("DELETE FROM watched_files WHERE path = ?", (path,))
+            self._commit()
+    
+    def clear(self):
+        """清空全部状态"""
+        with self._lock:
+            self.conn.execute("DELETE FROM watched_files")
+            self.conn.commit()
@@ -0,0 +1,182 @@
+"""
+Ollama节点池测试 - 使用本地桩HTTP服务器模拟多个Ollama节点
+"""
+import json
+import time
+import asyncio
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+import config
+from services.ollama_pool import OllamaPool
+from services.ollama_service import OllamaService
+
+MODEL = "stub-model"
+
+class StubOllama:
+    """本地桩Ollama节点：/api/tags 返回已加载的模型，/api/generate 按设定的延迟和状态码返回"""
+    
+    def __init__(self):
+        self.delay = 0.0  # 生成请求的响应延迟（秒）
+        self.status = 200  # 生成请求和健康检查返回的状态码
+        self.generate_calls = 0
+        stub = self
+        
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == "/api/tags":
+                    self._reply(stub.status, {"models": [{"name": MODEL}]})
+                else:
+                    self._reply(404, {"error": "not found"})
+            
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if self.path != "/api/generate":
+                    self._reply(404, {"error": "not found"})
+                    return
+                stub.generate_calls += 1
+                time.sleep(stub.delay)
+                prompt = json.loads(body).get("prompt", "")
+                self._reply(stub.status, {"response": f"echo: {prompt}", "context": [1, 2, 3], "done": True})
+            
+            def _reply(self, status, data):
+                payload = json.dumps(data).encode("utf-8")
+                try:
+                    self.send_response(status)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(payload)))
+                    self.end_headers()
+                    self.wfile.write(payload)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # 对冲请求胜出后，落后的请求已被客户端取消
+            
+            def log_message(self, format, *args):
+                pass
+        
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+    
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+@pytest.fixture
+def stubs():
+    servers = [StubOllama(), StubOllama()]
+    yield servers
+    for server in servers:
+        server.stop()
+
+@pytest.fixture(autouse=True)
+def stub_config(monkeypatch):
+    monkeypatch.setattr(config, "OLLAMA_MODEL", MODEL)
+    monkeypatch.setattr(config, "OLLAMA_EJECT_FAILURES", 2)
+    monkeypatch.setattr(config, "OLLAMA_HEDGE_AFTER", None)
+
+def test_routes_to_least_outstanding_backend(stubs):
+    """节点上有未完成的请求时，新请求发往另一个节点"""
+    slow, idle = stubs
+    slow.delay = 0.5
+    
+    async def run():
+        service = OllamaService([slow.url, idle.url])
+        try:
+            first = asyncio.ensure_future(service._generate("第一个"))
+            while service.pool.backends[0].outstanding == 0:
+                await asyncio.sleep(0.01)
+            second = await service._generate("第二个")
+            return await first, second
+        finally:
+            await service.close()
+    
+    first, second = asyncio.run(run())
+    assert first["backend"] == slow.url
+    assert second["backend"] == idle.url
+    assert (slow.generate_calls, idle.generate_calls) == (1, 1)
+
+def test_pick_prefers_fewest_outstanding():
+    """pick 在健康节点中选择未完成请求数最少的节点"""
+    pool = OllamaPool(["http://a", "http://b", "http://c"])
+    a, b, c = pool.backends
+    a.outstanding, b.outstanding, c.outstanding = 2, 0, 1
+    assert pool.pick() is b
+    assert pool.pick(exclude=[b]) is c
+    b.healthy = False
+    assert pool.pick() is c
+
+def test_failing_backend_is_ejected_and_recovers(stubs):
+    """连续失败的节点被摘除，请求改发其他节点；健康检查通过后节点恢复"""
+    broken, healthy = stubs
+    broken.status = 500
+    
+    async def run():
+        service = OllamaService([broken.url, healthy.url])
+        pool = service.pool
+        bad = pool.backends[0]
+        try:
+            for _ in range(config.OLLAMA_EJECT_FAILURES):
+                result = await service._generate("问题", prefer=broken.url)
+                assert result["backend"] == healthy.url
+            assert not bad.healthy
+            assert pool.healthy_count() == 1
+            
+            calls = broken.generate_calls
+            for _ in range(3):
+                assert (await service._generate("问题"))["backend"] == healthy.url
+            assert broken.generate_calls == calls
+            
+            assert await pool.probe_all(MODEL)
+            assert not bad.healthy
+            
+            broken.status = 200
+            assert await pool.probe_all(MODEL)
+            assert bad.healthy and bad.consecutive_failures == 0
+            return await service._generate("问题", prefer=broken.url)
+        finally:
+            await service.close()
+    
+    result = asyncio.run(run())
+    assert result["backend"] == broken.url
+
+def test_hedged_request_goes_to_another_backend(stubs, monkeypatch):
+    """请求超过对冲阈值未返回时，同一请求发往另一个节点并采用先返回的结果"""
+    slow, fast = stubs
+    slow.delay = 1.0
+    monkeypatch.setattr(config, "OLLAMA_HEDGE_AFTER", 0.1)
+    
+    async def run():
+        service = OllamaService([slow.url, fast.url])
+        try:
+            result = await service._generate("问题", prefer=slow.url)
+            return result, service.get_stats()
+        finally:
+            await service.close()
+    
+    result, stats = asyncio.run(run())
+    assert result["backend"] == fast.url
+    assert result["response"] == "echo: 问题"
+    assert (slow.generate_calls, fast.generate_calls) == (1, 1)
+    assert stats["hedged"] == 1
+    assert stats["hedge_wins"] == 1
+
+def test_no_hedge_with_single_healthy_backend(stubs, monkeypatch):
+    """只有一个健康节点时不发送对冲请求"""
+    slow, other = stubs
+    slow.delay = 0.3
+    monkeypatch.setattr(config, "OLLAMA_HEDGE_AFTER", 0.05)
+    
+    async def run():
+        service = OllamaService([slow.url, other.url])
+        service.pool.backends[1].healthy = False
+        try:
+            return await service._generate("问题"), service.get_stats()
+        finally:
+            await service.close()
+    
+    result, stats = asyncio.run(run())
+    assert result["backend"] == slow.url
+    assert other.generate_calls == 0
+    assert stats["hedged"] == 0